@@ -2,6 +2,7 @@ import os
 import json
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import inspect, text
 from celery import Celery
 from config import Config
 
@@ -32,6 +33,10 @@ def create_app():
     # Initialiser les extensions avec l'application
     db.init_app(app)
 
+    # Réglages des connexions (pragmas SQLite) et réponse 503 aux écritures refusées pour verrou
+    from . import database
+    database.init_app(app)
+
     # Mettre à jour la configuration de Celery (conserve les autres paramètres de Flask)
     celery.conf.update(app.config)
 
@@ -41,9 +46,63 @@ def create_app():
     app.register_blueprint(files_bp, url_prefix='/api')
     app.register_blueprint(admin_bp, url_prefix='/admin')
 
+    # Journal d'audit écrit par lots en arrière-plan
+    from . import audit
+    audit.init_app(app)
+
+    # File d'écriture unique, optionnelle (DB_WRITE_QUEUE_ENABLED)
+    from . import writes
+    writes.init_app(app)
+
+    # Métriques Prometheus (/metrics) et instrumentation des requêtes
+    from . import metrics
+    metrics.init_app(app)
+
+    # Réglages modifiables à chaud (config.json), lus depuis le cache mémoire du processus
+    from .settings import apply_runtime_config
+    app.before_request(apply_runtime_config)
+
     # Le service 'web' est le seul responsable de la création de la BDD
     if os.environ.get('ROLE') != 'background':
-        with app.app_context():
+        with app.app_context(), database.schema_lock():
             db.create_all()
+            added_columns = upgrade_schema()
+            if ('item', 'child_count') in added_columns:
+                from .tree import rebuild_child_counts
+                rebuild_child_counts()
+                db.session.commit()
+            if ('item', 'file_count') in added_columns:
+                from .tree import rebuild_rollups
+                rebuild_rollups()
+                db.session.commit()
+            database.widen_integer_columns()
+            database.create_dialect_indexes()
+            from .search import init_search_index
+            init_search_index()
+
+    return app
+
 
-    return app
\ No newline at end of file
+def upgrade_schema():
+    """
+    Ajoute aux tables existantes les colonnes et index apparus depuis leur création,
+    db.create_all() ne modifiant jamais une table déjà présente.
+    Retourne l'ensemble des couples (table, colonne) ajoutés, pour les éventuels remplissages initiaux.
+    """
+    added_columns = set()
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing_columns:
+                continue
+            column_type = column.type.compile(dialect=db.engine.dialect)
+            default = f" DEFAULT {column.server_default.arg}" if column.server_default is not None else ""
+            db.session.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}{default}'))
+            added_columns.add((table.name, column.name))
+        db.session.commit()
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+    return added_columns
\ No newline at end of file
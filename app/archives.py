@@ -0,0 +1,249 @@
+import os
+import struct
+import calendar
+import tarfile
+import zlib
+from collections import namedtuple
+from flask import Response, current_app
+from . import db
+from .models import Item, Blob
+from .blobs import item_object
+from .compression import COMPRESSED_EXTENSIONS, read_content
+
+# Élément d'une archive : chemin dans l'archive, objet stocké source (None pour un dossier), taille d'origine, date
+# et codec de stockage du fichier source
+ArchiveEntry = namedtuple('ArchiveEntry', ['name', 'source', 'size', 'mtime', 'codec'])
+
+ARCHIVE_MIMETYPES = {'zip': 'application/zip', 'tar': 'application/x-tar'}
+
+ZIP_STORED = 0
+ZIP_DEFLATED = 8
+ZIP64_LIMIT = 0xFFFFFFFF
+ZIP_FLAG_DATA_DESCRIPTOR = 0x08
+ZIP_FLAG_UTF8 = 0x800
+TAR_BLOCK_SIZE = 512
+
+
+def directory_entries(directory):
+    """
+    Liste le contenu d'un dossier (sous-dossiers compris), parents avant enfants, sans lire les fichiers.
+    Seuls les fichiers locaux absents sont exclus : vérifier un objet distant coûterait une requête par fichier
+    avant le premier octet, son absence n'est donc constatée qu'à la lecture (voir _read_file).
+    """
+    rows = db.session.query(Item.path, Item.item_type, Item.size_bytes, Item.created_at, Item.blob_id, Item.sha256,
+                            Blob.codec, Blob.volume) \
+        .outerjoin(Blob, Item.blob_id == Blob.id) \
+        .filter(Item.path.startswith(f"{directory.path}/", autoescape=True)) \
+        .order_by(Item.path.asc())
+
+    entries = [ArchiveEntry(directory.name, None, 0, directory.created_at, None)]
+    for row in rows:
+        name = directory.name + row.path[len(directory.path):]
+        if row.item_type == 'directory':
+            entries.append(ArchiveEntry(name, None, 0, row.created_at, None))
+            continue
+        source = item_object(row, row.volume)
+        if source.local_path is not None and not source.exists():
+            current_app.logger.warning(f"Fichier '{row.path}' introuvable dans le stockage, exclu de l'archive.")
+            continue
+        entries.append(ArchiveEntry(name, source, row.size_bytes or 0, row.created_at, row.codec))
+    return entries
+
+
+def _read_file(entry):
+    """
+    Lit exactement `entry.size` octets par blocs : la taille annoncée dans l'archive doit être respectée.
+    Un fichier disparu du stockage interrompt l'archive, déjà en partie envoyée : le client la reçoit incomplète.
+    """
+    remaining = entry.size
+    try:
+        for block in read_content(entry.source, entry.codec, 0, entry.size):
+            remaining -= len(block)
+            yield block
+    except FileNotFoundError:
+        raise IOError(f"Fichier '{entry.name}' introuvable dans le stockage, archive interrompue.")
+    if remaining > 0:
+        raise IOError(f"Fichier '{entry.name}' plus court que sa taille enregistrée.")
+
+
+# --- ZIP ---
+
+
+def _zip_method(entry, compress):
+    if not compress or entry.source is None or entry.size == 0:
+        return ZIP_STORED
+    if os.path.splitext(entry.name)[1].lower() in COMPRESSED_EXTENSIONS:
+        return ZIP_STORED
+    return ZIP_DEFLATED
+
+
+def _zip_needs_zip64(entry, method):
+    # Des données incompressibles peuvent légèrement grossir une fois « compressées »
+    margin = entry.size // 1000 + 1024 if method == ZIP_DEFLATED else 0
+    return entry.size + margin >= ZIP64_LIMIT
+
+
+def _zip_entry_name(entry):
+    return (entry.name + '/' if entry.source is None else entry.name).encode('utf-8')
+
+
+def _zip_flags(entry):
+    # Fichiers : CRC et tailles sont écrits après les données (descripteur), une fois calculés au fil de l'eau
+    return ZIP_FLAG_UTF8 if entry.source is None else ZIP_FLAG_UTF8 | ZIP_FLAG_DATA_DESCRIPTOR
+
+
+def _dos_datetime(dt):
+    if dt is None or dt.year < 1980:
+        return 0, (1 << 5) | 1
+    return (dt.hour << 11) | (dt.minute << 5) | (dt.second // 2), ((dt.year - 1980) << 9) | (dt.month << 5) | dt.day
+
+
+def _zip_local_header(entry, method, zip64):
+    name = _zip_entry_name(entry)
+    dos_time, dos_date = _dos_datetime(entry.mtime)
+    extra = struct.pack('<HHQQ', 0x0001, 16, 0, 0) if zip64 else b''
+    size_field = ZIP64_LIMIT if zip64 else 0
+    return struct.pack('<IHHHHHIIIHH', 0x04034b50, 45 if zip64 else 20, _zip_flags(entry), method,
+                       dos_time, dos_date, 0, size_field, size_field, len(name), len(extra)) + name + extra
+
+
+def _zip_data_descriptor(crc, compressed_size, size, zip64):
+    if zip64:
+        return struct.pack('<IIQQ', 0x08074b50, crc, compressed_size, size)
+    return struct.pack('<IIII', 0x08074b50, crc, compressed_size, size)
+
+
+def _zip_central_header(entry, method, zip64, crc, compressed_size, offset):
+    name = _zip_entry_name(entry)
+    dos_time, dos_date = _dos_datetime(entry.mtime)
+    zip64_fields = [entry.size, compressed_size] if zip64 else []
+    if offset >= ZIP64_LIMIT:
+        zip64_fields.append(offset)
+    extra = b''
+    if zip64_fields:
+        extra = struct.pack(f'<HH{len(zip64_fields)}Q', 0x0001, 8 * len(zip64_fields), *zip64_fields)
+    if entry.source is None:
+        external_attr = (0o40755 << 16) | 0x10
+    else:
+        external_attr = 0o100644 << 16
+    version = 45 if zip64_fields else 20
+    return struct.pack('<IHHHHHHIIIHHHHHII', 0x02014b50, (3 << 8) | version, version, _zip_flags(entry), method,
+                       dos_time, dos_date, crc,
+                       ZIP64_LIMIT if zip64 else compressed_size, ZIP64_LIMIT if zip64 else entry.size,
+                       len(name), len(extra), 0, 0, 0, external_attr, min(offset, ZIP64_LIMIT)) + name + extra
+
+
+def _zip_end_records(count, cd_offset, cd_size):
+    records = b''
+    if count >= 0xFFFF or cd_offset >= ZIP64_LIMIT or cd_size >= ZIP64_LIMIT:
+        records += struct.pack('<IQHHIIQQQQ', 0x06064b50, 44, 45, 45, 0, 0, count, count, cd_size, cd_offset)
+        records += struct.pack('<IIQI', 0x07064b50, 0, cd_offset + cd_size, 1)
+        count, cd_offset, cd_size = min(count, 0xFFFF), min(cd_offset, ZIP64_LIMIT), min(cd_size, ZIP64_LIMIT)
+    return records + struct.pack('<IHHHHIIH', 0x06054b50, 0, 0, count, count, cd_size, cd_offset, 0)
+
+
+def zip_content_length(entries):
+    """Taille exacte d'une archive ZIP sans compression, calculée à partir des seules métadonnées."""
+    offset = 0
+    cd_size = 0
+    for entry in entries:
+        zip64 = _zip_needs_zip64(entry, ZIP_STORED)
+        cd_size += len(_zip_central_header(entry, ZIP_STORED, zip64, 0, entry.size, offset))
+        offset += len(_zip_local_header(entry, ZIP_STORED, zip64))
+        if entry.source is not None:
+            offset += entry.size + len(_zip_data_descriptor(0, entry.size, entry.size, zip64))
+    return offset + cd_size + len(_zip_end_records(len(entries), offset, cd_size))
+
+
+def stream_zip(entries, compress=False):
+    """
+    Génère une archive ZIP bloc par bloc, en mémoire constante.
+    Le CRC et la taille compressée de chaque fichier sont calculés pendant la lecture puis écrits
+    dans un descripteur de données, ce qui évite tout retour en arrière dans le flux.
+    """
+    offset = 0
+    central_headers = []
+    for entry in entries:
+        method = _zip_method(entry, compress)
+        zip64 = _zip_needs_zip64(entry, method)
+        header = _zip_local_header(entry, method, zip64)
+        yield header
+
+        crc = 0
+        compressed_size = 0
+        descriptor = b''
+        if entry.source is not None:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, -15) if method == ZIP_DEFLATED else None
+            for block in _read_file(entry):
+                crc = zlib.crc32(block, crc)
+                if compressor is not None:
+                    block = compressor.compress(block)
+                if block:
+                    compressed_size += len(block)
+                    yield block
+            if compressor is not None:
+                block = compressor.flush()
+                compressed_size += len(block)
+                yield block
+            descriptor = _zip_data_descriptor(crc, compressed_size, entry.size, zip64)
+            yield descriptor
+
+        central_headers.append(_zip_central_header(entry, method, zip64, crc, compressed_size, offset))
+        offset += len(header) + compressed_size + len(descriptor)
+
+    cd_size = sum(len(header) for header in central_headers)
+    yield b''.join(central_headers)
+    yield _zip_end_records(len(central_headers), offset, cd_size)
+
+
+# --- TAR ---
+
+
+def _tar_header(entry):
+    info = tarfile.TarInfo(entry.name)
+    if entry.source is None:
+        info.type = tarfile.DIRTYPE
+        info.mode = 0o755
+    else:
+        info.size = entry.size
+        info.mode = 0o644
+    info.mtime = calendar.timegm(entry.mtime.utctimetuple()) if entry.mtime else 0
+    return info.tobuf(tarfile.PAX_FORMAT, 'utf-8', 'surrogateescape')
+
+
+def tar_content_length(entries):
+    """Taille exacte d'une archive TAR, calculée à partir des seules métadonnées."""
+    length = 2 * TAR_BLOCK_SIZE
+    for entry in entries:
+        length += len(_tar_header(entry)) + entry.size + (-entry.size % TAR_BLOCK_SIZE)
+    return length
+
+
+def stream_tar(entries):
+    """Génère une archive TAR (format PAX) bloc par bloc, en mémoire constante."""
+    for entry in entries:
+        yield _tar_header(entry)
+        if entry.source is not None:
+            yield from _read_file(entry)
+            yield b'\0' * (-entry.size % TAR_BLOCK_SIZE)
+    yield b'\0' * (2 * TAR_BLOCK_SIZE)
+
+
+def send_directory_archive(directory, archive_format, compress=False):
+    """
+    Sert un dossier sous forme d'archive générée pendant l'envoi, sans fichier temporaire.
+    La taille exacte est annoncée sauf pour un ZIP compressé, dont elle n'est connue qu'à la fin.
+    """
+    entries = directory_entries(directory)
+    if archive_format == 'zip':
+        body = stream_zip(entries, compress)
+        content_length = None if compress else zip_content_length(entries)
+    else:
+        body = stream_tar(entries)
+        content_length = tar_content_length(entries)
+
+    response = Response(body, mimetype=ARCHIVE_MIMETYPES[archive_format], direct_passthrough=True)
+    response.headers.set('Content-Disposition', 'attachment', filename=f"{directory.name}.{archive_format}")
+    if content_length is not None:
+        response.headers['Content-Length'] = str(content_length)
+    return response
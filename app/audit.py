@@ -0,0 +1,162 @@
+import os
+import json
+import time
+import atexit
+import threading
+from collections import deque
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import insert
+from . import db
+from .models import Log
+from .utils import get_redis
+
+# File Redis partagée par tous les processus (mode 'redis')
+AUDIT_QUEUE_KEY = 'dropzone:audit'
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_buffer = deque()
+_state = {'app': None, 'flusher_pid': None}
+_stats = {'enqueued': 0, 'flushed': 0, 'dropped': 0, 'flush_errors': 0, 'last_flush_ms': None}
+
+
+def init_app(app):
+    """Mémorise l'application utilisée par le thread d'écriture en arrière-plan."""
+    _state['app'] = app
+
+
+def log_event(action, details):
+    """
+    Journalise un événement sans jamais participer à la transaction de l'appelant.
+    Selon AUDIT_LOG_DURABILITY :
+    - 'sync' : insertion et commit immédiats (comportement historique) ;
+    - 'buffered' : file en mémoire du processus, écrite par lots en arrière-plan ;
+    - 'redis' : file Redis partagée, qui survit au redémarrage d'un worker.
+    """
+    durability = current_app.config['AUDIT_LOG_DURABILITY']
+    event = {'timestamp': datetime.utcnow(), 'action': action, 'details': details}
+
+    if durability == 'sync':
+        db.session.add(Log(**event))
+        db.session.commit()
+        return
+
+    _ensure_flusher()
+    if durability == 'redis':
+        try:
+            get_redis().rpush(AUDIT_QUEUE_KEY, json.dumps({**event, 'timestamp': event['timestamp'].isoformat()}))
+            with _lock:
+                _stats['enqueued'] += 1
+            return
+        except Exception:
+            # Redis indisponible : repli sur la file en mémoire
+            pass
+
+    with _lock:
+        if len(_buffer) >= current_app.config['AUDIT_LOG_QUEUE_SIZE']:
+            # File pleine : l'écriture prend du retard sur la production, l'événement est abandonné
+            _stats['dropped'] += 1
+            _wakeup.set()
+            return
+        _buffer.append(event)
+        _stats['enqueued'] += 1
+        if len(_buffer) >= current_app.config['AUDIT_LOG_BATCH_SIZE']:
+            _wakeup.set()
+
+
+def _take_batch(batch_size):
+    """Retire un lot d'événements de la file en mémoire, complété par la file Redis si elle est utilisée."""
+    with _lock:
+        batch = [_buffer.popleft() for _ in range(min(batch_size, len(_buffer)))]
+
+    if current_app.config['AUDIT_LOG_DURABILITY'] == 'redis' and len(batch) < batch_size:
+        try:
+            raw_events = get_redis().lpop(AUDIT_QUEUE_KEY, batch_size - len(batch)) or []
+        except Exception:
+            raw_events = []
+        for raw in raw_events:
+            event = json.loads(raw)
+            event['timestamp'] = datetime.fromisoformat(event['timestamp'])
+            batch.append(event)
+    return batch
+
+
+def flush():
+    """Écrit les événements en attente par insertions groupées ; retourne le nombre de lignes écrites."""
+    batch_size = current_app.config['AUDIT_LOG_BATCH_SIZE']
+    written = 0
+    while True:
+        batch = _take_batch(batch_size)
+        if not batch:
+            return written
+
+        started = time.monotonic()
+        try:
+            db.session.execute(insert(Log), batch)
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            # Base indisponible (ex. verrouillée) : le lot est remis en tête de file pour le prochain passage
+            with _lock:
+                _buffer.extendleft(reversed(batch))
+                _stats['flush_errors'] += 1
+            current_app.logger.warning(f"Écriture du journal d'audit différée: {e}")
+            return written
+
+        written += len(batch)
+        with _lock:
+            _stats['flushed'] += len(batch)
+            _stats['last_flush_ms'] = round((time.monotonic() - started) * 1000, 2)
+        if len(batch) < batch_size:
+            return written
+
+
+def _flush_loop():
+    while True:
+        app = _state['app']
+        _wakeup.wait(app.config['AUDIT_LOG_FLUSH_SECONDS'])
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                flush()
+            except Exception as e:
+                app.logger.error(f"Erreur du thread d'écriture du journal d'audit: {e}")
+
+
+def _flush_at_exit():
+    app = _state['app']
+    if app is not None and _state['flusher_pid'] == os.getpid():
+        with app.app_context():
+            flush()
+
+
+def _ensure_flusher():
+    """Démarre le thread d'écriture une fois par processus (y compris après un fork de gunicorn)."""
+    pid = os.getpid()
+    if _state['flusher_pid'] == pid:
+        return
+    with _lock:
+        if _state['flusher_pid'] == pid:
+            return
+        _state['flusher_pid'] = pid
+        # Événements hérités du processus parent : ils seront écrits par celui-ci
+        _buffer.clear()
+    if _state['app'] is None:
+        _state['app'] = current_app._get_current_object()
+    threading.Thread(target=_flush_loop, name='audit-flusher', daemon=True).start()
+    atexit.register(_flush_at_exit)
+
+
+def get_stats():
+    """Retourne les compteurs de la file d'audit de ce processus."""
+    with _lock:
+        stats = dict(_stats, queued=len(_buffer))
+    stats['durability'] = current_app.config['AUDIT_LOG_DURABILITY']
+    stats['max_queue'] = current_app.config['AUDIT_LOG_QUEUE_SIZE']
+    if stats['durability'] == 'redis':
+        try:
+            stats['redis_queued'] = get_redis().llen(AUDIT_QUEUE_KEY)
+        except Exception:
+            stats['redis_queued'] = None
+    return stats
@@ -0,0 +1,167 @@
+import os
+from collections import Counter
+from flask import current_app
+from sqlalchemy.exc import IntegrityError
+from . import db
+from .models import Item, Blob
+from .compression import choose_codec, compress_file
+from .storage import LocalObject, choose_volume, get_volume, volume_column
+
+# Préfixé d'un point : secure_filename() empêche tout item utilisateur de porter ce nom
+BLOB_DIRNAME = '.blobs'
+
+
+def blob_folder():
+    """Retourne la racine du stockage par empreinte."""
+    return os.path.join(current_app.config['UPLOAD_FOLDER'], BLOB_DIRNAME)
+
+
+def blob_key(sha256):
+    """Retourne la clé d'un contenu dans son volume, à partir de son SHA-256."""
+    return f"{sha256[:2]}/{sha256}"
+
+
+def blob_object(sha256, volume=None):
+    """Retourne l'objet stocké d'un contenu (`volume` : valeur de Blob.volume)."""
+    return get_volume(volume).object(blob_key(sha256))
+
+
+def legacy_object(path):
+    """Retourne l'objet stocké d'un ancien fichier, rangé à `path` dans le dossier d'upload."""
+    return LocalObject(os.path.join(current_app.config['UPLOAD_FOLDER'], path))
+
+
+def item_object(item, volume=None):
+    """
+    Retourne l'objet stocké d'un fichier : son blob, ou son ancien emplacement à `item.path`.
+    Pour un Item, l'empreinte et le volume sont lus sur son blob ; une ligne de résultat doit fournir `volume`.
+    """
+    if not item.blob_id:
+        return legacy_object(item.path)
+    if isinstance(item, Item):
+        return blob_object(item.blob.sha256, item.blob.volume)
+    return blob_object(item.sha256, volume)
+
+
+def item_codec(item):
+    """Retourne le codec de stockage d'un fichier (None : stocké tel quel)."""
+    return item.blob.codec if item.blob_id else None
+
+
+def find_blob(sha256):
+    """Retourne le blob correspondant à une empreinte s'il est présent dans son volume, sinon None."""
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob is None or not blob_object(sha256, blob.volume).exists():
+        return None
+    return blob
+
+
+def acquire_blob(blob):
+    """
+    Ajoute une référence à un blob existant (à committer avec l'item qui le référence) et le retourne.
+    Retourne None si le blob a été supprimé entre-temps par la libération de sa dernière référence.
+    """
+    acquired = Blob.query.filter_by(id=blob.id).update({Blob.ref_count: Blob.ref_count + 1},
+                                                       synchronize_session=False)
+    if acquired != 1:
+        return None
+    return blob
+
+
+def _prepare_stored_file(src_path, codec):
+    """Retourne le fichier à ranger pour un codec donné : la source elle-même, ou sa version compressée."""
+    if codec is None:
+        return src_path
+    stored_path = f"{src_path}.{codec}"
+    compress_file(src_path, stored_path)
+    return stored_path
+
+
+def store_blob(src_path, sha256, filename=''):
+    """
+    Range un fichier assemblé dans le stockage par empreinte et retourne son blob référencé.
+    Si ce contenu est déjà connu, le fichier source est simplement supprimé.
+    Un nouveau contenu peut être compressé (voir choose_codec) puis est placé sur l'un des volumes
+    (voir choose_volume) ; ce travail a lieu avant toute écriture en base, pour ne jamais la garder verrouillée.
+    """
+    blob = Blob.query.filter_by(sha256=sha256).first()
+    if blob is not None and blob_object(sha256, blob.volume).exists():
+        if acquire_blob(blob) is not None:
+            os.remove(src_path)
+            return blob
+        # Dernière référence libérée entre-temps : le contenu est rangé comme un nouveau blob
+        db.session.expunge(blob)
+        blob = None
+
+    codec = blob.codec if blob is not None else choose_codec(src_path, filename)
+    stored_path = _prepare_stored_file(src_path, codec)
+    if blob is None:
+        volume = choose_volume(os.path.getsize(stored_path))
+        blob = Blob(sha256=sha256, size_bytes=os.path.getsize(src_path), codec=codec,
+                    stored_size_bytes=os.path.getsize(stored_path), volume=volume_column(volume), ref_count=0)
+        db.session.add(blob)
+        try:
+            db.session.flush()
+        except IntegrityError:
+            # Le même contenu vient d'être enregistré par un autre worker
+            db.session.rollback()
+            blob = Blob.query.filter_by(sha256=sha256).one()
+            if blob.codec != codec:
+                # Son choix de codec fait foi : le fichier est préparé à nouveau en conséquence
+                if stored_path != src_path:
+                    os.remove(stored_path)
+                stored_path = _prepare_stored_file(src_path, blob.codec)
+
+    if blob_object(sha256, blob.volume).exists():
+        os.remove(stored_path)
+    else:
+        blob.stored_size_bytes = os.path.getsize(stored_path)
+        get_volume(blob.volume).put(stored_path, blob_key(sha256))
+    if stored_path != src_path and os.path.exists(src_path):
+        os.remove(src_path)
+
+    if acquire_blob(blob) is None:
+        # Le blob enregistré par l'autre worker a perdu sa dernière référence : le contenu rangé est réenregistré
+        db.session.expunge(blob)
+        blob = Blob(sha256=sha256, size_bytes=blob.size_bytes, codec=blob.codec,
+                    stored_size_bytes=blob.stored_size_bytes, volume=blob.volume, ref_count=0)
+        db.session.add(blob)
+        db.session.flush()
+        acquire_blob(blob)
+    return blob
+
+
+def release_blobs(blob_ids):
+    """
+    Retire une référence par id fourni (un même id peut apparaître plusieurs fois).
+    Les blobs qui ne sont plus référencés sont supprimés de la base ; leurs (empreinte, volume) sont
+    retournés pour que les fichiers soient effacés avec remove_blob_files() après le commit.
+    """
+    counts = Counter(blob_id for blob_id in blob_ids if blob_id)
+    if not counts:
+        return []
+
+    for blob_id, count in counts.items():
+        Blob.query.filter_by(id=blob_id).update({Blob.ref_count: Blob.ref_count - count},
+                                                synchronize_session=False)
+
+    orphans = Blob.query.filter(Blob.id.in_(list(counts)), Blob.ref_count <= 0).all()
+    released = [(blob.sha256, blob.volume) for blob in orphans]
+    for blob in orphans:
+        db.session.delete(blob)
+    return released
+
+
+def orphan_blob_objects(released):
+    """Retourne les objets stockés des blobs libérés, sauf ceux réenregistrés entre-temps par un nouvel upload."""
+    if not released:
+        return []
+    reused = {row.sha256 for row in db.session.query(Blob.sha256).filter(
+        Blob.sha256.in_([sha256 for sha256, _ in released]))}
+    return [blob_object(sha256, volume) for sha256, volume in released if sha256 not in reused]
+
+
+def remove_blob_files(released):
+    """Efface de leur volume les blobs libérés par release_blobs(), une fois la transaction validée."""
+    for stored in orphan_blob_objects(released):
+        stored.delete()
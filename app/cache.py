@@ -0,0 +1,141 @@
+import time
+import posixpath
+import threading
+from flask import current_app
+from . import db
+from .models import Item
+from .metrics import RESPONSE_CACHE_REQUESTS
+from .utils import get_redis
+
+# Préfixe des clés Redis du cache des listings
+CACHE_PREFIX = 'dropzone:cache:'
+# Génération globale : incrémentée quand un changement touche des dossiers qu'on ne peut pas énumérer
+# (renommage, déplacement ou suppression d'un dossier : fil d'Ariane et sous-dossiers de tous ses descendants)
+GENERATION_KEY = f'{CACHE_PREFIX}generation'
+# Délai (secondes) avant de réessayer Redis après une erreur : un Redis indisponible ne ralentit pas les requêtes
+RETRY_AFTER_ERROR_SECONDS = 30
+
+_lock = threading.Lock()
+_state = {'retry_at': 0.0}
+_stats = {'hits': 0, 'misses': 0, 'errors': 0, 'invalidations': 0}
+_STAT_NAMES = {'hit': 'hits', 'miss': 'misses', 'error': 'errors'}
+
+
+def _folder_key(folder_id):
+    return 'root' if folder_id is None else str(folder_id)
+
+
+def _version_key(folder_id):
+    return f'{CACHE_PREFIX}version:{_folder_key(folder_id)}'
+
+
+def _count(result):
+    with _lock:
+        _stats[_STAT_NAMES[result]] += 1
+    RESPONSE_CACHE_REQUESTS.labels('list_items', result).inc()
+
+
+def _available():
+    return current_app.config['LIST_CACHE_ENABLED'] and time.monotonic() >= _state['retry_at']
+
+
+def _failed(e):
+    _state['retry_at'] = time.monotonic() + RETRY_AFTER_ERROR_SECONDS
+    current_app.logger.warning(f"Cache des listings indisponible: {e}")
+
+
+# --- Lecture ---
+
+def get_listing(folder_id, limit, cursor):
+    """
+    Cherche une page de listing en cache ; retourne (corps JSON ou None, tampon de version).
+    Le tampon (génération globale, version du dossier) est lu avant toute requête en base : une page calculée
+    pendant une modification est rangée sous l'ancienne version et ne sera jamais servie.
+    """
+    if not _available():
+        return None, None
+    try:
+        redis_client = get_redis()
+        generation, version = redis_client.mget(GENERATION_KEY, _version_key(folder_id))
+        stamp = f"{int(generation or 0)}:{int(version or 0)}"
+        body = redis_client.get(_entry_key(folder_id, stamp, limit, cursor))
+    except Exception as e:
+        _failed(e)
+        _count('error')
+        return None, None
+    _count('hit' if body is not None else 'miss')
+    return body, stamp
+
+
+def _entry_key(folder_id, stamp, limit, cursor):
+    return f"{CACHE_PREFIX}items:{_folder_key(folder_id)}:{stamp}:{limit}:{cursor or ''}"
+
+
+def store_listing(folder_id, limit, cursor, stamp, body):
+    """Range une page calculée sous le tampon lu avant son calcul (expire après LIST_CACHE_TTL_SECONDS)."""
+    if stamp is None:
+        return
+    try:
+        get_redis().set(_entry_key(folder_id, stamp, limit, cursor), body,
+                        ex=current_app.config['LIST_CACHE_TTL_SECONDS'])
+    except Exception as e:
+        _failed(e)
+
+
+# --- Invalidation (à appeler après le commit des modifications) ---
+
+def invalidate_folders(folder_ids):
+    """Périme les listings de dossiers donnés par leur id (None pour la racine)."""
+    folder_ids = set(folder_ids)
+    if not folder_ids or not current_app.config['LIST_CACHE_ENABLED']:
+        return
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for folder_id in folder_ids:
+            pipeline.incr(_version_key(folder_id))
+        pipeline.execute()
+    except Exception as e:
+        # Les pages en cache expirent d'elles-mêmes après LIST_CACHE_TTL_SECONDS
+        _failed(e)
+        return
+    with _lock:
+        _stats['invalidations'] += len(folder_ids)
+
+
+def invalidate_paths(paths):
+    """
+    Périme les listings de tous les dossiers contenant les items donnés par leur chemin, jusqu'à la racine :
+    l'item apparaît dans son dossier, et les totaux affichés de chacun de ses dossiers parents changent.
+    """
+    folders = set()
+    for path in paths:
+        folder = posixpath.dirname(path)
+        while folder:
+            folders.add(folder)
+            folder = posixpath.dirname(folder)
+    folder_ids = [None]
+    if folders:
+        folder_ids += [row.id for row in db.session.query(Item.id).filter(Item.path.in_(folders))]
+    invalidate_folders(folder_ids)
+
+
+def invalidate_all():
+    """Périme tous les listings en cache (changement de l'arborescence elle-même)."""
+    if not current_app.config['LIST_CACHE_ENABLED']:
+        return
+    try:
+        get_redis().incr(GENERATION_KEY)
+    except Exception as e:
+        _failed(e)
+        return
+    with _lock:
+        _stats['invalidations'] += 1
+
+
+def get_stats():
+    """Compteurs du cache pour le processus courant (les métriques Prometheus agrègent tous les processus)."""
+    with _lock:
+        stats = dict(_stats)
+    lookups = stats['hits'] + stats['misses']
+    stats['hit_ratio'] = round(stats['hits'] / lookups, 3) if lookups else None
+    return stats
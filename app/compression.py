@@ -0,0 +1,111 @@
+import os
+import struct
+import zstandard
+from flask import current_app
+from .uploads import COPY_BUFFER_SIZE
+
+CODEC_ZSTD = 'zstd'
+
+# Taille d'origine de chaque trame zstd indépendante : c'est la granularité des lectures par plage
+ZSTD_FRAME_SIZE = 1024 * 1024
+
+# Format « seekable » de zstd : table des trames dans une trame ignorée par les décodeurs standards
+SKIPPABLE_MAGIC = 0x184D2A5E
+SEEKABLE_MAGIC = 0x8F92EAB1
+SEEK_TABLE_FOOTER_SIZE = 9
+
+# Types déjà compressés : les recompresser coûte du CPU pour un gain nul
+COMPRESSED_EXTENSIONS = frozenset({
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jpg', '.jpeg', '.png', '.gif', '.webp',
+    '.heic', '.mp3', '.aac', '.ogg', '.flac', '.m4a', '.mp4', '.mkv', '.mov', '.avi', '.webm', '.pdf',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.epub', '.apk', '.jar', '.iso',
+})
+
+
+def choose_codec(src_path, filename):
+    """
+    Choisit le codec de stockage d'un nouveau contenu selon STORAGE_COMPRESSION, sa taille, son extension
+    et le taux de compression obtenu sur un échantillon ; retourne None pour un stockage tel quel.
+    """
+    if current_app.config['STORAGE_COMPRESSION'] != CODEC_ZSTD:
+        return None
+    if os.path.getsize(src_path) < current_app.config['STORAGE_COMPRESSION_MIN_BYTES']:
+        return None
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return None
+
+    with open(src_path, 'rb') as f:
+        sample = f.read(ZSTD_FRAME_SIZE)
+    compressed = zstandard.ZstdCompressor(level=current_app.config['STORAGE_COMPRESSION_LEVEL']).compress(sample)
+    if len(compressed) > len(sample) * current_app.config['STORAGE_COMPRESSION_MAX_RATIO']:
+        return None
+    return CODEC_ZSTD
+
+
+def compress_file(src_path, dst_path):
+    """
+    Compresse un fichier au format zstd « seekable » : une trame indépendante par ZSTD_FRAME_SIZE octets,
+    suivie de la table des trames. Le résultat reste un flux zstd standard, servable tel quel aux clients.
+    """
+    compressor = zstandard.ZstdCompressor(level=current_app.config['STORAGE_COMPRESSION_LEVEL'])
+    seek_table = []
+    with open(src_path, 'rb') as src, open(dst_path, 'wb') as dst:
+        for block in iter(lambda: src.read(ZSTD_FRAME_SIZE), b""):
+            frame = compressor.compress(block)
+            dst.write(frame)
+            seek_table.append((len(frame), len(block)))
+
+        entries = b''.join(struct.pack('<II', compressed_size, size) for compressed_size, size in seek_table)
+        footer = struct.pack('<IBI', len(seek_table), 0, SEEKABLE_MAGIC)
+        dst.write(struct.pack('<II', SKIPPABLE_MAGIC, len(entries) + len(footer)) + entries + footer)
+
+
+def open_source(source):
+    """Ouvre en lecture binaire un chemin ou un objet stocké (voir storage)."""
+    return source.open() if hasattr(source, 'open') else open(source, 'rb')
+
+
+def read_seek_table(f):
+    """Retourne la liste (taille compressée, taille d'origine) des trames d'un fichier zstd seekable ouvert."""
+    f.seek(-SEEK_TABLE_FOOTER_SIZE, os.SEEK_END)
+    frame_count, descriptor, magic = struct.unpack('<IBI', f.read(SEEK_TABLE_FOOTER_SIZE))
+    if magic != SEEKABLE_MAGIC:
+        raise IOError(f"Table des trames zstd absente: {getattr(f, 'name', '?')}")
+    entry_size = 12 if descriptor & 0x80 else 8
+    f.seek(-(SEEK_TABLE_FOOTER_SIZE + frame_count * entry_size), os.SEEK_END)
+    table = f.read(frame_count * entry_size)
+    return [struct.unpack_from('<II', table, i * entry_size) for i in range(frame_count)]
+
+
+def read_content(source, codec, start=0, stop=None):
+    """
+    Lit par blocs les octets [start, stop) du contenu d'origine d'un fichier stocké (jusqu'à la fin si stop est None).
+    `source` est un chemin ou un objet stocké (volume local ou S3).
+    Pour un fichier compressé, seules les trames couvrant la plage demandée sont décompressées.
+    """
+    if stop is None:
+        stop = float('inf')
+    with open_source(source) as f:
+        if codec is None:
+            f.seek(start)
+            remaining = stop - start
+            while remaining > 0:
+                block = f.read(min(COPY_BUFFER_SIZE, remaining))
+                if not block:
+                    break
+                remaining -= len(block)
+                yield block
+            return
+
+        decompressor = zstandard.ZstdDecompressor()
+        frame_offset = 0
+        content_offset = 0
+        for compressed_size, size in read_seek_table(f):
+            if content_offset >= stop:
+                break
+            if content_offset + size > start:
+                f.seek(frame_offset)
+                block = decompressor.decompress(f.read(compressed_size), max_output_size=size)
+                yield block[max(start - content_offset, 0):min(stop - content_offset, size)]
+            frame_offset += compressed_size
+            content_offset += size
@@ -0,0 +1,196 @@
+import time
+import random
+import zlib
+from contextlib import contextmanager
+from functools import wraps
+from flask import current_app, jsonify
+from sqlalchemy import BigInteger, Integer, event, inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from . import db
+from .metrics import DB_BUSY_ERRORS
+
+# Valeurs acceptées pour les pragmas réglables (interpolées dans les requêtes PRAGMA)
+SQLITE_JOURNAL_MODES = ('wal', 'delete', 'truncate', 'persist', 'memory')
+SQLITE_SYNCHRONOUS_MODES = ('off', 'normal', 'full', 'extra')
+# Taille maximale conservée du fichier -wal après un checkpoint (il grossit pendant les longues lectures)
+SQLITE_JOURNAL_SIZE_LIMIT = 64 * 1024 * 1024
+
+# Messages SQLite d'un verrou tenu par une autre connexion au-delà de busy_timeout
+SQLITE_BUSY_MESSAGES = ('database is locked', 'database table is locked', 'database is busy')
+# Codes PostgreSQL d'un conflit d'écriture : échec de sérialisation, interblocage, verrou indisponible
+POSTGRESQL_BUSY_CODES = ('40001', '40P01', '55P03')
+# Verrou consultatif PostgreSQL sérialisant la mise à jour du schéma entre les workers gunicorn
+SCHEMA_LOCK_ID = zlib.crc32(b'dropzone:schema')
+
+# Index propres à PostgreSQL : les filtres sur un préfixe de chemin (LIKE 'dossier/%', sous-arbres) n'exploitent
+# un index B-tree qu'avec text_pattern_ops lorsque la collation de la base n'est pas 'C'
+POSTGRESQL_INDEXES = (
+    "CREATE INDEX IF NOT EXISTS ix_item_path_pattern ON item (path text_pattern_ops)",
+)
+
+
+def init_app(app):
+    """Règle chaque nouvelle connexion SQLite et répond 503 aux requêtes refusées pour verrou."""
+    app.register_error_handler(OperationalError, _busy_response)
+    with app.app_context():
+        if db.engine.dialect.name != 'sqlite':
+            return
+        pragmas = sqlite_pragmas(app.config)
+        event.listen(db.engine, 'connect',
+                     lambda dbapi_connection, _: _configure_sqlite(dbapi_connection, pragmas, app.logger))
+
+
+def sqlite_pragmas(config):
+    """
+    Pragmas appliqués à chaque connexion SQLite, dans l'ordre :
+    - journal WAL : les lectures ne sont jamais bloquées par une écriture en cours, ni l'inverse ;
+    - synchronous NORMAL : en WAL, la base reste cohérente après une coupure, seules les dernières transactions
+      validées pouvant être perdues ;
+    - busy_timeout : une écriture attend la libération du verrou au lieu d'échouer immédiatement ;
+    - foreign_keys : clés étrangères vérifiées comme sous PostgreSQL, pour ne pas découvrir un ordre
+      d'écriture invalide seulement en production.
+    """
+    journal_mode = config['SQLITE_JOURNAL_MODE'].lower()
+    if journal_mode not in SQLITE_JOURNAL_MODES:
+        raise ValueError(f"SQLITE_JOURNAL_MODE invalide : {journal_mode}")
+    synchronous = config['SQLITE_SYNCHRONOUS'].lower()
+    if synchronous not in SQLITE_SYNCHRONOUS_MODES:
+        raise ValueError(f"SQLITE_SYNCHRONOUS invalide : {synchronous}")
+    return (
+        ('busy_timeout', int(config['SQLITE_BUSY_TIMEOUT_MS'])),
+        ('journal_mode', journal_mode),
+        ('synchronous', synchronous),
+        ('journal_size_limit', SQLITE_JOURNAL_SIZE_LIMIT),
+        # Valeur négative : taille du cache en Kio
+        ('cache_size', -int(config['SQLITE_CACHE_SIZE_MB']) * 1024),
+        ('mmap_size', int(config['SQLITE_MMAP_SIZE_MB']) * 1024 * 1024),
+        ('temp_store', 'memory'),
+        ('foreign_keys', 'on' if config['SQLITE_FOREIGN_KEYS'] else 'off'),
+    )
+
+
+def _configure_sqlite(dbapi_connection, pragmas, logger):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas:
+            try:
+                cursor.execute(f"PRAGMA {name}={value}")
+            except Exception as e:
+                # Passage en WAL impossible tant qu'un autre processus garde la base en mode rollback :
+                # la connexion reste utilisable, une suivante réessaiera
+                logger.warning(f"Pragma SQLite {name} non appliqué: {e}")
+    finally:
+        cursor.close()
+
+
+# --- Écritures refusées pour verrou ---
+
+def is_busy(error):
+    """Indique si une erreur vient d'un verrou tenu par une autre transaction (à réessayer plus tard)."""
+    if not isinstance(error, OperationalError):
+        return False
+    code = getattr(error.orig, 'pgcode', None)
+    if code is not None:
+        return code in POSTGRESQL_BUSY_CODES
+    message = str(error.orig).lower()
+    return any(marker in message for marker in SQLITE_BUSY_MESSAGES)
+
+
+def retry_on_busy(func):
+    """
+    Réessaie une unité de travail refusée pour verrou, au plus DB_BUSY_RETRIES fois, après une attente croissante
+    (DB_BUSY_RETRY_BASE_MS doublé à chaque tentative, avec une part aléatoire pour désynchroniser les processus).
+    La fonction doit valider elle-même sa transaction et n'agir que sur la base : elle est rejouée en entier.
+    """
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        retries = current_app.config['DB_BUSY_RETRIES']
+        attempt = 0
+        while True:
+            try:
+                return func(*args, **kwargs)
+            except OperationalError as e:
+                db.session.rollback()
+                if not is_busy(e):
+                    raise
+                if attempt >= retries:
+                    DB_BUSY_ERRORS.labels('failed').inc()
+                    raise
+                DB_BUSY_ERRORS.labels('retried').inc()
+                delay = current_app.config['DB_BUSY_RETRY_BASE_MS'] / 1000 * 2 ** attempt
+                time.sleep(delay * random.uniform(0.5, 1.5))
+                attempt += 1
+    return wrapper
+
+
+def _busy_response(error):
+    if not is_busy(error):
+        raise error
+    db.session.rollback()
+    DB_BUSY_ERRORS.labels('rejected').inc()
+    response = jsonify({"error": "Base de données occupée, veuillez réessayer."})
+    response.status_code = 503
+    response.headers['Retry-After'] = '1'
+    return response
+
+
+# --- Schéma ---
+
+@contextmanager
+def schema_lock():
+    """
+    Sérialise la création et la mise à jour du schéma entre les processus qui démarrent ensemble.
+    PostgreSQL : verrou consultatif ; SQLite : inutile, les écritures y étant déjà sérialisées (busy_timeout).
+    """
+    if db.engine.dialect.name != 'postgresql':
+        yield
+        return
+    with db.engine.connect() as connection:
+        connection.execute(text("SELECT pg_advisory_lock(:id)"), {'id': SCHEMA_LOCK_ID})
+        try:
+            yield
+        finally:
+            connection.execute(text("SELECT pg_advisory_unlock(:id)"), {'id': SCHEMA_LOCK_ID})
+
+
+def widen_integer_columns():
+    """
+    Passe en BIGINT les colonnes entières des tables existantes déclarées BigInteger depuis leur création
+    (tailles de fichiers au-delà de 2 Gio), upgrade_schema() n'ajoutant que les colonnes manquantes.
+    PostgreSQL uniquement : un INTEGER SQLite stocke déjà des entiers sur 64 bits.
+    """
+    if db.engine.dialect.name != 'postgresql':
+        return
+    inspector = inspect(db.engine)
+    for table in db.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing_types = {column['name']: column['type'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            existing_type = existing_types.get(column.name)
+            if (isinstance(column.type, BigInteger) and isinstance(existing_type, Integer)
+                    and not isinstance(existing_type, BigInteger)):
+                db.session.execute(text(f"ALTER TABLE {table.name} ALTER COLUMN {column.name} TYPE BIGINT"))
+    db.session.commit()
+
+
+def create_dialect_indexes():
+    """Crée les index que seul le moteur utilisé sait exploiter (PostgreSQL uniquement)."""
+    if db.engine.dialect.name != 'postgresql':
+        return
+    try:
+        for statement in POSTGRESQL_INDEXES:
+            db.session.execute(text(statement))
+        db.session.commit()
+    except (OperationalError, ProgrammingError) as e:
+        db.session.rollback()
+        current_app.logger.warning(f"Index PostgreSQL non créés: {e}")
+
+
+def get_stats():
+    """Moteur utilisé et, pour SQLite, réglages effectifs de la connexion."""
+    stats = {'dialect': db.engine.dialect.name}
+    if stats['dialect'] == 'sqlite':
+        for name in ('journal_mode', 'synchronous', 'busy_timeout', 'cache_size', 'mmap_size', 'foreign_keys'):
+            stats[name] = db.session.execute(text(f"PRAGMA {name}")).scalar()
+    return stats
@@ -0,0 +1,146 @@
+import os
+import mimetypes
+from flask import Response, request, current_app
+from werkzeug.datastructures import Headers
+from werkzeug.wsgi import wrap_file
+from .uploads import COPY_BUFFER_SIZE
+from .compression import read_content
+
+# Au-delà, une requête multi-plages est servie en entier (protection contre les requêtes abusives)
+MAX_RANGES = 32
+
+
+def _requested_ranges(size, etag, last_modified):
+    """
+    Retourne la liste des plages (début, fin exclue) demandées et applicables, None pour un envoi complet,
+    ou une liste vide si aucune plage n'est satisfiable (416).
+    """
+    byte_range = request.range
+    if byte_range is None or byte_range.units != 'bytes':
+        return None
+
+    # If-Range : les plages ne s'appliquent que si le fichier n'a pas changé depuis la première requête
+    if_range = request.if_range
+    if if_range.etag is not None:
+        if etag is None or if_range.etag != etag:
+            return None
+    elif if_range.date is not None and last_modified > if_range.date:
+        return None
+
+    ranges = []
+    for start, stop in byte_range.ranges:
+        if start < 0:
+            start, stop = max(size + start, 0), size
+        else:
+            stop = size if stop is None else min(stop, size)
+        if start < stop:
+            ranges.append((start, stop))
+
+    # Fusionne les plages qui se chevauchent ou se touchent
+    ranges.sort()
+    merged = []
+    for start, stop in ranges:
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], stop))
+        else:
+            merged.append((start, stop))
+
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _multipart_body(stored, codec, ranges, size, mimetype, boundary):
+    """Retourne le générateur du corps multipart/byteranges et sa taille exacte."""
+    part_headers = [
+        (f"\r\n--{boundary}\r\nContent-Type: {mimetype}\r\n"
+         f"Content-Range: bytes {start}-{stop - 1}/{size}\r\n\r\n").encode('ascii')
+        for start, stop in ranges
+    ]
+    closing = f"\r\n--{boundary}--\r\n".encode('ascii')
+    length = sum(len(header) for header in part_headers) + sum(stop - start for start, stop in ranges) + len(closing)
+
+    def generate():
+        for header, (start, stop) in zip(part_headers, ranges):
+            yield header
+            yield from read_content(stored, codec, start, stop)
+        yield closing
+
+    return generate(), length
+
+
+def send_stored_file(stored, download_name, etag=None, codec=None, size=None):
+    """
+    Sert un fichier stocké (objet d'un volume local ou S3, voir storage) avec ETag fort, requêtes conditionnelles
+    et plages d'octets (y compris multiples).
+    Selon DOWNLOAD_OFFLOAD, le transfert des octets d'un fichier local peut être délégué au proxy frontal.
+    Un fichier stocké compressé (`codec`, `size` étant sa taille d'origine) est envoyé tel quel aux clients
+    acceptant cet encodage, sinon décompressé à la volée, trame par trame pour les plages.
+    """
+    stored_size, last_modified = stored.stat()
+    if codec is None:
+        size = stored_size
+    mimetype = mimetypes.guess_type(download_name)[0] or 'application/octet-stream'
+
+    headers = Headers()
+    headers.set('Content-Disposition', 'attachment', filename=download_name)
+    headers['Accept-Ranges'] = 'bytes'
+    headers['Last-Modified'] = last_modified.strftime('%a, %d %b %Y %H:%M:%S GMT')
+
+    # Représentation compressée : uniquement pour un envoi complet, les plages portant sur le contenu d'origine
+    send_encoded = codec is not None and request.range is None \
+        and request.accept_encodings[codec] > 0
+    if codec is not None:
+        headers['Vary'] = 'Accept-Encoding'
+    if etag:
+        # Chaque représentation a son propre ETag fort
+        etag = f"{etag}-{codec}" if send_encoded else etag
+        headers['ETag'] = f'"{etag}"'
+
+    if etag and request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+
+    if send_encoded:
+        headers['Content-Encoding'] = codec
+        headers['Content-Length'] = str(stored_size)
+        body = wrap_file(request.environ, stored.open(), COPY_BUFFER_SIZE)
+        return Response(body, status=200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    offload = current_app.config['DOWNLOAD_OFFLOAD'] if codec is None and stored.local_path else ''
+    if offload == 'x-accel':
+        relative_path = os.path.relpath(stored.local_path, current_app.config['UPLOAD_FOLDER'])
+        if not relative_path.startswith(os.pardir):
+            # nginx sert le fichier (et gère lui-même les plages) depuis une location interne
+            prefix = current_app.config['X_ACCEL_REDIRECT_PREFIX'].rstrip('/')
+            headers['X-Accel-Redirect'] = f"{prefix}/{relative_path.replace(os.sep, '/')}"
+            return Response(status=200, headers=headers, mimetype=mimetype)
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(stored.local_path)
+        return Response(status=200, headers=headers, mimetype=mimetype)
+
+    ranges = _requested_ranges(size, etag, last_modified)
+    if ranges is None:
+        headers['Content-Length'] = str(size)
+        if codec is None:
+            # wrap_file permet au serveur WSGI d'utiliser sendfile() lorsqu'il le supporte
+            body = wrap_file(request.environ, stored.open(), COPY_BUFFER_SIZE)
+        else:
+            body = read_content(stored, codec, 0, size)
+        return Response(body, status=200, headers=headers, mimetype=mimetype, direct_passthrough=True)
+
+    if not ranges:
+        headers['Content-Range'] = f"bytes */{size}"
+        return Response(status=416, headers=headers)
+
+    if len(ranges) == 1:
+        start, stop = ranges[0]
+        headers['Content-Range'] = f"bytes {start}-{stop - 1}/{size}"
+        headers['Content-Length'] = str(stop - start)
+        return Response(read_content(stored, codec, start, stop), status=206, headers=headers, mimetype=mimetype,
+                        direct_passthrough=True)
+
+    boundary = os.urandom(12).hex()
+    body, length = _multipart_body(stored, codec, ranges, size, mimetype, boundary)
+    headers['Content-Length'] = str(length)
+    return Response(body, status=206, headers=headers, content_type=f"multipart/byteranges; boundary={boundary}",
+                    direct_passthrough=True)
@@ -0,0 +1,178 @@
+import os
+import json
+import time
+import queue
+import threading
+from collections import defaultdict
+import redis
+from flask import current_app
+from .models import item_to_dict
+from .utils import get_redis, sizeof_fmt
+
+# Canal Redis unique sur lequel tous les processus (web et Celery) publient les changements de l'arborescence
+EVENTS_CHANNEL = 'dropzone:events'
+# Valeur de `parent_id` d'un événement destiné à tous les dossiers (ex. : purge complète)
+ALL_FOLDERS = '*'
+# Événements de suppression, aussi remis aux flux ouverts sur un sous-dossier de l'élément supprimé
+REMOVAL_EVENTS = ('deleted', 'expired')
+# Valeur par défaut de item_event() : le dossier de l'item (None désignant déjà la racine)
+_ITEM_FOLDER = object()
+
+_lock = threading.Lock()
+_subscribers = defaultdict(set)
+_state = {'listener_pid': None}
+
+
+# --- Publication ---
+
+def item_payload(item):
+    """Représentation d'un Item identique à celle de /api/items."""
+    data = item_to_dict(item)
+    size = item.size_bytes if item.item_type == 'file' else item.total_size_bytes
+    if size is not None:
+        data['size_human'] = sizeof_fmt(size)
+    return data
+
+
+def item_event(event_type, item, parent_id=_ITEM_FOLDER):
+    """Événement portant l'état complet d'un item, publié dans son dossier (ou `parent_id`, ex. : ancien dossier)."""
+    return {"type": event_type, "parent_id": item.parent_id if parent_id is _ITEM_FOLDER else parent_id,
+            "item": item_payload(item)}
+
+
+def removal_events(event_type, rows):
+    """Un événement par dossier concerné, listant les ids supprimés ; `rows` : objets ayant `id` et `parent_id`."""
+    ids_by_parent = defaultdict(list)
+    for row in rows:
+        ids_by_parent[row.parent_id].append(row.id)
+    return [{"type": event_type, "parent_id": parent_id, "ids": ids} for parent_id, ids in ids_by_parent.items()]
+
+
+def publish(*events):
+    """
+    Diffuse des événements à tous les processus, à appeler après le commit des modifications.
+    Une notification perdue n'est pas une erreur : Redis indisponible ne fait jamais échouer l'appelant,
+    les clients se resynchronisant par une relecture du dossier.
+    """
+    if not events or not current_app.config['EVENTS_ENABLED']:
+        return
+    try:
+        pipeline = get_redis().pipeline(transaction=False)
+        for event in events:
+            pipeline.publish(EVENTS_CHANNEL, json.dumps(event))
+        pipeline.execute()
+    except Exception as e:
+        current_app.logger.warning(f"Publication des événements impossible: {e}")
+
+
+# --- Diffusion aux flux SSE du processus ---
+
+class Subscriber:
+    """Flux ouvert sur un dossier ; `ancestors` : ids de ses dossiers parents, pour les suppressions en cascade."""
+
+    def __init__(self, folder, ancestors, queue_size):
+        self.folder = folder
+        self.ancestors = set(ancestors)
+        self.events = queue.Queue(maxsize=queue_size)
+        self.overflowed = False
+
+    def push(self, event):
+        try:
+            self.events.put_nowait(event)
+        except queue.Full:
+            # Client trop lent : les événements en attente sont abandonnés au profit d'une resynchronisation
+            self.overflowed = True
+
+
+def _dispatch(event):
+    folder = event.get('parent_id')
+    with _lock:
+        if folder == ALL_FOLDERS:
+            targets = [subscriber for subscribers in _subscribers.values() for subscriber in subscribers]
+        else:
+            targets = list(_subscribers.get(folder, ()))
+            if event['type'] in REMOVAL_EVENTS:
+                removed = set(event['ids'])
+                targets += [subscriber for key, subscribers in _subscribers.items() if key != folder
+                            for subscriber in subscribers if subscriber.ancestors & removed]
+    for subscriber in targets:
+        subscriber.push(event)
+
+
+def _listen(redis_client):
+    """Relaie les événements publiés aux flux du processus ; se reconnecte en cas de coupure."""
+    connected_once = False
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(EVENTS_CHANNEL)
+            if connected_once:
+                # Des événements ont pu être manqués pendant la déconnexion
+                _dispatch({"type": "resync", "parent_id": ALL_FOLDERS})
+            connected_once = True
+            for message in pubsub.listen():
+                try:
+                    _dispatch(json.loads(message['data']))
+                except (ValueError, KeyError, TypeError):
+                    continue
+        except Exception:
+            time.sleep(5)
+
+
+def _ensure_listener():
+    """Démarre l'écoute du canal une fois par processus (y compris après un fork de gunicorn)."""
+    pid = os.getpid()
+    if _state['listener_pid'] == pid:
+        return
+    with _lock:
+        if _state['listener_pid'] == pid:
+            return
+        _state['listener_pid'] = pid
+    # Un client dédié : la connexion pub/sub reste bloquée en lecture
+    redis_client = redis.Redis.from_url(current_app.config['REDIS_URL'])
+    threading.Thread(target=_listen, args=(redis_client,), name='events-listener', daemon=True).start()
+
+
+def _format(event):
+    return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+
+def event_stream(folder, ancestors):
+    """
+    Flux Server-Sent Events des changements du dossier `folder` (None pour la racine).
+    Un commentaire est envoyé toutes les EVENTS_HEARTBEAT_SECONDS secondes pour détecter les clients partis ;
+    le flux est fermé après EVENTS_STREAM_MAX_SECONDS, le navigateur se reconnectant de lui-même.
+    """
+    _ensure_listener()
+    config = current_app.config
+    heartbeat = config['EVENTS_HEARTBEAT_SECONDS']
+    max_seconds = config['EVENTS_STREAM_MAX_SECONDS']
+    queue_size = config['EVENTS_QUEUE_SIZE']
+
+    def generate():
+        subscriber = Subscriber(folder, ancestors, queue_size)
+        with _lock:
+            _subscribers[folder].add(subscriber)
+        try:
+            yield f"retry: {config['EVENTS_RETRY_MS']}\n\n"
+            deadline = time.monotonic() + max_seconds
+            while time.monotonic() < deadline:
+                if subscriber.overflowed:
+                    subscriber.overflowed = False
+                    while not subscriber.events.empty():
+                        subscriber.events.get_nowait()
+                    yield _format({"type": "resync", "parent_id": folder})
+                    continue
+                try:
+                    event = subscriber.events.get(timeout=min(heartbeat, max(deadline - time.monotonic(), 0.1)))
+                except queue.Empty:
+                    yield ": ping\n\n"
+                    continue
+                yield _format(event)
+        finally:
+            with _lock:
+                _subscribers[folder].discard(subscriber)
+                if not _subscribers[folder]:
+                    del _subscribers[folder]
+
+    return generate()
@@ -0,0 +1,129 @@
+import os
+import socket
+import time
+from flask import Response, current_app, g, request
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Histogram, generate_latest,
+                               multiprocess, values)
+from prometheus_client.core import GaugeMetricFamily
+from .utils import get_redis
+from .uploads import scan_sessions
+
+# Mode multi-processus : chaque processus (workers gunicorn, workers Celery) écrit ses mesures dans ce dossier,
+# agrégées au moment de la collecte. Le dossier peut être partagé entre conteneurs : l'identifiant de
+# processus inclut donc le nom d'hôte, les pid de conteneurs différents pouvant coïncider.
+MULTIPROC_DIR = os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+    _hostname = socket.gethostname()
+    values.ValueClass = values.MultiProcessValue(lambda: f"{_hostname}_{os.getpid()}")
+
+SIZE_BUCKETS = tuple(2 ** power * 1024 for power in range(6, 18, 1))  # 64 Kio à 128 Mio
+
+REQUEST_LATENCY = Histogram('dropzone_http_request_duration_seconds',
+                            "Durée de traitement des requêtes HTTP (jusqu'à l'envoi des en-têtes)",
+                            ['method', 'endpoint', 'status'])
+REQUEST_BYTES = Counter('dropzone_http_request_bytes', 'Octets reçus dans le corps des requêtes', ['endpoint'])
+RESPONSE_BYTES = Counter('dropzone_http_response_bytes', 'Octets envoyés dans le corps des réponses', ['endpoint'])
+
+UPLOAD_CHUNK_SECONDS = Histogram('dropzone_upload_chunk_seconds', "Durée de réception et d'écriture d'un morceau",
+                                 buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60))
+UPLOAD_CHUNK_BYTES = Histogram('dropzone_upload_chunk_bytes', 'Taille des morceaux reçus', buckets=SIZE_BUCKETS)
+
+ASSEMBLY_PHASE_SECONDS = Histogram('dropzone_assembly_phase_seconds',
+                                   "Durée des phases de l'assemblage (copy, hash, store, total)", ['phase'],
+                                   buckets=(.01, .05, .1, .5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+EXPIRY_BATCH_SECONDS = Histogram('dropzone_expiry_batch_seconds', "Durée d'un lot de suppression des fichiers expirés")
+EXPIRED_FILES = Counter('dropzone_expired_files', 'Fichiers expirés supprimés')
+UPLOAD_SESSIONS_REMOVED = Counter('dropzone_upload_sessions_removed', "Sessions d'upload abandonnées supprimées")
+UPLOAD_SESSION_BYTES_RECLAIMED = Counter('dropzone_upload_session_reclaimed_bytes',
+                                         "Octets libérés par la suppression des sessions d'upload abandonnées")
+RESPONSE_CACHE_REQUESTS = Counter('dropzone_response_cache_requests', 'Consultations du cache des réponses',
+                                  ['endpoint', 'result'])
+DB_BUSY_ERRORS = Counter('dropzone_db_busy', 'Écritures refusées pour verrou (base occupée)', ['outcome'])
+DB_QUEUED_WRITES = Counter('dropzone_db_queued_writes', "Écritures appliquées par la file d'écriture unique",
+                           ['result'])
+TASK_SECONDS = Histogram('dropzone_celery_task_seconds', 'Durée des tâches Celery', ['task', 'state'],
+                         buckets=(.01, .05, .1, .5, 1, 5, 10, 30, 60, 300, 900))
+
+
+class CeleryQueueCollector:
+    """Longueur de la file Celery, lue dans Redis à chaque collecte."""
+
+    def collect(self):
+        gauge = GaugeMetricFamily('dropzone_celery_queue_length', 'Tâches en attente dans la file Celery',
+                                  labels=['queue'])
+        queue = current_app.config.get('task_default_queue') or 'celery'
+        try:
+            gauge.add_metric([queue], get_redis(current_app.config['broker_url']).llen(queue))
+        except Exception:
+            # Broker injoignable : la métrique est simplement absente de cette collecte
+            pass
+        yield gauge
+
+
+class UploadSessionCollector:
+    """Sessions d'upload présentes dans uploads/tmp, actives ou abandonnées, comptées à chaque collecte."""
+
+    def collect(self):
+        gauge = GaugeMetricFamily('dropzone_upload_sessions', "Sessions d'upload en cours, par état", labels=['state'])
+        stale_before = time.time() - current_app.config['UPLOAD_SESSION_TTL_HOURS'] * 3600
+        active, stale = scan_sessions(current_app.config['UPLOAD_FOLDER'], stale_before)
+        gauge.add_metric(['active'], active)
+        gauge.add_metric(['abandoned'], len(stale))
+        yield gauge
+
+
+# Mesures calculées au moment de la collecte, identiques quel que soit le processus qui répond
+_live_registry = CollectorRegistry(auto_describe=False)
+_live_registry.register(CeleryQueueCollector())
+_live_registry.register(UploadSessionCollector())
+
+
+def _start_timer():
+    g.metrics_started = time.perf_counter()
+
+
+def _count_response_bytes(body, endpoint):
+    for block in body:
+        RESPONSE_BYTES.labels(endpoint).inc(len(block))
+        yield block
+
+
+def _record_request(response):
+    started = g.pop('metrics_started', None)
+    if started is None or request.endpoint == 'metrics':
+        return response
+
+    endpoint = request.endpoint or 'unknown'
+    REQUEST_LATENCY.labels(request.method, endpoint, response.status_code).observe(time.perf_counter() - started)
+    if request.content_length:
+        REQUEST_BYTES.labels(endpoint).inc(request.content_length)
+    if response.content_length is not None:
+        RESPONSE_BYTES.labels(endpoint).inc(response.content_length)
+    elif response.is_streamed:
+        # Taille inconnue à l'avance (archive compressée, etc.) : comptée au fil de l'envoi
+        response.response = _count_response_bytes(response.response, endpoint)
+    return response
+
+
+def metrics():
+    """Expose les métriques au format texte Prometheus (agrégées sur tous les processus en mode multi-processus)."""
+    token = current_app.config['METRICS_TOKEN']
+    if token and request.headers.get('Authorization') != f"Bearer {token}":
+        return Response("Accès non autorisé\n", status=401, mimetype='text/plain')
+
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return Response(generate_latest(registry) + generate_latest(_live_registry), content_type=CONTENT_TYPE_LATEST)
+
+
+def init_app(app):
+    """Active l'instrumentation des requêtes et la route /metrics (si METRICS_ENABLED)."""
+    if not app.config['METRICS_ENABLED']:
+        return
+    app.before_request(_start_timer)
+    app.after_request(_record_request)
+    app.add_url_rule('/metrics', 'metrics', metrics)
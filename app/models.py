@@ -18,29 +18,86 @@ class Item(db.Model):
                                cascade="all, delete-orphan")
 
     # Champs spécifiques aux fichiers (seront NULL pour les dossiers)
-    size_bytes = db.Column(db.Integer, nullable=True)
+    size_bytes = db.Column(db.BigInteger, nullable=True)
     sha256 = db.Column(db.String(64), nullable=True)
+    # Contenu partagé (stockage par empreinte). NULL pour les dossiers et les fichiers stockés à `path`
+    blob_id = db.Column(db.Integer, db.ForeignKey('blob.id'), nullable=True, index=True)
+    blob = db.relationship('Blob')
+    # Taille occupée sur le disque, inférieure à size_bytes (taille d'origine) si le contenu est compressé
+    stored_size_bytes = db.Column(db.BigInteger, nullable=True)
     status = db.Column(db.String(20), default='processed', nullable=False)
+    # Nombre d'enfants directs (dossiers uniquement), tenu à jour à chaque ajout, suppression ou déplacement
+    child_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
+    # Taille cumulée (size_bytes) et nombre des fichiers de tout le sous-arbre (dossiers uniquement),
+    # reportés sur toute la chaîne des dossiers parents à chaque ajout, suppression, expiration ou déplacement
+    total_size_bytes = db.Column(db.BigInteger, nullable=False, default=0, server_default='0')
+    file_count = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     expires_at = db.Column(db.DateTime, nullable=True)
+    # Dernière vérification de l'intégrité du contenu par la tâche de vérification (NULL : jamais vérifié)
+    verified_at = db.Column(db.DateTime, nullable=True)
+
+    __table_args__ = (
+        # Listing d'un dossier trié par (type, nom) et pagination par curseur
+        db.Index('ix_item_parent_type_name', 'parent_id', 'item_type', 'name'),
+        # Recherche des fichiers expirés par la tâche de purge
+        db.Index('ix_item_type_expires_at', 'item_type', 'expires_at'),
+        # Recherche des dossiers vides par la tâche de nettoyage
+        db.Index('ix_item_type_child_count', 'item_type', 'child_count'),
+        # Sélection des fichiers à vérifier, du jamais vérifié au moins récemment vérifié
+        db.Index('ix_item_type_verified_at', 'item_type', 'verified_at'),
+    )
 
     def to_dict(self):
-        data = {
-            "id": self.id,
-            "name": self.name,
-            "item_type": self.item_type,
-            "path": self.path,
-            "parent_id": self.parent_id,
-            "size_bytes": self.size_bytes,
-            "sha256": self.sha256,
-            "status": self.status,
-            "created_at": self.created_at.isoformat() + 'Z',
-            "expires_at": self.expires_at.isoformat() + 'Z' if self.expires_at else None,
-            "download_url": None
-        }
-        if self.item_type == 'file':
-            data['download_url'] = f"/download/{self.id}/{self.name}"
-        return data
+        return item_to_dict(self)
+
+
+# Colonnes nécessaires à item_to_dict(), pour les requêtes qui évitent d'instancier des objets Item
+ITEM_LIST_COLUMNS = (Item.id, Item.name, Item.item_type, Item.path, Item.parent_id, Item.size_bytes,
+                     Item.stored_size_bytes, Item.sha256, Item.status, Item.created_at, Item.expires_at,
+                     Item.total_size_bytes, Item.file_count)
+
+
+def item_to_dict(item):
+    """Sérialise un Item ou une ligne de résultat contenant ITEM_LIST_COLUMNS."""
+    data = {
+        "id": item.id,
+        "name": item.name,
+        "item_type": item.item_type,
+        "path": item.path,
+        "parent_id": item.parent_id,
+        "size_bytes": item.size_bytes,
+        "stored_size_bytes": item.stored_size_bytes,
+        "sha256": item.sha256,
+        "status": item.status,
+        "created_at": item.created_at.isoformat() + 'Z',
+        "expires_at": item.expires_at.isoformat() + 'Z' if item.expires_at else None,
+        "download_url": None,
+        "archive_url": None
+    }
+    if item.item_type == 'file':
+        data['download_url'] = f"/download/{item.id}/{item.name}"
+    else:
+        data['archive_url'] = f"/archive/{item.id}/{item.name}.zip"
+        data['total_size_bytes'] = item.total_size_bytes
+        data['file_count'] = item.file_count
+    return data
+
+
+class Blob(db.Model):
+    """Contenu stocké une seule fois, référencé par tous les fichiers ayant le même SHA-256."""
+    __tablename__ = 'blob'
+    id = db.Column(db.Integer, primary_key=True)
+    sha256 = db.Column(db.String(64), nullable=False, unique=True)
+    size_bytes = db.Column(db.BigInteger, nullable=False)
+    # Codec de stockage sur le disque ('zstd') ; NULL pour un contenu stocké tel quel
+    codec = db.Column(db.String(16), nullable=True)
+    stored_size_bytes = db.Column(db.BigInteger, nullable=True)
+    # Volume de stockage (voir STORAGE_VOLUMES) ; NULL pour le volume par défaut, UPLOAD_FOLDER/.blobs
+    volume = db.Column(db.String(64), nullable=True)
+    # Nombre d'items pointant vers ce contenu ; le fichier est supprimé quand il retombe à 0
+    ref_count = db.Column(db.Integer, nullable=False, default=0)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
 
 
 class Log(db.Model):
@@ -49,6 +106,13 @@ class Log(db.Model):
     action = db.Column(db.String(50), nullable=False)
     details = db.Column(db.String(500))
 
+    __table_args__ = (
+        # Pagination par curseur (timestamp, id) et purge par ancienneté
+        db.Index('ix_log_timestamp_id', 'timestamp', 'id'),
+        # Filtre par action sur une période
+        db.Index('ix_log_action_timestamp', 'action', 'timestamp'),
+    )
+
     def to_dict(self):
         return {
             "id": self.id,
@@ -1,31 +1,20 @@
 import os
-import json
 import shutil
-from flask import Blueprint, jsonify, request, current_app
-from ..models import db, Item, Log
-from ..utils import admin_required
+from datetime import datetime
+from flask import Blueprint, jsonify, request, current_app, send_from_directory
+from sqlalchemy import tuple_
+from ..models import db, Item, Blob, Log
+from ..blobs import BLOB_DIRNAME
+from ..storage import get_volumes
+from ..settings import load_persistent_config, save_persistent_config, get_setting
+from ..audit import log_event, get_stats as get_audit_stats
+from .. import cache, database, events, writes
+from ..scrub import load_state as load_scrub_state
+from ..tasks import scrub_files, rebuild_folder_rollups
+from ..tree import usage_totals
+from ..utils import admin_required, encode_cursor, decode_cursor, sizeof_fmt
 
 admin_bp = Blueprint('admin_bp', __name__)
-CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'config.json')
-
-
-def load_persistent_config():
-    """Charge la configuration depuis config.json."""
-    if os.path.isfile(CONFIG_FILE):
-        try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    return {}
-
-
-def save_persistent_config(data):
-    """Sauvegarde la configuration dans config.json."""
-    current_config = load_persistent_config()
-    current_config.update(data)
-    with open(CONFIG_FILE, 'w') as f:
-        json.dump(current_config, f, indent=4)
 
 
 @admin_bp.route('/login', methods=['POST'])
@@ -43,7 +32,7 @@ def handle_config():
     """Gère la configuration (lit et écrit dans config.json)."""
     if request.method == 'POST':
         data = request.get_json()
-        current_config = load_persistent_config()
+        current_config = dict(load_persistent_config())
 
         config_keys = {
             'max_upload_mb': 'MAX_UPLOAD_MB',
@@ -60,46 +49,140 @@ def handle_config():
                     if value < 1:
                         return jsonify({"error": f"La valeur pour {key} doit être au moins de 1."}), 400
                     current_config[config_name] = value
-                    if config_name == 'MAX_UPLOAD_MB':
-                        current_app.config['MAX_CONTENT_LENGTH'] = value * 1024 * 1024
                 except (ValueError, TypeError):
                     return jsonify({"error": f"La valeur pour {key} doit être un nombre entier."}), 400
 
         save_persistent_config(current_config)
-        log = Log(action="CONFIG_UPDATE", details=f"Configuration mise à jour.")
-        db.session.add(log)
-        db.session.commit()
+        log_event("CONFIG_UPDATE", "Configuration mise à jour.")
         return jsonify({"message": "Configuration mise à jour."})
 
     # GET
-    persistent_config = load_persistent_config()
     return jsonify({
-        "max_upload_mb": persistent_config.get('MAX_UPLOAD_MB', current_app.config['MAX_UPLOAD_MB']),
-        "chunk_size_mb": persistent_config.get('CHUNK_SIZE_MB', current_app.config['CHUNK_SIZE_MB']),
-        "default_expiration_minutes": persistent_config.get('DEFAULT_EXPIRATION_MINUTES',
-                                                            current_app.config['DEFAULT_EXPIRATION_MINUTES']),
-        "max_expiration_minutes": persistent_config.get('MAX_EXPIRATION_MINUTES',
-                                                        current_app.config['MAX_EXPIRATION_MINUTES']),
-        "cleanup_frequency_hours": persistent_config.get('CLEANUP_EMPTY_FOLDERS_HOURS',
-                                                         current_app.config['CLEANUP_EMPTY_FOLDERS_HOURS'])
+        "max_upload_mb": get_setting('MAX_UPLOAD_MB'),
+        "chunk_size_mb": get_setting('CHUNK_SIZE_MB'),
+        "default_expiration_minutes": get_setting('DEFAULT_EXPIRATION_MINUTES'),
+        "max_expiration_minutes": get_setting('MAX_EXPIRATION_MINUTES'),
+        "cleanup_frequency_hours": get_setting('CLEANUP_EMPTY_FOLDERS_HOURS')
     })
 
 
 @admin_bp.route('/logs', methods=['GET'])
 @admin_required
 def get_logs():
-    """Récupère tous les logs, protégé par le décorateur."""
-    page = request.args.get('page', 1, type=int)
-    per_page = 20
-    logs_pagination = Log.query.order_by(Log.timestamp.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    logs = logs_pagination.items
+    """
+    Récupère les logs du plus récent au plus ancien, protégé par le décorateur.
+    Pagination par curseur (`cursor`, `limit`) et filtres optionnels `action`, `since` et `until` (ISO 8601).
+    """
+    limit = min(request.args.get('limit', 20, type=int), 200)
+    if limit < 1:
+        return jsonify({"error": "limit invalide"}), 400
+
+    query = Log.query
+    action = request.args.get('action')
+    if action:
+        query = query.filter(Log.action == action)
+    try:
+        since = request.args.get('since')
+        if since:
+            query = query.filter(Log.timestamp >= datetime.fromisoformat(since.rstrip('Z')))
+        until = request.args.get('until')
+        if until:
+            query = query.filter(Log.timestamp < datetime.fromisoformat(until.rstrip('Z')))
+    except ValueError:
+        return jsonify({"error": "Date invalide (format ISO 8601 attendu)."}), 400
+
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            last_timestamp, last_id = decode_cursor(cursor)
+            last_timestamp = datetime.fromisoformat(last_timestamp)
+        except (ValueError, TypeError):
+            return jsonify({"error": "cursor invalide"}), 400
+        query = query.filter(tuple_(Log.timestamp, Log.id) < tuple_(last_timestamp, last_id))
+
+    logs = query.order_by(Log.timestamp.desc(), Log.id.desc()).limit(limit + 1).all()
+    next_cursor = None
+    if len(logs) > limit:
+        last = logs[limit - 1]
+        next_cursor = encode_cursor([last.timestamp.isoformat(), last.id])
+
     return jsonify({
-        "logs": [log.to_dict() for log in logs],
-        "total_pages": logs_pagination.pages,
-        "current_page": page
+        "logs": [log.to_dict() for log in logs[:limit]],
+        "next_cursor": next_cursor
     })
 
 
+@admin_bp.route('/logs/archives', methods=['GET'])
+@admin_required
+def list_log_archives():
+    """Liste les segments d'archive des logs (un fichier compressé par jour)."""
+    archive_folder = current_app.config['LOG_ARCHIVE_FOLDER']
+    segments = []
+    if os.path.isdir(archive_folder):
+        for name in sorted(os.listdir(archive_folder), reverse=True):
+            if name.endswith('.jsonl.gz'):
+                segments.append({"name": name, "size_bytes": os.path.getsize(os.path.join(archive_folder, name))})
+    return jsonify({"archives": segments})
+
+
+@admin_bp.route('/logs/archives/<name>', methods=['GET'])
+@admin_required
+def download_log_archive(name):
+    """Télécharge un segment d'archive des logs."""
+    return send_from_directory(current_app.config['LOG_ARCHIVE_FOLDER'], name, as_attachment=True)
+
+
+@admin_bp.route('/audit/stats', methods=['GET'])
+@admin_required
+def audit_stats():
+    """Retourne l'état de la file d'écriture du journal (pour le processus ayant traité la requête)."""
+    return jsonify(get_audit_stats())
+
+
+@admin_bp.route('/cache/stats', methods=['GET'])
+@admin_required
+def cache_stats():
+    """Retourne les compteurs du cache des listings (pour le processus ayant traité la requête)."""
+    return jsonify(cache.get_stats())
+
+
+@admin_bp.route('/db/stats', methods=['GET'])
+@admin_required
+def db_stats():
+    """Retourne le moteur de base, ses réglages et la file d'écriture (pour le processus ayant traité la requête)."""
+    return jsonify({"database": database.get_stats(), "write_queue": writes.get_stats()})
+
+
+@admin_bp.route('/scrub', methods=['GET', 'POST'])
+@admin_required
+def scrub_report():
+    """Retourne l'état de la vérification d'intégrité (passage en cours ou dernier rapport) ; POST lance un passage."""
+    if request.method == 'POST':
+        scrub_files.delay()
+        return jsonify({"message": "Vérification d'intégrité lancée."}), 202
+    state = load_scrub_state(current_app)
+    if state is None:
+        return jsonify({"error": "Aucune vérification d'intégrité effectuée."}), 404
+    return jsonify(state)
+
+
+@admin_bp.route('/usage', methods=['GET'])
+@admin_required
+def storage_usage():
+    """Retourne l'espace utilisé et le nombre de fichiers, lus sur les totaux des dossiers de la racine."""
+    total_size, file_count = usage_totals()
+    return jsonify({"total_size_bytes": total_size, "total_size_human": sizeof_fmt(total_size),
+                    "file_count": file_count})
+
+
+@admin_bp.route('/usage/rebuild', methods=['POST'])
+@admin_required
+def rebuild_usage():
+    """Lance le recalcul des totaux de tous les dossiers (réparation)."""
+    rebuild_folder_rollups.delay()
+    return jsonify({"message": "Recalcul des totaux des dossiers lancé."}), 202
+
+
 @admin_bp.route('/purge', methods=['POST'])
 @admin_required
 def purge_files():
@@ -109,9 +192,16 @@ def purge_files():
     errors = []
 
     try:
+        # Base d'abord : si la suppression échoue, aucun contenu encore référencé n'a été effacé
+        num_rows_deleted = db.session.query(Item).delete()
+        db.session.query(Blob).delete()
+        db.session.commit()
+        cache.invalidate_all()
+        events.publish({"type": "resync", "parent_id": events.ALL_FOLDERS})
+
         for filename in os.listdir(upload_folder):
             file_path = os.path.join(upload_folder, filename)
-            if filename in ['tmp', 'app.db', '.gitkeep']:
+            if filename in ['tmp', 'app.db', '.gitkeep', BLOB_DIRNAME]:
                 continue
             try:
                 if os.path.isfile(file_path) or os.path.islink(file_path):
@@ -123,12 +213,15 @@ def purge_files():
             except Exception as e:
                 errors.append(f"Impossible de supprimer {filename}: {e}")
 
-        num_rows_deleted = db.session.query(Item).delete()
+        # Tous les items sont supprimés : plus aucun contenu n'est référencé, sur aucun volume
+        for volume in get_volumes().values():
+            try:
+                volume.purge()
+            except OSError as e:
+                errors.append(f"Impossible de vider le volume {volume.name}: {e}")
 
-        log_entry = Log(action="PURGE",
-                        details=f"{deleted_items_count} élément(s) supprimé(s) du disque et {num_rows_deleted} entrée(s) de la base de données.")
-        db.session.add(log_entry)
-        db.session.commit()
+        log_event("PURGE", f"{deleted_items_count} élément(s) supprimé(s) du disque et "
+                           f"{num_rows_deleted} entrée(s) de la base de données.")
 
         if errors:
             return jsonify(
@@ -1,12 +1,29 @@
 import os
-import json
+import time
 import shutil
-from flask import Blueprint, jsonify, request, send_from_directory, current_app
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from datetime import datetime, timedelta
+from flask import Blueprint, Response, jsonify, request, current_app
 from werkzeug.utils import secure_filename
-from sqlalchemy import text, asc
-from ..models import db, Item, Log
-from ..utils import sizeof_fmt
+from sqlalchemy import text, asc, func, literal, tuple_, or_, delete
+from sqlalchemy.orm import aliased
+from ..models import db, Item, ITEM_LIST_COLUMNS, item_to_dict
+from ..utils import sizeof_fmt, encode_cursor, decode_cursor
 from ..tasks import process_file_checksum, assemble_chunks
+from ..settings import get_setting
+from ..audit import log_event
+from .. import cache, events
+from ..downloads import send_stored_file
+from ..archives import ARCHIVE_MIMETYPES, send_directory_archive
+from ..metrics import UPLOAD_CHUNK_SECONDS, UPLOAD_CHUNK_BYTES
+from ..search import SEARCH_FIELDS, SEARCH_MODES, search_items, ancestors_by_path
+from ..tree import adjust_child_counts, child_added, children_removed, file_added, items_removed, items_moved
+from ..blobs import (find_blob, acquire_blob, release_blobs, remove_blob_files, orphan_blob_objects, item_object,
+                     item_codec)
+from ..uploads import (session_dir, open_session, load_session, write_chunk, pop_digest, mark_chunk_received,
+                       missing_chunks, is_assembling, claim_assembly, release_assembly)
 
 files_bp = Blueprint('files_bp', __name__)
 
@@ -25,149 +42,473 @@ def get_or_create_directory_path(full_path, parent_id):
     path_parts = full_path.strip(os.path.sep).split(os.path.sep)
 
     for part in path_parts:
-        if not part: continue
-        current_path = os.path.join(base_path, part)
+        safe_name = secure_filename(part)
+        if not safe_name: continue
+        current_path = os.path.join(base_path, safe_name)
         directory = Item.query.filter_by(path=current_path).first()
         if not directory:
-            safe_name = secure_filename(part)
-
             physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], current_path)
             os.makedirs(physical_path, exist_ok=True)
 
             directory = Item(name=safe_name, item_type='directory', path=current_path, parent_id=current_parent_id)
             db.session.add(directory)
+            child_added(current_parent_id)
             db.session.commit()
+            cache.invalidate_folders([current_parent_id])
         current_parent_id = directory.id
+        base_path = current_path
 
     return current_parent_id
 
 
-# Helper function to be used in this blueprint
-def load_persistent_config():
-    """Charge la configuration depuis config.json."""
-    CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', '..', 'config.json')
-    if os.path.isfile(CONFIG_FILE):
+def resolve_upload_target(parent_id_str, relative_path):
+    """Retourne le chemin et l'id du dossier de destination d'un upload (en créant les sous-dossiers)."""
+    parent_id = int(parent_id_str) if parent_id_str and parent_id_str != 'null' else None
+    target_path = ''
+    final_parent_id = parent_id
+
+    if parent_id:
+        parent_folder = Item.query.get(parent_id)
+        if parent_folder:
+            target_path = parent_folder.path
+
+    if relative_path:
+        dir_path = os.path.dirname(relative_path)
+        if dir_path:
+            final_parent_id = get_or_create_directory_path(dir_path, parent_id)
+            parent_folder = Item.query.get(final_parent_id)
+            if parent_folder:
+                target_path = parent_folder.path
+
+    return target_path, final_parent_id
+
+
+def clamp_expiration(expiration_minutes_str):
+    """Convertit la durée d'expiration demandée en la bornant au maximum configuré."""
+    try:
+        expiration_minutes = int(expiration_minutes_str)
+    except (ValueError, TypeError):
+        expiration_minutes = get_setting('DEFAULT_EXPIRATION_MINUTES')
+
+    return min(expiration_minutes, get_setting('MAX_EXPIRATION_MINUTES'))
+
+
+def rewrite_subtree_paths(old_path, new_path):
+    """Réécrit les chemins de tous les descendants d'un dossier déplacé, par un seul UPDATE."""
+    Item.query.filter(Item.path.startswith(f"{old_path}/", autoescape=True)).update(
+        {Item.path: literal(new_path) + func.substr(Item.path, len(old_path) + 1)},
+        synchronize_session=False)
+
+
+def subtree_filter(paths):
+    """Condition SQL sélectionnant les descendants de tous les dossiers donnés par leur chemin."""
+    return or_(*[Item.path.startswith(f"{path}/", autoescape=True) for path in paths])
+
+
+def outermost_ancestors(items):
+    """
+    Associe l'id de chaque item à son plus haut ancêtre présent dans la liste (lui-même s'il n'en a pas) :
+    un item contenu dans un dossier de la liste suit simplement ce dossier.
+    """
+    directories = {item.path: item for item in items if item.item_type == 'directory'}
+    outermost = {}
+    for item in items:
+        parts = item.path.split('/')
+        ancestor_paths = ('/'.join(parts[:depth]) for depth in range(1, len(parts)))
+        outermost[item.id] = next((directories[path] for path in ancestor_paths if path in directories), item)
+    return outermost
+
+
+def parse_item_ids(data):
+    """Valide la liste `ids` d'une requête groupée ; retourne (ids, None) ou (None, (message, code HTTP))."""
+    ids = data.get('ids')
+    if not isinstance(ids, list) or not ids or not all(isinstance(item_id, int) for item_id in ids):
+        return None, ("`ids` doit être une liste non vide d'identifiants.", 400)
+    if len(ids) > current_app.config['BULK_MAX_ITEMS']:
+        return None, (f"Au plus {current_app.config['BULK_MAX_ITEMS']} éléments par requête.", 400)
+    return list(dict.fromkeys(ids)), None
+
+
+def run_filesystem_operations(operations):
+    """
+    Exécute en parallèle des opérations disque indépendantes, données par des couples (id, fonction).
+    Retourne la liste des couples (id, message) en erreur, sans interrompre les autres opérations.
+    """
+    def run(operation):
+        item_id, function = operation
         try:
-            with open(CONFIG_FILE, 'r') as f:
-                return json.load(f)
-        except (json.JSONDecodeError, FileNotFoundError):
-            return {}
-    return {}
+            function()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            return item_id, str(e)
+        return item_id, None
+
+    with ThreadPoolExecutor(max_workers=current_app.config['BULK_FILESYSTEM_WORKERS']) as executor:
+        return [(item_id, error) for item_id, error in executor.map(run, operations) if error]
+
+
+def move_item(item, new_parent, new_name):
+    """
+    Renomme et/ou déplace un item sous `new_parent` (None pour la racine), sans commit.
+    Les chemins de tous les descendants sont réécrits par un seul UPDATE, sans les charger en mémoire.
+    Retourne None en cas de succès, ou un tuple (message d'erreur, code HTTP).
+    """
+    if new_parent is not None:
+        if new_parent.item_type != 'directory':
+            return "La destination doit être un dossier.", 400
+        if new_parent.id == item.id or new_parent.path.startswith(f"{item.path}/"):
+            return "Impossible de déplacer un dossier dans lui-même.", 400
+
+    old_path = item.path
+    new_path = os.path.join(new_parent.path if new_parent else '', new_name)
+    if new_path == old_path:
+        return None
+    if Item.query.filter_by(path=new_path).first():
+        return "Ce nom est déjà pris à cet emplacement.", 409
+
+    old_physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], old_path)
+    new_physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], new_path)
+    # Les fichiers stockés par empreinte n'ont pas d'emplacement physique propre
+    if os.path.exists(old_physical_path):
+        os.makedirs(os.path.dirname(new_physical_path), exist_ok=True)
+        os.rename(old_physical_path, new_physical_path)
+
+    if item.item_type == 'directory':
+        rewrite_subtree_paths(old_path, new_path)
+
+    new_parent_id = new_parent.id if new_parent else None
+    if new_parent_id != item.parent_id:
+        adjust_child_counts({item.parent_id: -1, new_parent_id: 1})
+
+    item.name = new_name
+    item.path = new_path
+    item.parent_id = new_parent_id
+    items_moved([(item, old_path)])
+    return None
+
+
+def get_breadcrumbs(folder_id):
+    """Retourne la liste des ancêtres d'un dossier (de la racine jusqu'à lui) en une seule requête récursive."""
+    ancestors = db.session.query(Item.id, Item.name, Item.parent_id, literal(0).label('depth')) \
+        .filter(Item.id == folder_id).cte('ancestors', recursive=True)
+    parent = aliased(Item)
+    ancestors = ancestors.union_all(
+        db.session.query(parent.id, parent.name, parent.parent_id, ancestors.c.depth + 1)
+        .join(ancestors, parent.id == ancestors.c.parent_id)
+    )
+    rows = db.session.query(ancestors.c.id, ancestors.c.name).order_by(ancestors.c.depth.desc()).all()
+    return [{"id": row.id, "name": row.name} for row in rows]
 
 
 # --- Routes API ---
 
 @files_bp.route('/public-config', methods=['GET'])
 def get_public_config():
-    """Retourne la configuration non-sensible pour le client."""
-    persistent_config = load_persistent_config()
-    max_upload_mb = persistent_config.get('MAX_UPLOAD_MB', current_app.config['MAX_UPLOAD_MB'])
-    chunk_size_mb = persistent_config.get('CHUNK_SIZE_MB', current_app.config['CHUNK_SIZE_MB'])
-    default_expiration = persistent_config.get('DEFAULT_EXPIRATION_MINUTES',
-                                               current_app.config['DEFAULT_EXPIRATION_MINUTES'])
-    max_expiration = persistent_config.get('MAX_EXPIRATION_MINUTES', current_app.config['MAX_EXPIRATION_MINUTES'])
-
-    return jsonify({
-        "max_filesize_mb": max_upload_mb,
-        "chunk_size_mb": chunk_size_mb,
-        "default_expiration_minutes": default_expiration,
-        "max_expiration_minutes": max_expiration
+    """
+    Retourne la configuration non-sensible pour le client, lue dans le cache mémoire des réglages.
+    Le navigateur la revalide par ETag : tant qu'elle n'a pas changé, la réponse est un 304 sans contenu.
+    """
+    response = jsonify({
+        "max_filesize_mb": get_setting('MAX_UPLOAD_MB'),
+        "chunk_size_mb": get_setting('CHUNK_SIZE_MB'),
+        "default_expiration_minutes": get_setting('DEFAULT_EXPIRATION_MINUTES'),
+        "max_expiration_minutes": get_setting('MAX_EXPIRATION_MINUTES'),
+        "events_enabled": current_app.config['EVENTS_ENABLED']
     })
+    response.add_etag()
+    response.headers['Cache-Control'] = 'no-cache'
+    return response.make_conditional(request)
 
 
 @files_bp.route('/items', methods=['GET'])
 def list_items():
-    """Liste les items (fichiers/dossiers) et le chemin (breadcrumbs)."""
+    """
+    Liste les items (fichiers/dossiers) d'un dossier et le chemin (breadcrumbs).
+    Pagination par curseur sur (item_type, name) : `limit` et `cursor` (valeur `next_cursor` de la page précédente).
+    """
     parent_id_str = request.args.get('parent_id')
-    breadcrumbs = []
+    limit = min(request.args.get('limit', current_app.config['LIST_PAGE_SIZE'], type=int),
+                current_app.config['LIST_MAX_PAGE_SIZE'])
+    if limit < 1:
+        return jsonify({"error": "limit invalide"}), 400
 
     if parent_id_str is None or parent_id_str == 'root':
         parent_id = None
-        items = Item.query.filter_by(parent_id=None).order_by(Item.item_type.asc(), Item.name.asc()).all()
+        breadcrumbs = []
     else:
         try:
             parent_id = int(parent_id_str)
-            parent = Item.query.get_or_404(parent_id)
-            items = parent.children.order_by(Item.item_type.asc(), Item.name.asc()).all()
-
-            curr = parent
-            while curr:
-                breadcrumbs.insert(0, {"id": curr.id, "name": curr.name})
-                curr = curr.parent
         except (ValueError, TypeError):
             return jsonify({"error": "parent_id invalide"}), 400
 
-    item_list = [item.to_dict() for item in items]
-    for item_data in item_list:
-        if item_data['item_type'] == 'file' and item_data['size_bytes'] is not None:
-            item_data['size_human'] = sizeof_fmt(item_data['size_bytes'])
+    # Page déjà calculée pour l'état actuel du dossier : aucune requête en base
+    cursor = request.args.get('cursor')
+    cached_body, stamp = cache.get_listing(parent_id, limit, cursor)
+    if cached_body is not None:
+        return Response(cached_body, mimetype='application/json')
 
-    return jsonify({
+    if parent_id is not None:
+        breadcrumbs = get_breadcrumbs(parent_id)
+        if not breadcrumbs:
+            return jsonify({"error": "Dossier introuvable."}), 404
+
+    # Projection sur les seules colonnes affichées : pas d'objets ORM à construire
+    query = db.session.query(*ITEM_LIST_COLUMNS).filter(Item.parent_id == parent_id)
+
+    if cursor:
+        try:
+            last_type, last_name = decode_cursor(cursor)
+        except ValueError:
+            return jsonify({"error": "cursor invalide"}), 400
+        query = query.filter(tuple_(Item.item_type, Item.name) > tuple_(last_type, last_name))
+
+    rows = query.order_by(Item.item_type.asc(), Item.name.asc()).limit(limit + 1).all()
+    next_cursor = encode_cursor([rows[limit - 1].item_type, rows[limit - 1].name]) if len(rows) > limit else None
+
+    item_list = []
+    for row in rows[:limit]:
+        item_data = item_to_dict(row)
+        size = row.size_bytes if row.item_type == 'file' else row.total_size_bytes
+        if size is not None:
+            item_data['size_human'] = sizeof_fmt(size)
+        item_list.append(item_data)
+
+    response = jsonify({
         "items": item_list,
         "breadcrumbs": breadcrumbs,
-        "current_folder_id": parent_id
+        "current_folder_id": parent_id,
+        "next_cursor": next_cursor
     })
+    cache.store_listing(parent_id, limit, cursor, stamp, response.get_data())
+    return response
+
+
+@files_bp.route('/events', methods=['GET'])
+def event_stream():
+    """
+    Flux Server-Sent Events des changements d'un dossier (`parent_id`, 'root' pour la racine) :
+    created, renamed, moved, updated (état complet de l'item), deleted, expired (ids supprimés),
+    assembly_failed, et resync lorsque le client doit relire le dossier.
+    """
+    if not current_app.config['EVENTS_ENABLED']:
+        return jsonify({"error": "Notifications désactivées."}), 404
+
+    parent_id_str = request.args.get('parent_id')
+    if parent_id_str is None or parent_id_str == 'root':
+        parent_id = None
+        ancestors = []
+    else:
+        try:
+            parent_id = int(parent_id_str)
+        except (ValueError, TypeError):
+            return jsonify({"error": "parent_id invalide"}), 400
+        breadcrumbs = get_breadcrumbs(parent_id)
+        if not breadcrumbs:
+            return jsonify({"error": "Dossier introuvable."}), 404
+        ancestors = [crumb['id'] for crumb in breadcrumbs]
+
+    # Pas de mise en tampon par nginx (X-Accel-Buffering) : chaque événement doit partir immédiatement
+    return Response(events.event_stream(parent_id, ancestors), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+
+@files_bp.route('/search', methods=['GET'])
+def search():
+    """
+    Recherche des fichiers et dossiers par nom ou chemin, avec le chemin (breadcrumbs) de chaque résultat.
+    Paramètres : `q`, `mode` (substring ou prefix), `field` (name ou path), `ext`, `parent_id` (dossier
+    dans lequel chercher), `limit` et `cursor` (valeur `next_cursor` de la page précédente).
+    """
+    term = (request.args.get('q') or '').strip()
+    extension = (request.args.get('ext') or '').strip()
+    if not term and not extension:
+        return jsonify({"error": "Paramètre `q` ou `ext` requis."}), 400
+    mode = request.args.get('mode', 'substring')
+    field = request.args.get('field', 'name')
+    if mode not in SEARCH_MODES or field not in SEARCH_FIELDS:
+        return jsonify({"error": "mode ou field invalide"}), 400
+    limit = min(request.args.get('limit', current_app.config['SEARCH_PAGE_SIZE'], type=int),
+                current_app.config['LIST_MAX_PAGE_SIZE'])
+    if limit < 1:
+        return jsonify({"error": "limit invalide"}), 400
+
+    scope_path = None
+    parent_id_str = request.args.get('parent_id')
+    if parent_id_str not in (None, '', 'root'):
+        try:
+            parent_id = int(parent_id_str)
+        except (ValueError, TypeError):
+            return jsonify({"error": "parent_id invalide"}), 400
+        folder = Item.query.get(parent_id)
+        if folder is None or folder.item_type != 'directory':
+            return jsonify({"error": "Dossier introuvable."}), 404
+        scope_path = folder.path
+
+    after_id = None
+    cursor = request.args.get('cursor')
+    if cursor:
+        try:
+            after_id = int(decode_cursor(cursor)[0])
+        except (ValueError, TypeError, IndexError):
+            return jsonify({"error": "cursor invalide"}), 400
+
+    rows = search_items(term, mode=mode, field=field, extension=extension, scope_path=scope_path,
+                        after_id=after_id, limit=limit + 1)
+    next_cursor = encode_cursor([rows[limit - 1].id]) if len(rows) > limit else None
+    rows = rows[:limit]
+
+    ancestors = ancestors_by_path([row.path for row in rows])
+    item_list = []
+    for row in rows:
+        item_data = item_to_dict(row)
+        item_data['breadcrumbs'] = ancestors[row.path]
+        size = row.size_bytes if row.item_type == 'file' else row.total_size_bytes
+        if size is not None:
+            item_data['size_human'] = sizeof_fmt(size)
+        item_list.append(item_data)
+
+    return jsonify({"items": item_list, "next_cursor": next_cursor})
 
 
 @files_bp.route('/upload', methods=['POST'])
 def upload_file():
-    """Gère l'upload de fichiers et délègue l'assemblage à une tâche de fond."""
+    """
+    Reçoit un morceau d'upload. Les morceaux peuvent arriver en parallèle et dans le désordre :
+    l'assemblage n'est délégué à une tâche de fond que lorsque tous ont été reçus.
+    """
+    started = time.perf_counter()
     file = request.files.get('file')
     if not file:
         return jsonify({"error": "Aucun fichier fourni"}), 400
 
-    parent_id_str = request.form.get('parent_id')
-    parent_id = int(parent_id_str) if parent_id_str and parent_id_str != 'null' else None
+    upload_uuid = request.form.get('dzuuid')
+    chunk_index = request.form.get('dzchunkindex', type=int)
+    total_chunks = request.form.get('dztotalchunkcount', type=int)
+    if total_chunks == 0:
+        # Dropzone annonce 0 morceau pour un fichier vide, mais en envoie un
+        total_chunks = 1
+    if not upload_uuid or chunk_index is None or not total_chunks or not 0 <= chunk_index < total_chunks:
+        return jsonify({"error": "Paramètres de morceau invalides."}), 400
+
+    total_size = request.form.get('dztotalfilesize', type=int)
+    streaming = current_app.config['UPLOAD_ASSEMBLY_MODE'] == 'streaming'
+    offset = request.form.get('dzchunkbyteoffset', type=int)
+    if streaming and offset is None:
+        # Position du morceau dans le fichier : sans elle, tous les morceaux s'écraseraient à l'octet 0
+        chunk_size = request.form.get('dzchunksize', type=int)
+        if not chunk_size and chunk_index > 0:
+            return jsonify({"error": "dzchunkbyteoffset ou dzchunksize requis."}), 400
+        offset = chunk_index * (chunk_size or 0)
+
+    temp_dir = session_dir(current_app.config['UPLOAD_FOLDER'], upload_uuid)
+    if is_assembling(temp_dir):
+        # Renvoi tardif d'un morceau déjà reçu : l'assemblage est déjà lancé
+        return jsonify({"message": "Upload déjà complet."}), 200
+
+    open_session(temp_dir, total_chunks, total_size, file.filename)
+    if streaming:
+        # Le morceau est écrit à sa position finale : pas de fichier .chunk intermédiaire
+        chunk_bytes = write_chunk(temp_dir, upload_uuid, file.stream, offset, total_size)
+    else:
+        chunk_path = os.path.join(temp_dir, f"{chunk_index}.chunk")
+        file.save(chunk_path)
+        chunk_bytes = os.path.getsize(chunk_path)
+    mark_chunk_received(temp_dir, chunk_index)
+    UPLOAD_CHUNK_SECONDS.observe(time.perf_counter() - started)
+    UPLOAD_CHUNK_BYTES.observe(chunk_bytes)
+
+    if not claim_assembly(temp_dir, total_chunks):
+        return jsonify({"message": "Morceau reçu."}), 200
 
-    expiration_minutes_str = request.form.get('expiration_minutes')
+    # Tous les morceaux sont là : résolution de la destination, une seule fois par fichier
     try:
-        expiration_minutes = int(expiration_minutes_str)
-    except (ValueError, TypeError):
-        expiration_minutes = current_app.config['DEFAULT_EXPIRATION_MINUTES']
-
-    persistent_config = load_persistent_config()
-    max_minutes = persistent_config.get('MAX_EXPIRATION_MINUTES', current_app.config['MAX_EXPIRATION_MINUTES'])
-    if expiration_minutes > max_minutes:
-        expiration_minutes = max_minutes
-
-    relative_path = request.form.get('webkitRelativePath')
-    target_path = ''
-    final_parent_id = parent_id
+        target_path, final_parent_id = resolve_upload_target(request.form.get('parent_id'),
+                                                             request.form.get('webkitRelativePath'))
+        expiration_minutes = clamp_expiration(request.form.get('expiration_minutes'))
+
+        assemble_chunks.delay(
+            upload_uuid=upload_uuid,
+            total_chunks=total_chunks,
+            original_filename=file.filename,
+            target_path=target_path,
+            parent_id=final_parent_id,
+            expiration_minutes=expiration_minutes,
+            sha256=pop_digest(upload_uuid, total_size) if streaming else None
+        )
+    except Exception as e:
+        # Assemblage non lancé : sans cela, tout renvoi du morceau répondrait « Upload déjà complet. »
+        release_assembly(temp_dir)
+        if isinstance(e, ValueError):
+            return jsonify({"error": "parent_id invalide"}), 400
+        raise
 
-    if parent_id:
-        parent_folder = Item.query.get(parent_id)
-        if parent_folder:
-            target_path = parent_folder.path
+    return jsonify({"message": "Upload terminé, assemblage en cours..."}), 202
 
-    if relative_path:
-        dir_path = os.path.dirname(relative_path)
-        if dir_path:
-            final_parent_id = get_or_create_directory_path(dir_path, parent_id)
-            parent_folder = Item.query.get(final_parent_id)
-            if parent_folder:
-                target_path = parent_folder.path
 
-    upload_uuid = request.form.get('dzuuid')
-    chunk_index = request.form.get('dzchunkindex', type=int)
-    total_chunks = request.form.get('dztotalchunkcount', type=int)
+@files_bp.route('/upload/<upload_uuid>/status', methods=['GET'])
+def upload_status(upload_uuid):
+    """Retourne l'état d'une session d'upload et les morceaux manquants, pour reprendre un upload interrompu."""
+    temp_dir = session_dir(current_app.config['UPLOAD_FOLDER'], upload_uuid)
+    session = load_session(temp_dir)
+    if session is None:
+        return jsonify({"error": "Session d'upload introuvable."}), 404
 
-    temp_dir = os.path.join(current_app.config['UPLOAD_FOLDER'], 'tmp', upload_uuid)
-    os.makedirs(temp_dir, exist_ok=True)
-    file.save(os.path.join(temp_dir, f"{chunk_index}.chunk"))
+    total_chunks = session['total_chunks']
+    missing = missing_chunks(temp_dir, total_chunks)
+    return jsonify({
+        "upload_uuid": upload_uuid,
+        "filename": session['filename'],
+        "total_chunks": total_chunks,
+        "total_size": session['total_size'],
+        "received_count": total_chunks - len(missing),
+        "missing_chunks": missing,
+        "status": "assembling" if is_assembling(temp_dir) else "receiving"
+    })
 
-    if chunk_index < total_chunks - 1:
-        return jsonify({"message": "Morceau reçu."}), 200
 
-    assemble_chunks.delay(
-        upload_uuid=upload_uuid,
-        total_chunks=total_chunks,
-        original_filename=file.filename,
-        target_path=target_path,
-        parent_id=final_parent_id,
-        expiration_minutes=expiration_minutes
-    )
+@files_bp.route('/upload/dedup', methods=['POST'])
+def upload_dedup():
+    """
+    Crée un fichier à partir d'un contenu déjà stocké, identifié par son SHA-256, sans renvoyer les octets.
+    Répond 404 si le contenu est inconnu : le client doit alors l'uploader normalement.
+    """
+    data = request.get_json() or {}
+    sha256 = (data.get('sha256') or '').lower()
+    filename = data.get('filename')
+    if len(sha256) != 64 or not filename:
+        return jsonify({"error": "Les champs sha256 et filename sont requis."}), 400
+
+    blob = find_blob(sha256)
+    if blob is None:
+        return jsonify({"exists": False}), 404
+
+    target_path, parent_id = resolve_upload_target(data.get('parent_id'), data.get('webkitRelativePath'))
+    expiration_minutes = clamp_expiration(data.get('expiration_minutes'))
+
+    final_filename = secure_filename(filename)
+    final_item_path = os.path.join(target_path, final_filename)
+    if Item.query.filter_by(path=final_item_path).first():
+        return jsonify({"error": "Un dossier ou fichier avec ce nom existe déjà."}), 409
+    if acquire_blob(blob) is None:
+        # Dernière référence libérée depuis find_blob() : le contenu va être effacé
+        return jsonify({"exists": False}), 404
+
+    now = datetime.utcnow()
+    new_item = Item(name=final_filename, item_type='file', path=final_item_path,
+                    parent_id=parent_id, size_bytes=blob.size_bytes,
+                    stored_size_bytes=blob.stored_size_bytes or blob.size_bytes,
+                    status='processed', sha256=sha256, blob_id=blob.id,
+                    created_at=now, expires_at=now + timedelta(minutes=expiration_minutes))
+    db.session.add(new_item)
+    child_added(parent_id)
+    file_added(final_item_path, blob.size_bytes)
+    db.session.commit()
+    log_event("UPLOAD_DEDUP", f"Fichier '{final_item_path}' créé depuis un contenu existant.")
+    cache.invalidate_paths([final_item_path])
+    events.publish(events.item_event('created', new_item))
 
-    return jsonify({"message": "Upload terminé, assemblage en cours..."}), 202
+    return jsonify({"exists": True, "item": new_item.to_dict()}), 201
 
 
 @files_bp.route('/directories', methods=['POST'])
@@ -197,9 +538,11 @@ def create_directory():
 
     new_dir = Item(name=safe_name, item_type='directory', path=new_path, parent_id=parent_id)
     db.session.add(new_dir)
-    log = Log(action="CREATE_DIR", details=f"Dossier '{new_path}' créé.")
-    db.session.add(log)
+    child_added(parent_id)
     db.session.commit()
+    log_event("CREATE_DIR", f"Dossier '{new_path}' créé.")
+    cache.invalidate_folders([parent_id])
+    events.publish(events.item_event('created', new_dir))
 
     return jsonify(new_dir.to_dict()), 201
 
@@ -211,15 +554,33 @@ def delete_item(item_id):
     physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], item.path)
 
     try:
-        if item.item_type == 'directory' and os.path.exists(physical_path):
-            shutil.rmtree(physical_path)
-        elif item.item_type == 'file' and os.path.exists(physical_path):
-            os.remove(physical_path)
-
-        log = Log(action="DELETE_ITEM", details=f"Item '{item.path}' supprimé.")
-        db.session.add(log)
+        if item.item_type == 'directory':
+            blob_ids = [row.blob_id for row in db.session.query(Item.blob_id).filter(
+                Item.path.startswith(f"{item.path}/", autoescape=True), Item.blob_id.isnot(None))]
+            if os.path.exists(physical_path):
+                shutil.rmtree(physical_path)
+        else:
+            blob_ids = [item.blob_id]
+            if not item.blob_id and os.path.exists(physical_path):
+                os.remove(physical_path)
+
+        children_removed([item.parent_id])
+        items_removed([item])
+        deleted_path = item.path
+        removed = events.removal_events('deleted', [item])
+        removed_directory = item.item_type == 'directory'
         db.session.delete(item)
+        # Les blobs ne sont libérés qu'une fois les items qui les référencent supprimés (clés étrangères)
+        db.session.flush()
+        released = release_blobs(blob_ids)
         db.session.commit()
+        remove_blob_files(released)
+        log_event("DELETE_ITEM", f"Item '{deleted_path}' supprimé.")
+        if removed_directory:
+            cache.invalidate_all()
+        else:
+            cache.invalidate_paths([deleted_path])
+        events.publish(*removed)
         return jsonify({"message": "Élément supprimé avec succès."})
     except Exception as e:
         db.session.rollback()
@@ -234,41 +595,250 @@ def rename_item(item_id):
     if not new_name_base:
         return jsonify({"error": "Le nom ne peut pas être vide."}), 400
 
-    parent_path = os.path.dirname(item.path)
-    old_path = item.path
-
     if item.item_type == 'file':
         _, ext = os.path.splitext(item.name)
         new_name = f"{secure_filename(new_name_base)}{ext}"
     else:  # directory
         new_name = secure_filename(new_name_base)
 
-    new_path = os.path.join(parent_path, new_name)
+    old_path = item.path
+    try:
+        error = move_item(item, item.parent, new_name)
+        if error:
+            return jsonify({"error": error[0]}), error[1]
 
-    if Item.query.filter_by(path=new_path).first():
-        return jsonify({"error": "Ce nom est déjà pris à cet emplacement."}), 409
+        db.session.commit()
+        log_event("RENAME_ITEM", f"'{old_path}' renommé en '{item.path}'.")
+        # Renommer un dossier change le fil d'Ariane de tous ses descendants
+        if item.item_type == 'directory':
+            cache.invalidate_all()
+        else:
+            cache.invalidate_folders([item.parent_id])
+        events.publish(events.item_event('renamed', item))
+        return jsonify({"message": "Élément renommé avec succès."})
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
 
-    old_physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], old_path)
-    new_physical_path = os.path.join(current_app.config['UPLOAD_FOLDER'], new_path)
 
+@files_bp.route('/items/<int:item_id>/move', methods=['PUT'])
+def move_item_route(item_id):
+    """Déplace un fichier ou un dossier vers un autre dossier (`parent_id`, null pour la racine)."""
+    item = Item.query.get_or_404(item_id)
+    data = request.get_json() or {}
+    parent_id = data.get('parent_id')
+
+    new_parent = None
+    if parent_id not in (None, 'root'):
+        new_parent = Item.query.get(parent_id)
+        if new_parent is None:
+            return jsonify({"error": "Dossier de destination introuvable."}), 404
+
+    old_path = item.path
+    old_parent_id = item.parent_id
     try:
+        error = move_item(item, new_parent, item.name)
+        if error:
+            return jsonify({"error": error[0]}), error[1]
+
+        db.session.commit()
+        log_event("MOVE_ITEM", f"'{old_path}' déplacé vers '{item.path}'.")
+        if item.item_type == 'directory':
+            cache.invalidate_all()
+        else:
+            cache.invalidate_paths([old_path, item.path])
+        events.publish(*_move_events([(item, old_parent_id, old_path)]))
+        return jsonify(item.to_dict())
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+
+def _move_events(moves):
+    """
+    Un déplacement, donné par (item, ancien dossier, ancien chemin), est signalé à l'ancien dossier
+    (qui retire l'élément) et au nouveau (qui l'affiche).
+    """
+    published = []
+    for item, old_parent_id, _ in moves:
+        published.append(events.item_event('moved', item, parent_id=old_parent_id))
+        if item.parent_id != old_parent_id:
+            published.append(events.item_event('moved', item))
+    return published
+
+
+def _rename_physical(old_physical_path, new_physical_path):
+    # Les fichiers stockés par empreinte n'ont pas d'emplacement physique propre
+    if os.path.exists(old_physical_path):
+        os.makedirs(os.path.dirname(new_physical_path), exist_ok=True)
         os.rename(old_physical_path, new_physical_path)
 
+
+def _bulk_results(ids, results, outermost):
+    """Résultat par id demandé : celui de l'item, de son ancêtre sélectionné qu'il suit, ou 'not_found'."""
+    response = []
+    for item_id in ids:
+        owner = outermost.get(item_id)
+        result = results[owner.id] if owner is not None else {"status": "not_found"}
+        response.append(dict(result, id=item_id))
+    return response
+
+
+def _report_filesystem_errors(results, errors):
+    for item_id, message in errors:
+        if item_id is None:
+            current_app.logger.warning(f"Erreur disque lors d'une opération groupée: {message}")
+        else:
+            results[item_id].update(status="error", error=message)
+
+
+@files_bp.route('/items/bulk-delete', methods=['POST'])
+def bulk_delete_items():
+    """
+    Supprime plusieurs fichiers ou dossiers (`ids`) : les ids sont résolus par une seule requête et la base
+    modifiée en une seule transaction ; le disque est nettoyé ensuite, en parallèle, avec un résultat par élément.
+    """
+    ids, error = parse_item_ids(request.get_json(silent=True) or {})
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    found = Item.query.filter(Item.id.in_(ids)).all()
+    outermost = outermost_ancestors(found)
+    items = [item for item in found if outermost[item.id] is item]
+    results = {item.id: {} for item in items}
+    if not items:
+        return jsonify({"deleted": 0, "results": _bulk_results(ids, results, outermost)})
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    filesystem_operations = []
+    blob_ids = []
+    for item in items:
+        physical_path = os.path.join(upload_folder, item.path)
         if item.item_type == 'directory':
-            descendants = Item.query.filter(Item.path.startswith(f"{old_path}/")).all()
-            for descendant in descendants:
-                descendant.path = descendant.path.replace(old_path, new_path, 1)
-
-        item.name = new_name
-        item.path = new_path
-        log = Log(action="RENAME_ITEM", details=f"'{old_path}' renommé en '{new_path}'.")
-        db.session.add(log)
+            filesystem_operations.append((item.id, partial(shutil.rmtree, physical_path)))
+        elif item.blob_id:
+            blob_ids.append(item.blob_id)
+        else:
+            filesystem_operations.append((item.id, partial(os.remove, physical_path)))
+
+    try:
+        directory_paths = [item.path for item in items if item.item_type == 'directory']
+        children_removed([item.parent_id for item in items])
+        items_removed(items)
+        deleted_paths = [item.path for item in items]
+        removed = events.removal_events('deleted', items)
+        if directory_paths:
+            subtree = subtree_filter(directory_paths)
+            blob_ids += [row.blob_id for row in db.session.query(Item.blob_id).filter(
+                subtree, Item.blob_id.isnot(None))]
+            db.session.execute(delete(Item).where(subtree))
+        db.session.execute(delete(Item).where(Item.id.in_([item.id for item in items])))
+        # Les blobs ne sont libérés qu'une fois les items qui les référencent supprimés (clés étrangères)
+        released = release_blobs(blob_ids)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        return jsonify({"error": str(e)}), 500
+
+    for item in items:
+        results[item.id]["status"] = "deleted"
+    filesystem_operations += [(None, stored.delete) for stored in orphan_blob_objects(released)]
+    _report_filesystem_errors(results, run_filesystem_operations(filesystem_operations))
+
+    log_event("BULK_DELETE", f"{len(items)} élément(s) supprimé(s) : {', '.join(deleted_paths[:10])}"
+                             f"{'...' if len(deleted_paths) > 10 else ''}")
+    if directory_paths:
+        cache.invalidate_all()
+    else:
+        cache.invalidate_paths(deleted_paths)
+    events.publish(*removed)
+    return jsonify({"deleted": len(items), "results": _bulk_results(ids, results, outermost)})
+
+
+@files_bp.route('/items/bulk-move', methods=['POST'])
+def bulk_move_items():
+    """
+    Déplace plusieurs fichiers ou dossiers (`ids`) vers un dossier (`parent_id`, null pour la racine),
+    en une seule transaction ; les déplacements sur le disque sont faits ensuite, en parallèle.
+    Les éléments refusés (nom déjà pris, dossier déplacé dans lui-même) sont signalés individuellement.
+    """
+    data = request.get_json(silent=True) or {}
+    ids, error = parse_item_ids(data)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    new_parent = None
+    parent_id = data.get('parent_id')
+    if parent_id not in (None, 'root'):
+        new_parent = Item.query.get(parent_id)
+        if new_parent is None:
+            return jsonify({"error": "Dossier de destination introuvable."}), 404
+        if new_parent.item_type != 'directory':
+            return jsonify({"error": "La destination doit être un dossier."}), 400
+    new_parent_id = new_parent.id if new_parent else None
+
+    found = Item.query.filter(Item.id.in_(ids)).all()
+    outermost = outermost_ancestors(found)
+    items = [item for item in found if outermost[item.id] is item]
+    results = {item.id: {} for item in items}
+
+    # Noms déjà présents dans le dossier de destination, en une seule requête
+    taken_names = {row.name for row in db.session.query(Item.name).filter(
+        Item.parent_id == new_parent_id, Item.name.in_([item.name for item in items]))}
+
+    upload_folder = current_app.config['UPLOAD_FOLDER']
+    filesystem_operations = []
+    child_deltas = Counter()
+    moves = []
+    try:
+        for item in items:
+            result = results[item.id]
+            if item.parent_id == new_parent_id:
+                result["status"] = "unchanged"
+                continue
+            if new_parent is not None and (new_parent.id == item.id or new_parent.path.startswith(f"{item.path}/")):
+                result.update(status="error", error="Impossible de déplacer un dossier dans lui-même.")
+                continue
+            if item.name in taken_names:
+                result.update(status="error", error="Ce nom est déjà pris à cet emplacement.")
+                continue
+            taken_names.add(item.name)
+
+            old_path = item.path
+            new_path = os.path.join(new_parent.path if new_parent else '', item.name)
+            if item.item_type == 'directory':
+                rewrite_subtree_paths(old_path, new_path)
+            moves.append((item, item.parent_id, old_path))
+            child_deltas[item.parent_id] -= 1
+            child_deltas[new_parent_id] += 1
+            item.path = new_path
+            item.parent_id = new_parent_id
+            filesystem_operations.append((item.id, partial(_rename_physical, os.path.join(upload_folder, old_path),
+                                                            os.path.join(upload_folder, new_path))))
+            result["status"] = "moved"
+
+        adjust_child_counts(child_deltas)
+        items_moved([(item, old_path) for item, _, old_path in moves])
+        # Préparés avant le commit, qui expire les objets chargés
+        moved = _move_events(moves)
+        moved_paths = [path for item, _, old_path in moves for path in (old_path, item.path)]
+        moved_directory = any(item.item_type == 'directory' for item, _, _ in moves)
         db.session.commit()
-        return jsonify({"message": "Élément renommé avec succès."})
     except Exception as e:
         db.session.rollback()
         return jsonify({"error": str(e)}), 500
 
+    _report_filesystem_errors(results, run_filesystem_operations(filesystem_operations))
+    if moves:
+        destination = new_parent.path if new_parent else "la racine"
+        log_event("BULK_MOVE", f"{len(moves)} élément(s) déplacé(s) vers '{destination}'.")
+        if moved_directory:
+            cache.invalidate_all()
+        else:
+            cache.invalidate_paths(moved_paths)
+        events.publish(*moved)
+    return jsonify({"moved": len(moves), "results": _bulk_results(ids, results, outermost)})
+
 
 @files_bp.route('/download/<int:item_id>/<filename>', methods=['GET'])
 def download_file(item_id, filename):
@@ -280,7 +850,32 @@ def download_file(item_id, filename):
     if item.item_type != 'file':
         return jsonify({"error": "Ne peut télécharger que des fichiers."}), 400
 
-    log = Log(action="DOWNLOAD", details=f"Fichier '{item.path}' téléchargé.")
-    db.session.add(log)
-    db.session.commit()
-    return send_from_directory(current_app.config['UPLOAD_FOLDER'], item.path, as_attachment=True)
\ No newline at end of file
+    stored = item_object(item)
+    if not stored.exists():
+        return jsonify({"error": "Fichier introuvable sur le disque."}), 404
+
+    response = send_stored_file(stored, item.name, etag=item.sha256, codec=item_codec(item), size=item.size_bytes)
+    # Seul le début d'un téléchargement est journalisé (pas les reprises ni les validations de cache)
+    if response.status_code == 200 or response.headers.get('Content-Range', '').startswith('bytes 0-'):
+        log_event("DOWNLOAD", f"Fichier '{item.path}' téléchargé.")
+    return response
+
+
+@files_bp.route('/archive/<int:item_id>/<filename>', methods=['GET'])
+def download_archive(item_id, filename):
+    """
+    Télécharge un dossier et tout son contenu sous forme d'archive générée à la volée.
+    Le format est donné par l'extension (`<nom>.zip` ou `<nom>.tar`) ; `compress` active la compression du ZIP.
+    """
+    item = Item.query.get_or_404(item_id)
+    if item.item_type != 'directory':
+        return jsonify({"error": "Seuls les dossiers peuvent être téléchargés en archive."}), 400
+
+    base_name, _, archive_format = filename.rpartition('.')
+    if base_name != item.name or archive_format not in ARCHIVE_MIMETYPES:
+        return jsonify({"error": "Nom d'archive incorrect."}), 404
+
+    compress = request.args.get('compress', str(current_app.config['ARCHIVE_ZIP_COMPRESS'])).lower() in ('1', 'true')
+    response = send_directory_archive(item, archive_format, compress=compress)
+    log_event("DOWNLOAD_ARCHIVE", f"Dossier '{item.path}' téléchargé en {archive_format.upper()}.")
+    return response
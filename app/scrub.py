@@ -0,0 +1,161 @@
+import os
+import json
+import mmap
+import time
+import hashlib
+from datetime import datetime, timedelta
+from sqlalchemy import or_
+from . import db
+from .models import Item, Blob
+from .blobs import item_object
+from .compression import read_content
+
+# Nombre maximal de fichiers en erreur détaillés dans le rapport (les compteurs restent exacts)
+MAX_REPORTED_FILES = 200
+
+
+def state_path(app):
+    """Fichier de reprise de la vérification d'intégrité (passage en cours ou dernier rapport)."""
+    return os.path.join(app.config['DB_FOLDER'], 'scrub_state.json')
+
+
+def load_state(app):
+    path = state_path(app)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def save_state(app, state):
+    # Écriture atomique : un arrêt brutal laisse l'ancien point de reprise intact
+    path = state_path(app)
+    with open(f"{path}.tmp", 'w') as f:
+        json.dump(state, f)
+    os.replace(f"{path}.tmp", path)
+
+
+def new_pass(reverify_days):
+    """Démarre un passage : seuls les fichiers jamais vérifiés ou vérifiés avant `cutoff` seront relus."""
+    now = datetime.utcnow()
+    return {
+        "started_at": now.isoformat(),
+        "cutoff": (now - timedelta(days=reverify_days)).isoformat(),
+        "finished_at": None,
+        "files_checked": 0,
+        "bytes_read": 0,
+        "mismatch_count": 0,
+        "missing_count": 0,
+        "mismatches": [],
+        "missing": [],
+    }
+
+
+def next_batch(cutoff, batch_size):
+    """
+    Prochains fichiers à vérifier : jamais vérifiés d'abord, puis du moins récemment vérifié au plus récent.
+    Les fichiers partageant un même contenu sont regroupés pour n'être lus qu'une fois.
+    """
+    rows = db.session.query(Item.id, Item.path, Item.sha256, Item.blob_id, Blob.codec, Blob.volume) \
+        .outerjoin(Blob, Item.blob_id == Blob.id) \
+        .filter(Item.item_type == 'file', Item.sha256.isnot(None),
+                or_(Item.verified_at.is_(None), Item.verified_at < cutoff)) \
+        .order_by(Item.verified_at.asc().nullsfirst(), Item.id.asc()) \
+        .limit(batch_size).all()
+
+    targets = {}
+    for row in rows:
+        key = ('blob', row.blob_id) if row.blob_id else ('item', row.id)
+        targets.setdefault(key, {"path": row.path, "source": item_object(row, row.volume), "codec": row.codec,
+                                 "sha256": row.sha256})
+    return targets
+
+
+class RateLimiter:
+    """Limite le débit de lecture d'un thread (octets par seconde ; 0 = illimité)."""
+
+    def __init__(self, bytes_per_second):
+        self.bytes_per_second = bytes_per_second
+        self.started = time.monotonic()
+        self.consumed = 0
+
+    def consume(self, count):
+        if not self.bytes_per_second:
+            return
+        self.consumed += count
+        delay = self.consumed / self.bytes_per_second - (time.monotonic() - self.started)
+        if delay > 0:
+            time.sleep(delay)
+
+
+def hash_stored_file(source, codec, buffer_size, bytes_per_second=0):
+    """
+    Calcule le SHA-256 du contenu d'origine d'un objet stocké ; retourne (empreinte, octets lus),
+    ou (None, 0) si le fichier est absent.
+    Un fichier local non compressé est projeté en mémoire (mmap) et haché par tranches de `buffer_size`,
+    sans copie ; hashlib relâche le GIL, ce qui permet de hacher plusieurs fichiers en parallèle par threads.
+    """
+    limiter = RateLimiter(bytes_per_second)
+    sha256_hash = hashlib.sha256()
+    read = 0
+    try:
+        if codec is not None or source.local_path is None:
+            for block in read_content(source, codec):
+                sha256_hash.update(block)
+                read += len(block)
+                limiter.consume(len(block))
+            return sha256_hash.hexdigest(), read
+
+        with open(source.local_path, 'rb') as f:
+            size = os.fstat(f.fileno()).st_size
+            if size == 0:
+                return sha256_hash.hexdigest(), 0
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                view = memoryview(mapped)
+                try:
+                    for offset in range(0, size, buffer_size):
+                        block = view[offset:offset + buffer_size]
+                        sha256_hash.update(block)
+                        read += len(block)
+                        limiter.consume(len(block))
+                        block.release()
+                finally:
+                    view.release()
+        return sha256_hash.hexdigest(), read
+    except FileNotFoundError:
+        return None, 0
+
+
+def record_results(state, targets, results):
+    """
+    Enregistre le résultat d'un lot : date de vérification de tous les items concernés,
+    statut 'error' pour les contenus absents, illisibles (résultat (None, 0)) ou corrompus
+    (à committer par l'appelant).
+    """
+    now = datetime.utcnow()
+    for key, target in targets.items():
+        digest, read = results[key]
+        kind, target_id = key
+        scope = Item.blob_id == target_id if kind == 'blob' else Item.id == target_id
+        values = {Item.verified_at: now}
+
+        state['files_checked'] += 1
+        state['bytes_read'] += read
+        if digest is None:
+            state['missing_count'] += 1
+            if len(state['missing']) < MAX_REPORTED_FILES:
+                state['missing'].append(target['path'])
+            values[Item.status] = 'error'
+        elif digest != target['sha256']:
+            state['mismatch_count'] += 1
+            if len(state['mismatches']) < MAX_REPORTED_FILES:
+                state['mismatches'].append({"path": target['path'], "expected": target['sha256'], "actual": digest})
+            values[Item.status] = 'error'
+        db.session.query(Item).filter(scope).update(values, synchronize_session=False)
+
+
+def report_summary(state):
+    """Résumé d'un passage, écrit dans une seule entrée de log."""
+    return (f"Vérification d'intégrité : {state['files_checked']} contenu(s), "
+            f"{state['bytes_read'] / (1024 ** 3):.1f} Gio lus, {state['mismatch_count']} corrompu(s), "
+            f"{state['missing_count']} manquant(s).")
@@ -0,0 +1,141 @@
+from flask import current_app
+from sqlalchemy import column, inspect, table, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from . import db
+from .models import Item, ITEM_LIST_COLUMNS
+
+# Index plein texte (SQLite FTS5, tokenizer trigram) sur le nom et le chemin des items.
+# Table à contenu externe : seul l'index est stocké, les triggers le tiennent à jour à chaque écriture
+# sur `item`, y compris les UPDATE et DELETE ensemblistes (déplacements, purges, expiration).
+ITEM_FTS = table('item_fts', column('rowid'))
+
+FTS_SCHEMA = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS item_fts USING fts5("
+    "name, path, content='item', content_rowid='id', tokenize='trigram')",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_insert AFTER INSERT ON item BEGIN "
+    "INSERT INTO item_fts(rowid, name, path) VALUES (new.id, new.name, new.path); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_delete AFTER DELETE ON item BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, path) VALUES ('delete', old.id, old.name, old.path); END",
+    "CREATE TRIGGER IF NOT EXISTS item_fts_update AFTER UPDATE OF name, path ON item BEGIN "
+    "INSERT INTO item_fts(item_fts, rowid, name, path) VALUES ('delete', old.id, old.name, old.path); "
+    "INSERT INTO item_fts(rowid, name, path) VALUES (new.id, new.name, new.path); END",
+)
+
+# PostgreSQL : pas de FTS5, les conditions ILIKE sur le nom et le chemin sont servies par des index trigram GIN
+# (extension pg_trgm, dont la création demande le droit CREATE sur la base)
+POSTGRESQL_TRGM_SCHEMA = (
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    "CREATE INDEX IF NOT EXISTS ix_item_name_trgm ON item USING gin (name gin_trgm_ops)",
+    "CREATE INDEX IF NOT EXISTS ix_item_path_trgm ON item USING gin (path gin_trgm_ops)",
+)
+
+# Le tokenizer trigram ne peut exploiter que des termes d'au moins 3 caractères
+MIN_TRIGRAM_LENGTH = 3
+
+SEARCH_FIELDS = {'name': Item.name, 'path': Item.path}
+SEARCH_MODES = ('substring', 'prefix')
+
+_state = {'fts_available': None}
+
+
+def init_search_index():
+    """
+    Crée l'index de recherche : table FTS5 et triggers sous SQLite (un nouvel index est rempli à sa création),
+    index trigram sous PostgreSQL.
+    """
+    if db.engine.dialect.name == 'postgresql':
+        _init_trigram_indexes()
+        return
+    if db.engine.dialect.name != 'sqlite':
+        return
+    created = not inspect(db.engine).has_table('item_fts')
+    try:
+        for statement in FTS_SCHEMA:
+            db.session.execute(text(statement))
+        if created:
+            db.session.execute(text("INSERT INTO item_fts(item_fts) VALUES ('rebuild')"))
+        db.session.commit()
+    except OperationalError as e:
+        # SQLite compilé sans FTS5 ou trop ancien pour le tokenizer trigram : recherche par LIKE
+        db.session.rollback()
+        current_app.logger.warning(f"Index de recherche plein texte indisponible: {e}")
+
+
+def _init_trigram_indexes():
+    try:
+        for statement in POSTGRESQL_TRGM_SCHEMA:
+            db.session.execute(text(statement))
+        db.session.commit()
+    except (OperationalError, ProgrammingError) as e:
+        # Extension indisponible ou droits insuffisants : recherche par ILIKE sans index
+        db.session.rollback()
+        current_app.logger.warning(f"Index trigram PostgreSQL indisponibles: {e}")
+
+
+def fts_available():
+    """Indique si l'index plein texte existe (vérifié une fois par processus)."""
+    if _state['fts_available'] is None:
+        _state['fts_available'] = db.engine.dialect.name == 'sqlite' and inspect(db.engine).has_table('item_fts')
+    return _state['fts_available']
+
+
+def _match_phrase(field, term):
+    escaped = term.replace('"', '""')
+    return f'{field} : "{escaped}"'
+
+
+def _like_escape(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_items(term, mode='substring', field='name', extension=None, scope_path=None, after_id=None, limit=50):
+    """
+    Recherche des items par nom ou chemin (`field`), du plus récent au plus ancien (pagination par id).
+    `mode` : 'substring' (le terme apparaît n'importe où) ou 'prefix' (la valeur commence par le terme) ;
+    `extension` restreint aux fichiers de cette extension, `scope_path` au contenu d'un dossier.
+    Les termes d'au moins 3 caractères sont résolus par l'index trigram, les conditions exactes vérifiées ensuite.
+    """
+    target = SEARCH_FIELDS[field]
+    conditions = []
+    match_terms = []
+    if term:
+        pattern = f"{_like_escape(term)}%" if mode == 'prefix' else f"%{_like_escape(term)}%"
+        conditions.append(target.ilike(pattern, escape='\\'))
+        if len(term) >= MIN_TRIGRAM_LENGTH:
+            match_terms.append(_match_phrase(field, term))
+    if extension:
+        suffix = f".{extension.lstrip('.')}"
+        conditions.append(Item.item_type == 'file')
+        conditions.append(Item.name.ilike(f"%{_like_escape(suffix)}", escape='\\'))
+        if len(suffix) >= MIN_TRIGRAM_LENGTH:
+            match_terms.append(_match_phrase('name', suffix))
+    if scope_path is not None:
+        conditions.append(Item.path.startswith(f"{scope_path}/", autoescape=True))
+
+    query = db.session.query(*ITEM_LIST_COLUMNS)
+    if match_terms and fts_available():
+        # Parcours de l'index dans l'ordre décroissant des rowid : arrêt dès que la page est remplie
+        order_column = ITEM_FTS.c.rowid
+        query = query.select_from(ITEM_FTS).join(Item, Item.id == ITEM_FTS.c.rowid) \
+            .filter(text("item_fts MATCH :match")).params(match=' AND '.join(match_terms))
+    else:
+        order_column = Item.id
+    if after_id is not None:
+        query = query.filter(order_column < after_id)
+    return query.filter(*conditions).order_by(order_column.desc()).limit(limit).all()
+
+
+def ancestors_by_path(paths):
+    """
+    Retourne, pour chaque chemin, la liste de ses dossiers parents (de la racine au parent direct)
+    sous la forme {id, name}, résolus par une seule requête à partir des préfixes des chemins.
+    """
+    prefixes = {path: ['/'.join(path.split('/')[:depth]) for depth in range(1, path.count('/') + 1)]
+                for path in paths}
+    wanted = {prefix for chain in prefixes.values() for prefix in chain}
+    directories = {}
+    if wanted:
+        directories = {row.path: {"id": row.id, "name": row.name}
+                       for row in db.session.query(Item.id, Item.name, Item.path).filter(Item.path.in_(wanted))}
+    return {path: [directories[prefix] for prefix in chain if prefix in directories]
+            for path, chain in prefixes.items()}
@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import threading
+import redis
+from flask import current_app
+from .utils import get_redis
+
+CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', 'config.json')
+# Canal Redis sur lequel est signalée chaque modification de config.json
+CONFIG_CHANNEL = 'dropzone:config'
+
+_lock = threading.Lock()
+_cache = {'values': None, 'mtime': None, 'checked_at': 0.0, 'listener_pid': None}
+
+
+def _read_config_file():
+    try:
+        with open(CONFIG_FILE, 'r') as f:
+            return json.load(f)
+    except (json.JSONDecodeError, FileNotFoundError):
+        return {}
+
+
+def _config_file_mtime():
+    try:
+        return os.stat(CONFIG_FILE).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+def invalidate():
+    """Force la relecture de config.json au prochain accès."""
+    with _lock:
+        _cache['values'] = None
+
+
+def _listen(redis_client):
+    """Invalide le cache à chaque notification ; se reconnecte en cas de coupure."""
+    while True:
+        try:
+            pubsub = redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(CONFIG_CHANNEL)
+            # Des notifications ont pu être manquées pendant une déconnexion
+            invalidate()
+            for _ in pubsub.listen():
+                invalidate()
+        except Exception:
+            time.sleep(5)
+
+
+def _ensure_listener():
+    """Démarre l'écoute des notifications une fois par processus (y compris après un fork de gunicorn)."""
+    pid = os.getpid()
+    if _cache['listener_pid'] == pid:
+        return
+    with _lock:
+        if _cache['listener_pid'] == pid:
+            return
+        _cache['listener_pid'] = pid
+    # Un client dédié : la connexion pub/sub reste bloquée en lecture
+    redis_client = redis.Redis.from_url(current_app.config['REDIS_URL'])
+    threading.Thread(target=_listen, args=(redis_client,), name='settings-listener', daemon=True).start()
+
+
+def load_persistent_config():
+    """
+    Retourne le contenu de config.json depuis un cache en mémoire du processus.
+    Le fichier n'est relu que sur notification Redis, ou si sa date de modification a changé
+    (vérifiée au plus toutes les RUNTIME_CONFIG_CHECK_SECONDS secondes).
+    """
+    _ensure_listener()
+    now = time.monotonic()
+    with _lock:
+        values = _cache['values']
+        if values is not None and now - _cache['checked_at'] < current_app.config['RUNTIME_CONFIG_CHECK_SECONDS']:
+            return values
+
+    mtime = _config_file_mtime()
+    with _lock:
+        if values is None or mtime != _cache['mtime']:
+            values = _read_config_file()
+            _cache['values'] = values
+            _cache['mtime'] = mtime
+        _cache['checked_at'] = now
+    return values
+
+
+def get_setting(name):
+    """Retourne un réglage : valeur de config.json si présente, sinon celle de la configuration Flask."""
+    return load_persistent_config().get(name, current_app.config[name])
+
+
+def save_persistent_config(data):
+    """Sauvegarde la configuration dans config.json et notifie tous les processus web et Celery."""
+    current_config = _read_config_file()
+    current_config.update(data)
+    # Écriture en place : config.json est monté comme fichier unique dans les conteneurs
+    with open(CONFIG_FILE, 'w') as f:
+        json.dump(current_config, f, indent=4)
+
+    invalidate()
+    try:
+        get_redis().publish(CONFIG_CHANNEL, 'updated')
+    except Exception as e:
+        # Les autres processus verront le changement à la prochaine vérification de date
+        current_app.logger.warning(f"Notification de configuration impossible: {e}")
+
+
+def apply_runtime_config():
+    """Répercute les réglages dynamiques sur la configuration Flask du processus (avant chaque requête)."""
+    current_app.config['MAX_CONTENT_LENGTH'] = get_setting('MAX_UPLOAD_MB') * 1024 * 1024
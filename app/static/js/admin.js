@@ -15,6 +15,8 @@ document.addEventListener('DOMContentLoaded', function() {
 
     const logsTableBody = document.getElementById('logs-table-body');
     const logsPagination = document.getElementById('logs-pagination');
+    const usageSize = document.getElementById('usage-size');
+    const usageFiles = document.getElementById('usage-files');
 
     // --- MODALS ---
     const purgeFilesModal = new bootstrap.Modal(document.getElementById('purge-files-modal'));
@@ -32,6 +34,7 @@ document.addEventListener('DOMContentLoaded', function() {
 
     const loadAdminData = () => {
         fetchConfig();
+        fetchUsage();
         fetchLogs();
     };
 
@@ -68,9 +71,27 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     };
 
-    const fetchLogs = async (page = 1) => {
+    const fetchUsage = async () => {
         try {
-            const response = await fetch(`/admin/logs?page=${page}`, { headers: getAuthHeader() });
+            const response = await fetch('/admin/usage', { headers: getAuthHeader() });
+            if (!response.ok) throw new Error("Erreur de chargement de l'espace utilisé.");
+            const usage = await response.json();
+            usageSize.textContent = usage.total_size_human;
+            usageFiles.textContent = usage.file_count;
+        } catch (error) {
+            console.error(error);
+        }
+    };
+
+    // Curseurs des pages de logs déjà visitées : logCursors[i] permet de recharger la page i
+    let logCursors = [null];
+
+    const fetchLogs = async (pageIndex = 0) => {
+        if (pageIndex === 0) logCursors = [null];
+        const cursor = logCursors[pageIndex];
+        try {
+            const url = cursor ? `/admin/logs?cursor=${encodeURIComponent(cursor)}` : '/admin/logs';
+            const response = await fetch(url, { headers: getAuthHeader() });
             if (!response.ok) throw new Error('Erreur de chargement des logs.');
             const data = await response.json();
             logsTableBody.innerHTML = '';
@@ -84,20 +105,25 @@ document.addEventListener('DOMContentLoaded', function() {
                 `;
                 logsTableBody.insertAdjacentHTML('beforeend', row);
             });
-            renderPagination(data.total_pages, data.current_page);
+            logCursors = logCursors.slice(0, pageIndex + 1);
+            if (data.next_cursor) logCursors.push(data.next_cursor);
+            renderPagination(pageIndex, Boolean(data.next_cursor));
         } catch (error) {
             console.error(error);
             logsTableBody.innerHTML = `<tr><td colspan="3" class="text-center text-danger">Impossible de charger les logs.</td></tr>`;
         }
     };
 
-    const renderPagination = (totalPages, currentPage) => {
+    const renderPagination = (pageIndex, hasNext) => {
         logsPagination.innerHTML = '';
-        for (let i = 1; i <= totalPages; i++) {
-            const liClass = i === currentPage ? 'page-item active' : 'page-item';
-            const pageItem = `<li class="${liClass}"><a class="page-link" href="#" data-page="${i}">${i}</a></li>`;
-            logsPagination.insertAdjacentHTML('beforeend', pageItem);
-        }
+        const previousClass = pageIndex > 0 ? 'page-item' : 'page-item disabled';
+        const nextClass = hasNext ? 'page-item' : 'page-item disabled';
+        logsPagination.insertAdjacentHTML('beforeend',
+            `<li class="${previousClass}"><a class="page-link" href="#" data-page="${pageIndex - 1}">Précédent</a></li>`);
+        logsPagination.insertAdjacentHTML('beforeend',
+            `<li class="page-item active"><span class="page-link">${pageIndex + 1}</span></li>`);
+        logsPagination.insertAdjacentHTML('beforeend',
+            `<li class="${nextClass}"><a class="page-link" href="#" data-page="${pageIndex + 1}">Suivant</a></li>`);
     };
 
     // --- EVENT LISTENERS ---
@@ -151,9 +177,9 @@ document.addEventListener('DOMContentLoaded', function() {
     logsPagination.addEventListener('click', (e) => {
         e.preventDefault();
         if (e.target.tagName === 'A') {
-            const page = e.target.dataset.page;
-            if (page) {
-                fetchLogs(page);
+            const pageIndex = parseInt(e.target.dataset.page, 10);
+            if (!e.target.parentElement.classList.contains('disabled') && pageIndex >= 0 && pageIndex < logCursors.length) {
+                fetchLogs(pageIndex);
             }
         }
     });
@@ -165,6 +191,7 @@ document.addEventListener('DOMContentLoaded', function() {
             if (!response.ok) throw new Error(result.error || 'Erreur inconnue.');
             alert(result.message);
             purgeFilesModal.hide();
+            fetchUsage();
             fetchLogs();
         } catch (error) {
             alert(`Erreur lors de la purge : ${error.message}`);
@@ -184,6 +211,17 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     });
 
+    document.getElementById('rebuild-usage-btn').addEventListener('click', async () => {
+        try {
+            const response = await fetch('/admin/usage/rebuild', { method: 'POST', headers: getAuthHeader() });
+            const result = await response.json();
+            if (!response.ok) throw new Error(result.error || 'Erreur inconnue.');
+            alert(result.message);
+        } catch (error) {
+            alert(`Erreur lors du recalcul: ${error.message}`);
+        }
+    });
+
     // --- INITIALIZATION ---
     checkAuth();
 });
\ No newline at end of file
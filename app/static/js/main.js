@@ -4,16 +4,26 @@ Dropzone.autoDiscover = false;
 document.addEventListener('DOMContentLoaded', function() {
     // --- STATE ---
     let currentFolderId = null;
+    let currentSearch = null;
+    let currentBreadcrumbIds = [];
 
     // --- ELEMENTS ---
     const itemTableBody = document.getElementById('item-table-body');
     const breadcrumbsList = document.getElementById('breadcrumbs-list');
     const refreshBtn = document.getElementById('refresh-btn');
     const newFolderBtn = document.getElementById('new-folder-btn');
+    const deleteSelectedBtn = document.getElementById('delete-selected-btn');
+    const searchInput = document.getElementById('search-input');
     const expirationValueInput = document.getElementById('expiration-value');
     const expirationUnitInput = document.getElementById('expiration-unit');
     let myDropzone;
     let maxExpirationMinutes = 0;
+    // Notifications en temps réel : tant que le flux est connecté, la liste est mise à jour sans être relue
+    let eventsEnabled = false;
+    let eventSource = null;
+    let eventFolderId;
+    let liveUpdates = false;
+    const ownUploads = new Set();
 
     // --- MODALS ---
     const deleteModal = new bootstrap.Modal(document.getElementById('delete-confirm-modal'));
@@ -25,6 +35,7 @@ document.addEventListener('DOMContentLoaded', function() {
     // --- FETCH & RENDER ---
     const fetchAndRender = async (folderId = null) => {
         currentFolderId = folderId;
+        currentSearch = null;
         const url = folderId ? `/api/items?parent_id=${folderId}` : '/api/items?parent_id=root';
 
         refreshBtn.disabled = true;
@@ -39,7 +50,10 @@ document.addEventListener('DOMContentLoaded', function() {
             window.location.hash = folderId ? `/folder/${folderId}` : '';
 
             renderItems(data.items);
+            renderLoadMore(data.next_cursor);
             renderBreadcrumbs(data.breadcrumbs);
+            currentBreadcrumbIds = data.breadcrumbs.map(crumb => crumb.id);
+            connectEvents(folderId);
         } catch (error) {
             console.error('Fetch error:', error);
             itemTableBody.innerHTML = `<tr><td colspan="6" class="text-center text-danger">Impossible de charger les éléments.</td></tr>`;
@@ -49,59 +63,139 @@ document.addEventListener('DOMContentLoaded', function() {
         }
     };
 
-    const renderItems = (items) => {
-        itemTableBody.innerHTML = '';
-        if (items.length === 0) {
-            itemTableBody.innerHTML = `<tr><td colspan="6" class="text-center text-muted">Ce dossier est vide.</td></tr>`;
+    const fetchSearchResults = async (query, cursor = null) => {
+        currentSearch = query;
+        const params = new URLSearchParams({ q: query });
+        if (cursor) params.set('cursor', cursor);
+        try {
+            const response = await fetch(`/api/search?${params}`);
+            const data = await response.json();
+            if (!response.ok) throw new Error(data.error || 'Erreur réseau.');
+            renderItems(data.items, Boolean(cursor));
+            renderLoadMore(data.next_cursor);
+            if (!cursor) {
+                renderBreadcrumbs([]);
+                const searchCrumb = document.createElement('li');
+                searchCrumb.className = 'breadcrumb-item active';
+                searchCrumb.textContent = `Recherche : « ${query} »`;
+                breadcrumbsList.appendChild(searchCrumb);
+            }
+        } catch (error) {
+            console.error('Search error:', error);
+            itemTableBody.innerHTML = `<tr><td colspan="6" class="text-center text-danger">Impossible d'effectuer la recherche.</td></tr>`;
+        }
+    };
+
+    const fetchNextPage = async (cursor) => {
+        if (currentSearch) return fetchSearchResults(currentSearch, cursor);
+        const parent = currentFolderId ? currentFolderId : 'root';
+        try {
+            const response = await fetch(`/api/items?parent_id=${parent}&cursor=${encodeURIComponent(cursor)}`);
+            if (!response.ok) throw new Error('Erreur réseau.');
+            const data = await response.json();
+            renderItems(data.items, true);
+            renderLoadMore(data.next_cursor);
+        } catch (error) {
+            console.error('Fetch error:', error);
+            renderLoadMore(cursor);
+        }
+    };
+
+    const renderLoadMore = (cursor) => {
+        const existing = document.getElementById('load-more-row');
+        if (existing) existing.remove();
+        if (!cursor) return;
+        itemTableBody.insertAdjacentHTML('beforeend', `
+            <tr id="load-more-row">
+                <td colspan="6" class="text-center">
+                    <button class="btn btn-sm btn-outline-secondary btn-load-more" data-cursor="${cursor}">Charger plus</button>
+                </td>
+            </tr>`);
+    };
+
+    const selectedItemIds = () => Array.from(document.querySelectorAll('.item-select:checked')).map(box => parseInt(box.dataset.id, 10));
+
+    const updateSelectionActions = () => {
+        const count = selectedItemIds().length;
+        deleteSelectedBtn.classList.toggle('d-none', count === 0);
+        deleteSelectedBtn.textContent = `🗑️ Supprimer (${count})`;
+    };
+
+    const renderItems = (items, append = false) => {
+        if (append) {
+            const existing = document.getElementById('load-more-row');
+            if (existing) existing.remove();
+        } else {
+            itemTableBody.innerHTML = '';
+            updateSelectionActions();
+        }
+        if (items.length === 0 && !append) {
+            renderEmptyFolder();
             return;
         }
 
-        items.forEach(item => {
-            const icon = item.item_type === 'directory' ? '📁' : '📄';
-            const nameHtml = item.item_type === 'directory'
-                ? `<a href="#" class="text-decoration-none folder-link" data-id="${item.id}">${item.name}</a>`
-                : `<div class="truncate-text" title="${item.name}">${item.name}</div>`;
-
-            const nameCellHtml = `
-                <div class="d-flex align-items-center">
-                    <span class="me-2">${icon}</span>
-                    ${nameHtml}
-                </div>
-            `;
-
-            let checksumHtml = '';
-            if (item.item_type === 'file') {
-                if (item.status === 'pending') checksumHtml = `<span class="badge bg-secondary">En cours...</span>`;
-                else if (item.status === 'error') checksumHtml = `<span class="badge bg-danger">Erreur</span>`;
-                else if (item.sha256) checksumHtml = `<code class="small checksum-copy" data-full-checksum="${item.sha256}" title="Cliquer pour copier">${item.sha256.substring(0, 12)}...</code>`;
-            }
+        items.forEach(item => itemTableBody.insertAdjacentHTML('beforeend', renderItemRow(item)));
+    };
 
-            const fileBaseName = (item.item_type === 'file' && item.name.includes('.')) ? item.name.substring(0, item.name.lastIndexOf('.')) : item.name;
-
-            const actionsHtml = `
-                <button class="btn btn-sm btn-outline-info btn-copy-url" data-id="${item.id}" data-type="${item.item_type}" data-download-url="${item.download_url || ''}" title="Copier l'URL">📋</button>
-                <button class="btn btn-sm btn-outline-warning btn-rename" data-id="${item.id}" data-name="${fileBaseName}" data-type="${item.item_type}" title="Renommer">✏️</button>
-                ${item.item_type === 'file' ? `<a href="/api${item.download_url}" class="btn btn-sm btn-success" title="Télécharger">DL</a>` : ''}
-                <button class="btn btn-sm btn-danger btn-delete" data-id="${item.id}" data-name="${item.name}" title="Supprimer">X</button>
-            `;
-
-            const dateOptions = { day: '2-digit', month: '2-digit', year: 'numeric', hour: '2-digit', minute: '2-digit' };
-            const createdAtHtml = new Date(item.created_at).toLocaleString('fr-FR', dateOptions);
-            const expiresAtHtml = item.expires_at
-                ? new Date(item.expires_at).toLocaleString('fr-FR', dateOptions)
-                : '';
-
-            const row = `
-                <tr>
-                    <td>${nameCellHtml}</td>
-                    <td>${item.size_human || ''}</td>
-                    <td>${checksumHtml}</td>
-                    <td>${createdAtHtml}</td>
-                    <td>${expiresAtHtml}</td>
-                    <td class="text-end">${actionsHtml}</td>
-                </tr>`;
-            itemTableBody.insertAdjacentHTML('beforeend', row);
-        });
+    const renderEmptyFolder = () => {
+        itemTableBody.innerHTML = `<tr id="empty-folder-row"><td colspan="6" class="text-center text-muted">Ce dossier est vide.</td></tr>`;
+    };
+
+    const renderItemRow = (item) => {
+        const icon = item.item_type === 'directory' ? '📁' : '📄';
+        const nameHtml = item.item_type === 'directory'
+            ? `<a href="#" class="text-decoration-none folder-link" data-id="${item.id}">${item.name}</a>`
+            : `<div class="truncate-text" title="${item.name}">${item.name}</div>`;
+        // En recherche, le dossier de chaque résultat est affiché sous son nom
+        const locationHtml = item.breadcrumbs
+            ? `<small class="text-muted d-block">/${item.breadcrumbs.map(crumb => crumb.name).join('/')}</small>`
+            : '';
+
+        const nameCellHtml = `
+            <div class="d-flex align-items-center">
+                <input class="form-check-input me-2 item-select" type="checkbox" data-id="${item.id}" title="Sélectionner">
+                <span class="me-2">${icon}</span>
+                <div>${nameHtml}${locationHtml}</div>
+            </div>
+        `;
+
+        let checksumHtml = '';
+        if (item.item_type === 'file') {
+            if (item.status === 'pending') checksumHtml = `<span class="badge bg-secondary">En cours...</span>`;
+            else if (item.status === 'error') checksumHtml = `<span class="badge bg-danger">Erreur</span>`;
+            else if (item.sha256) checksumHtml = `<code class="small checksum-copy" data-full-checksum="${item.sha256}" title="Cliquer pour copier">${item.sha256.substring(0, 12)}...</code>`;
+        }
+
+        const fileBaseName = (item.item_type === 'file' && item.name.includes('.')) ? item.name.substring(0, item.name.lastIndexOf('.')) : item.name;
+
+        const actionsHtml = `
+            <button class="btn btn-sm btn-outline-info btn-copy-url" data-id="${item.id}" data-type="${item.item_type}" data-download-url="${item.download_url || ''}" title="Copier l'URL">📋</button>
+            <button class="btn btn-sm btn-outline-warning btn-rename" data-id="${item.id}" data-name="${fileBaseName}" data-type="${item.item_type}" title="Renommer">✏️</button>
+            ${item.item_type === 'file' ? `<a href="/api${item.download_url}" class="btn btn-sm btn-success" title="Télécharger">DL</a>` : ''}
+            ${item.item_type === 'directory' ? `<a href="/api${item.archive_url}" class="btn btn-sm btn-success" title="Télécharger le dossier (ZIP)">ZIP</a>` : ''}
+            <button class="btn btn-sm btn-danger btn-delete" data-id="${item.id}" data-name="${item.name}" title="Supprimer">X</button>
+        `;
+
+        const dateOptions = { day: '2-digit', month: '2-digit', year: 'numeric', hour: '2-digit', minute: '2-digit' };
+        const createdAtHtml = new Date(item.created_at).toLocaleString('fr-FR', dateOptions);
+        const expiresAtHtml = item.expires_at
+            ? new Date(item.expires_at).toLocaleString('fr-FR', dateOptions)
+            : '';
+
+        // Les dossiers affichent la taille et le nombre de fichiers de tout leur contenu
+        const sizeHtml = item.item_type === 'directory'
+            ? `${item.size_human || ''} <small class="text-muted">(${item.file_count} fichier(s))</small>`
+            : (item.size_human || '');
+
+        return `
+            <tr data-item-id="${item.id}" data-item-type="${item.item_type}" data-item-name="${item.name}">
+                <td>${nameCellHtml}</td>
+                <td>${sizeHtml}</td>
+                <td>${checksumHtml}</td>
+                <td>${createdAtHtml}</td>
+                <td>${expiresAtHtml}</td>
+                <td class="text-end">${actionsHtml}</td>
+            </tr>`;
     };
 
     const renderBreadcrumbs = (breadcrumbs) => {
@@ -116,6 +210,101 @@ document.addEventListener('DOMContentLoaded', function() {
         });
     };
 
+    // --- LIVE UPDATES (Server-Sent Events) ---
+    const sameFolder = (parentId) => String(parentId ?? '') === String(currentFolderId ?? '');
+
+    const itemRow = (id) => itemTableBody.querySelector(`tr[data-item-id="${id}"]`);
+
+    // Ordre de /api/items : type puis nom
+    const sortsBefore = (item, row) => item.item_type !== row.dataset.itemType
+        ? item.item_type < row.dataset.itemType
+        : item.name < row.dataset.itemName;
+
+    const upsertItem = (item) => {
+        if (currentSearch) return;
+        const existing = itemRow(item.id);
+        if (existing) existing.remove();
+        if (!sameFolder(item.parent_id)) {
+            if (existing) {
+                renderEmptyIfNeeded();
+                updateSelectionActions();
+            }
+            return;
+        }
+
+        const emptyRow = document.getElementById('empty-folder-row');
+        if (emptyRow) emptyRow.remove();
+        const next = Array.from(itemTableBody.querySelectorAll('tr[data-item-id]')).find(row => sortsBefore(item, row));
+        if (next) {
+            next.insertAdjacentHTML('beforebegin', renderItemRow(item));
+        } else if (!document.getElementById('load-more-row')) {
+            itemTableBody.insertAdjacentHTML('beforeend', renderItemRow(item));
+        }
+        // Sinon l'élément appartient à une page pas encore chargée
+    };
+
+    const removeItems = (ids) => {
+        if (currentSearch) return;
+        if (ids.some(id => currentBreadcrumbIds.includes(id))) {
+            // Le dossier affiché (ou l'un de ses parents) a été supprimé
+            fetchAndRender(null);
+            return;
+        }
+        ids.forEach(id => {
+            const row = itemRow(id);
+            if (row) row.remove();
+        });
+        renderEmptyIfNeeded();
+        updateSelectionActions();
+    };
+
+    const renderEmptyIfNeeded = () => {
+        if (!itemTableBody.querySelector('tr[data-item-id]') && !document.getElementById('load-more-row')) renderEmptyFolder();
+    };
+
+    const refreshUnlessLive = () => {
+        if (!liveUpdates) fetchAndRender(currentFolderId);
+    };
+
+    const connectEvents = (folderId) => {
+        if (!eventsEnabled || (eventSource && eventFolderId === folderId && eventSource.readyState !== EventSource.CLOSED)) return;
+        if (eventSource) eventSource.close();
+        liveUpdates = false;
+        eventFolderId = folderId;
+        eventSource = new EventSource(`/api/events?parent_id=${folderId ? folderId : 'root'}`);
+        let interrupted = false;
+
+        eventSource.addEventListener('open', () => {
+            liveUpdates = true;
+            // Des événements ont pu être manqués pendant la coupure
+            if (interrupted && !currentSearch) fetchAndRender(currentFolderId);
+            interrupted = false;
+        });
+        // Le navigateur se reconnecte de lui-même ; en attendant, la liste est relue après chaque action
+        eventSource.addEventListener('error', () => {
+            liveUpdates = false;
+            interrupted = true;
+        });
+        ['created', 'renamed', 'moved', 'updated'].forEach(type => {
+            eventSource.addEventListener(type, e => {
+                const data = JSON.parse(e.data);
+                if (data.upload_uuid) ownUploads.delete(data.upload_uuid);
+                upsertItem(data.item);
+            });
+        });
+        ['deleted', 'expired'].forEach(type => {
+            eventSource.addEventListener(type, e => removeItems(JSON.parse(e.data).ids));
+        });
+        eventSource.addEventListener('assembly_failed', e => {
+            const data = JSON.parse(e.data);
+            if (!ownUploads.delete(data.upload_uuid)) return;
+            alert(`Erreur d'assemblage pour ${data.name}: ${data.error}`);
+        });
+        eventSource.addEventListener('resync', () => {
+            if (!currentSearch) fetchAndRender(currentFolderId);
+        });
+    };
+
     // --- ACTIONS ---
     const handleApiAction = async (url, options, successCallback) => {
         try {
@@ -136,6 +325,8 @@ document.addEventListener('DOMContentLoaded', function() {
             const publicConfig = await configResponse.json();
 
             maxExpirationMinutes = publicConfig.max_expiration_minutes;
+            eventsEnabled = Boolean(publicConfig.events_enabled);
+            connectEvents(currentFolderId);
             const defaultMinutes = publicConfig.default_expiration_minutes;
 
             if (defaultMinutes >= 1440 && defaultMinutes % 1440 === 0) {
@@ -159,7 +350,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 chunking: true,
                 forceChunking: true,
                 chunkSize: chunkSize * 1024 * 1024,
-                parallelChunkUploads: false,
+                parallelChunkUploads: true,
                 retryChunks: true,
                 retryChunksLimit: 3,
                 maxFilesize: maxFilesize,
@@ -187,11 +378,13 @@ document.addEventListener('DOMContentLoaded', function() {
                         formData.append('parent_id', currentFolderId);
                         formData.append('expiration_minutes', totalMinutes);
                     });
+                    this.on('success', file => {
+                        if (file.upload && file.upload.uuid) ownUploads.add(file.upload.uuid);
+                    });
                     this.on('queuecomplete', () => {
                         this.removeAllFiles(true);
-                        setTimeout(() => {
-                            fetchAndRender(currentFolderId);
-                        }, 3000);
+                        // Sans notifications, la liste est relue une fois l'assemblage probablement terminé
+                        if (!liveUpdates) setTimeout(refreshUnlessLive, 3000);
                     });
                     this.on("uploadprogress", function(file, progress) {
                         const progressText = file.previewElement.querySelector(".dz-progress-text");
@@ -230,9 +423,17 @@ document.addEventListener('DOMContentLoaded', function() {
         if (actionButton) {
             const itemId = actionButton.dataset.id;
 
-            if (actionButton.matches('#new-folder-btn')) {
+            if (actionButton.matches('.btn-load-more')) {
+                actionButton.disabled = true;
+                fetchNextPage(actionButton.dataset.cursor);
+            } else if (actionButton.matches('#new-folder-btn')) {
                 document.getElementById('new-folder-name').value = '';
                 newFolderModal.show();
+            } else if (actionButton.matches('#delete-selected-btn')) {
+                const ids = selectedItemIds();
+                itemToDelete = { ids: ids, name: `${ids.length} élément(s) sélectionné(s)` };
+                document.getElementById('item-to-delete-name').textContent = itemToDelete.name;
+                deleteModal.show();
             } else if (actionButton.matches('.btn-delete')) {
                 itemToDelete = { id: itemId, name: actionButton.dataset.name };
                 document.getElementById('item-to-delete-name').textContent = itemToDelete.name;
@@ -293,15 +494,41 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ name: name, parent_id: currentFolderId })
             }, () => {
                 newFolderModal.hide();
-                fetchAndRender(currentFolderId);
+                refreshUnlessLive();
             });
         }
     });
 
+    searchInput.addEventListener('keydown', e => {
+        if (e.key !== 'Enter') return;
+        e.preventDefault();
+        const query = searchInput.value.trim();
+        if (query) fetchSearchResults(query);
+        else fetchAndRender(currentFolderId);
+    });
+
+    itemTableBody.addEventListener('change', e => {
+        if (e.target.classList.contains('item-select')) updateSelectionActions();
+    });
+
     document.getElementById('confirm-delete-btn').addEventListener('click', () => {
+        if (itemToDelete.ids) {
+            // Suppression groupée : une seule requête, résultat détaillé par élément
+            handleApiAction('/api/items/bulk-delete', {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/json' },
+                body: JSON.stringify({ ids: itemToDelete.ids })
+            }, (result) => {
+                const errors = result.results.filter(r => r.status === 'error');
+                if (errors.length > 0) alert(`Erreur pour ${errors.length} élément(s) :\n${errors.map(r => r.error).join('\n')}`);
+                deleteModal.hide();
+                refreshUnlessLive();
+            });
+            return;
+        }
         handleApiAction(`/api/items/${itemToDelete.id}`, { method: 'DELETE' }, () => {
             deleteModal.hide();
-            fetchAndRender(currentFolderId);
+            refreshUnlessLive();
         });
     });
 
@@ -314,7 +541,7 @@ document.addEventListener('DOMContentLoaded', function() {
                 body: JSON.stringify({ name: newName })
             }, () => {
                 renameModal.hide();
-                fetchAndRender(currentFolderId);
+                refreshUnlessLive();
             });
         }
     });
@@ -0,0 +1,358 @@
+import io
+import os
+import errno
+import random
+import shutil
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from urllib.parse import urlparse, parse_qs
+from flask import current_app
+from sqlalchemy import func
+from . import db
+from .models import Blob
+from .uploads import COPY_BUFFER_SIZE
+
+# Volume historique (UPLOAD_FOLDER/.blobs), enregistré NULL dans Blob.volume
+DEFAULT_VOLUME = 'default'
+
+# Taille des suppressions groupées S3 (maximum de l'API DeleteObjects)
+S3_DELETE_BATCH = 1000
+
+
+class LocalObject:
+    """Fichier stocké sur un système de fichiers local."""
+
+    def __init__(self, path, volume=None):
+        self.path = path
+        self.local_path = path
+        self.volume = volume
+
+    def __str__(self):
+        return self.path
+
+    def open(self):
+        f = open(self.path, 'rb')
+        return _TrackedFile(f, self.volume) if self.volume is not None else f
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def stat(self):
+        """Retourne (taille stockée, date de modification UTC)."""
+        stat = os.stat(self.path)
+        return stat.st_size, datetime.fromtimestamp(int(stat.st_mtime), tz=timezone.utc)
+
+    def delete(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+class S3Object:
+    """Objet stocké sur un volume S3 ; les erreurs de l'API sont converties en OSError."""
+
+    def __init__(self, volume, key):
+        self.volume = volume
+        self.key = key
+        self.local_path = None
+
+    def __str__(self):
+        return f"s3://{self.volume.bucket}/{self.key}"
+
+    def open(self):
+        with self.volume.errors():
+            size = self.volume.client.head_object(Bucket=self.volume.bucket, Key=self.key)['ContentLength']
+        return _TrackedFile(io.BufferedReader(_S3Reader(self.volume, self.key, size), COPY_BUFFER_SIZE), self.volume)
+
+    def exists(self):
+        try:
+            self.stat()
+        except FileNotFoundError:
+            return False
+        return True
+
+    def stat(self):
+        with self.volume.errors():
+            head = self.volume.client.head_object(Bucket=self.volume.bucket, Key=self.key)
+        return head['ContentLength'], head['LastModified'].replace(microsecond=0)
+
+    def delete(self):
+        with self.volume.errors():
+            self.volume.client.delete_object(Bucket=self.volume.bucket, Key=self.key)
+
+
+class _TrackedFile:
+    """Fichier ouvert compté dans la charge de son volume jusqu'à sa fermeture."""
+
+    def __init__(self, f, volume):
+        self._file = f
+        self._volume = volume
+        self._closed = False
+        volume.acquire()
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._volume.release()
+        self._file.close()
+
+
+class _S3Reader(io.RawIOBase):
+    """
+    Lecture d'un objet S3 comme un fichier : une requête GET ouverte à partir de la position courante,
+    poursuivie tant que les lectures sont séquentielles et relancée après un déplacement.
+    """
+
+    def __init__(self, volume, key, size):
+        self._volume = volume
+        self._key = key
+        self._size = size
+        self._position = 0
+        self._body = None
+        self._body_position = None
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=os.SEEK_SET):
+        if whence == os.SEEK_CUR:
+            offset += self._position
+        elif whence == os.SEEK_END:
+            offset += self._size
+        self._position = max(offset, 0)
+        return self._position
+
+    def readinto(self, buffer):
+        if self._position >= self._size:
+            return 0
+        if self._body is None or self._body_position != self._position:
+            self._close_body()
+            with self._volume.errors():
+                self._body = self._volume.client.get_object(Bucket=self._volume.bucket, Key=self._key,
+                                                            Range=f"bytes={self._position}-")['Body']
+            self._body_position = self._position
+        with self._volume.errors():
+            data = self._body.read(len(buffer))
+        buffer[:len(data)] = data
+        self._position += len(data)
+        self._body_position += len(data)
+        return len(data)
+
+    def _close_body(self):
+        if self._body is not None:
+            self._body.close()
+            self._body = None
+
+    def close(self):
+        self._close_body()
+        super().close()
+
+
+class Volume:
+    """Volume de stockage des blobs ; `active` compte les lectures et écritures en cours dans ce processus."""
+
+    def __init__(self, name, read_only=False):
+        self.name = name
+        self.read_only = read_only
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            self.active += 1
+
+    def release(self):
+        with self._lock:
+            self.active -= 1
+
+    @contextmanager
+    def busy(self):
+        self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+
+class LocalVolume(Volume):
+    """Dossier local (un disque monté par volume)."""
+
+    def __init__(self, name, root, read_only=False):
+        super().__init__(name, read_only)
+        self.root = root
+
+    def object(self, key):
+        return LocalObject(os.path.join(self.root, key), self)
+
+    def put(self, src_path, key):
+        """Range un fichier sous `key` ; le fichier source est déplacé (copié si le volume est sur un autre disque)."""
+        destination = os.path.join(self.root, key)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        with self.busy():
+            try:
+                os.replace(src_path, destination)
+            except OSError as e:
+                if e.errno != errno.EXDEV:
+                    raise
+                shutil.move(src_path, f"{destination}.tmp")
+                os.replace(f"{destination}.tmp", destination)
+
+    def free_bytes(self):
+        os.makedirs(self.root, exist_ok=True)
+        return shutil.disk_usage(self.root).free
+
+    def purge(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+
+
+class S3Volume(Volume):
+    """Bucket S3 (ou service compatible : MinIO, Ceph...) ; identifiants lus par boto3 (AWS_ACCESS_KEY_ID...)."""
+
+    def __init__(self, name, bucket, prefix='', endpoint_url=None, region=None, capacity_bytes=None,
+                 read_only=False):
+        super().__init__(name, read_only)
+        import boto3
+        from botocore.exceptions import BotoCoreError, ClientError
+        self._errors = (BotoCoreError, ClientError)
+        self.bucket = bucket
+        self.prefix = prefix
+        self.capacity_bytes = capacity_bytes
+        self.client = boto3.client('s3', endpoint_url=endpoint_url, region_name=region)
+
+    @contextmanager
+    def errors(self):
+        """Convertit les erreurs S3 en OSError (FileNotFoundError pour un objet absent)."""
+        try:
+            yield
+        except self._errors as e:
+            code = getattr(e, 'response', {}).get('Error', {}).get('Code')
+            if code in ('404', 'NoSuchKey', 'NotFound'):
+                raise FileNotFoundError(errno.ENOENT, f"Objet S3 introuvable ({self.name})") from e
+            raise OSError(f"Erreur S3 ({self.name}): {e}") from e
+
+    def object(self, key):
+        return S3Object(self, self.prefix + key)
+
+    def put(self, src_path, key):
+        with self.busy(), self.errors():
+            self.client.upload_file(src_path, self.bucket, self.prefix + key)
+        os.remove(src_path)
+
+    def free_bytes(self):
+        """Capacité déclarée moins l'espace occupé par ses blobs ; None si aucune capacité n'est déclarée."""
+        if self.capacity_bytes is None:
+            return None
+        used = db.session.query(func.coalesce(func.sum(Blob.stored_size_bytes), 0)) \
+            .filter(Blob.volume == self.name).scalar()
+        return self.capacity_bytes - used
+
+    def purge(self):
+        paginator = self.client.get_paginator('list_objects_v2')
+        with self.errors():
+            for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+                keys = [{'Key': obj['Key']} for obj in page.get('Contents', [])]
+                for start in range(0, len(keys), S3_DELETE_BATCH):
+                    self.client.delete_objects(Bucket=self.bucket,
+                                               Delete={'Objects': keys[start:start + S3_DELETE_BATCH]})
+
+
+def parse_volume(name, url):
+    """
+    Crée un volume à partir de son URL :
+    file:///mnt/disque1 ou s3://bucket/prefixe?endpoint=http://minio:9000&region=...&capacity_gb=500.
+    `readonly=1` retire le volume du placement des nouveaux contenus (il reste lisible).
+    """
+    parsed = urlparse(url)
+    options = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+    read_only = options.get('readonly', '0').lower() in ('1', 'true')
+    if parsed.scheme == 'file':
+        return LocalVolume(name, parsed.path, read_only)
+    if parsed.scheme == 's3':
+        prefix = parsed.path.lstrip('/')
+        if prefix and not prefix.endswith('/'):
+            prefix += '/'
+        capacity = options.get('capacity_gb')
+        return S3Volume(name, parsed.netloc, prefix, endpoint_url=options.get('endpoint'),
+                        region=options.get('region'),
+                        capacity_bytes=int(float(capacity) * 1024 ** 3) if capacity else None, read_only=read_only)
+    raise ValueError(f"Volume de stockage '{name}' : schéma d'URL non pris en charge ({url})")
+
+
+def get_volumes():
+    """
+    Volumes configurés par STORAGE_VOLUMES ('nom=url,nom=url'), créés une fois par application.
+    Le volume 'default' (UPLOAD_FOLDER/.blobs) existe toujours, les contenus déjà stockés s'y trouvant.
+    """
+    volumes = current_app.extensions.get('storage_volumes')
+    if volumes is None:
+        from .blobs import blob_folder
+        volumes = {}
+        for entry in filter(None, (part.strip() for part in current_app.config['STORAGE_VOLUMES'].split(','))):
+            name, _, url = entry.partition('=')
+            volumes[name.strip()] = parse_volume(name.strip(), url.strip())
+        if DEFAULT_VOLUME not in volumes:
+            volumes[DEFAULT_VOLUME] = LocalVolume(DEFAULT_VOLUME, blob_folder())
+        current_app.extensions['storage_volumes'] = volumes
+    return volumes
+
+
+def get_volume(name):
+    """Retourne le volume d'un blob (`name` : valeur de Blob.volume, None pour le volume par défaut)."""
+    name = name or DEFAULT_VOLUME
+    volumes = get_volumes()
+    if name not in volumes:
+        raise OSError(f"Volume de stockage '{name}' absent de STORAGE_VOLUMES")
+    return volumes[name]
+
+
+def volume_column(volume):
+    """Valeur enregistrée dans Blob.volume pour un volume."""
+    return None if volume.name == DEFAULT_VOLUME else volume.name
+
+
+def choose_volume(size):
+    """
+    Choisit le volume d'un nouveau contenu de `size` octets, au hasard parmi les volumes accessibles en écriture
+    et ayant assez d'espace libre, avec une probabilité proportionnelle à l'espace libre et inversement
+    proportionnelle au nombre d'opérations en cours. Un volume sans capacité connue compte pour la moyenne.
+    """
+    volumes = get_volumes()
+    if len(volumes) == 1:
+        return volumes[DEFAULT_VOLUME]
+
+    margin = current_app.config['STORAGE_MIN_FREE_MB'] * 1024 * 1024
+    candidates = []
+    for volume in volumes.values():
+        if volume.read_only:
+            continue
+        free = volume.free_bytes()
+        if free is not None and free - size < margin:
+            continue
+        candidates.append((volume, free))
+    if not candidates:
+        raise OSError(errno.ENOSPC, "Aucun volume de stockage n'a assez d'espace libre")
+    if len(candidates) == 1:
+        return candidates[0][0]
+
+    known = [free for _, free in candidates if free is not None]
+    average = sum(known) / len(known) if known else 1
+    weights = [(average if free is None else free) / (1 + volume.active) for volume, free in candidates]
+    return random.choices([volume for volume, _ in candidates], weights=weights)[0]
@@ -1,111 +1,324 @@
 import os
+import gzip
 import hashlib
 import shutil
 import json
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from . import celery, db, create_app
-from .models import Item, Log
+from sqlalchemy import delete, select
+from . import celery, db, scrub, events, cache, writes
+from .models import Item, Log, Blob
+from .database import retry_on_busy
+from .worker import task_app_context
+from .metrics import (ASSEMBLY_PHASE_SECONDS, EXPIRY_BATCH_SECONDS, EXPIRED_FILES, UPLOAD_SESSIONS_REMOVED,
+                      UPLOAD_SESSION_BYTES_RECLAIMED)
+from .uploads import session_dir, part_path, hash_file, scan_sessions, remove_session, COPY_BUFFER_SIZE
+from .settings import get_setting
+from .utils import sizeof_fmt
+from .tree import child_added, children_removed, rebuild_child_counts, file_added, files_removed, rebuild_rollups
+from .blobs import (BLOB_DIRNAME, store_blob, release_blobs, remove_blob_files, orphan_blob_objects, legacy_object,
+                    item_object, item_codec)
 from werkzeug.utils import secure_filename
 
 
 @celery.task
-def assemble_chunks(upload_uuid, total_chunks, original_filename, target_path, parent_id, expiration_minutes):
+def assemble_chunks(upload_uuid, total_chunks, original_filename, target_path, parent_id, expiration_minutes,
+                    sha256=None):
     """Tâche de fond pour assembler les fichiers, calculer le checksum ET définir leur date d'expiration."""
-    app = create_app()
-    with app.app_context():
-        temp_dir = os.path.join(app.config['UPLOAD_FOLDER'], 'tmp', upload_uuid)
+    with task_app_context() as app:
+        temp_dir = session_dir(app.config['UPLOAD_FOLDER'], upload_uuid)
         final_filename = secure_filename(original_filename)
         final_item_path = os.path.join(target_path, final_filename)
-        final_filepath_on_disk = os.path.join(app.config['UPLOAD_FOLDER'], final_item_path)
 
         if Item.query.filter_by(path=final_item_path).first():
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
+            events.publish({"type": "assembly_failed", "parent_id": parent_id, "upload_uuid": upload_uuid,
+                            "name": final_filename, "error": "Un fichier avec ce nom existe déjà."})
             return
 
-        sha256_hash = hashlib.sha256()
+        started = time.perf_counter()
         try:
-            destination_dir = os.path.dirname(final_filepath_on_disk)
-            os.makedirs(destination_dir, exist_ok=True)
-
-            with open(final_filepath_on_disk, 'wb') as final_file:
-                for i in range(total_chunks):
-                    chunk_path = os.path.join(temp_dir, f"{i}.chunk")
-                    with open(chunk_path, 'rb') as chunk_file:
-                        chunk_content = chunk_file.read()
-                        sha256_hash.update(chunk_content)
-                        final_file.write(chunk_content)
-
+            partial_file = part_path(temp_dir)
+            if os.path.exists(partial_file):
+                # Assemblage en flux : le fichier est déjà complet, seul le checksum peut manquer
+                final_checksum = sha256
+                if final_checksum is None:
+                    final_checksum = hash_file(partial_file)
+                    ASSEMBLY_PHASE_SECONDS.labels('hash').observe(time.perf_counter() - started)
+            else:
+                sha256_hash = hashlib.sha256()
+                hash_seconds = 0.0
+                with open(partial_file, 'wb') as final_file:
+                    for i in range(total_chunks):
+                        chunk_path = os.path.join(temp_dir, f"{i}.chunk")
+                        with open(chunk_path, 'rb') as chunk_file:
+                            for block in iter(lambda: chunk_file.read(COPY_BUFFER_SIZE), b""):
+                                hash_started = time.perf_counter()
+                                sha256_hash.update(block)
+                                hash_seconds += time.perf_counter() - hash_started
+                                final_file.write(block)
+                final_checksum = sha256_hash.hexdigest()
+                ASSEMBLY_PHASE_SECONDS.labels('hash').observe(hash_seconds)
+                ASSEMBLY_PHASE_SECONDS.labels('copy').observe(time.perf_counter() - started - hash_seconds)
+
+            # Stockage par empreinte : un contenu déjà connu n'est pas conservé une seconde fois
+            store_started = time.perf_counter()
+            blob = store_blob(partial_file, final_checksum, final_filename)
+            ASSEMBLY_PHASE_SECONDS.labels('store').observe(time.perf_counter() - store_started)
             shutil.rmtree(temp_dir)
         except Exception as e:
+            db.session.rollback()
             if os.path.exists(temp_dir):
                 shutil.rmtree(temp_dir)
             log_error = Log(action="ASSEMBLY_ERROR", details=f"Erreur pour {final_filename}: {e}")
             db.session.add(log_error)
             db.session.commit()
+            events.publish({"type": "assembly_failed", "parent_id": parent_id, "upload_uuid": upload_uuid,
+                            "name": final_filename, "error": "Erreur lors de l'assemblage du fichier."})
             return
 
-        final_checksum = sha256_hash.hexdigest()
-        file_size = os.path.getsize(final_filepath_on_disk)
-
         now = datetime.utcnow()
         expires_at = now + timedelta(minutes=expiration_minutes)
+        writes.submit('record_upload', upload_uuid=upload_uuid, name=final_filename, path=final_item_path,
+                      parent_id=parent_id, blob_id=blob.id, created_at=now.isoformat(),
+                      expires_at=expires_at.isoformat())
+        ASSEMBLY_PHASE_SECONDS.labels('total').observe(time.perf_counter() - started)
 
-        new_item = Item(name=final_filename, item_type='file', path=final_item_path,
-                        parent_id=parent_id, size_bytes=file_size,
-                        status='processed', sha256=final_checksum,
-                        created_at=now, expires_at=expires_at)
-        db.session.add(new_item)
-        log = Log(action="UPLOAD_SUCCESS", details=f"Fichier '{final_filename}' assemblé et checksum calculé.")
-        db.session.add(log)
-        db.session.commit()
 
+def _release_upload(upload_uuid, name, parent_id, blob_id, error):
+    """Rend la référence au blob d'un fichier assemblé non enregistré ; l'échec est notifié après le commit."""
+    released = release_blobs([blob_id])
 
-@celery.task
-def delete_expired_files():
-    """Supprime tous les fichiers dont la date d'expiration est dépassée."""
-    app = create_app()
-    with app.app_context():
-        now = datetime.utcnow()
-        expired_items = Item.query.filter(Item.item_type == 'file', Item.expires_at <= now).all()
+    def report_failure():
+        remove_blob_files(released)
+        events.publish({"type": "assembly_failed", "parent_id": parent_id, "upload_uuid": upload_uuid,
+                        "name": name, "error": error})
+    return report_failure
 
-        if not expired_items:
-            print("Aucun fichier expiré à supprimer.")
-            return "Aucun fichier expiré à supprimer."
 
-        deleted_count = 0
-        for item in expired_items:
-            try:
-                physical_path = os.path.join(app.config['UPLOAD_FOLDER'], item.path)
-                if os.path.exists(physical_path):
-                    os.remove(physical_path)
+def _abandon_upload(upload_uuid, name, path, parent_id, blob_id, created_at, expires_at):
+    """Écriture 'record_upload' abandonnée (conflit d'insertion...) : le blob ne doit pas rester référencé."""
+    return _release_upload(upload_uuid, name, parent_id, blob_id, "Erreur lors de l'enregistrement du fichier.")
+
 
-                db.session.delete(item)
-                deleted_count += 1
-            except Exception as e:
-                log_error = Log(action="DELETE_EXPIRED_ERROR", details=f"Erreur pour {item.path}: {e}")
-                db.session.add(log_error)
+@writes.operation('record_upload', on_abandon=_abandon_upload)
+def _record_upload(upload_uuid, name, path, parent_id, blob_id, created_at, expires_at):
+    """
+    Enregistre un fichier assemblé dont le contenu est déjà référencé par son blob.
+    Si le nom a été pris ou le dossier supprimé entre-temps, la référence est rendue et l'échec notifié.
+    """
+    error = None
+    if Item.query.filter_by(path=path).first():
+        error = "Un fichier avec ce nom existe déjà."
+    elif parent_id is not None and not Item.query.filter_by(id=parent_id, item_type='directory',
+                                                           path=os.path.dirname(path)).first():
+        # Comparaison du chemin : l'id d'un dossier supprimé peut avoir été réattribué
+        error = "Le dossier de destination a été supprimé."
+    if error is not None:
+        return _release_upload(upload_uuid, name, parent_id, blob_id, error)
+
+    blob = Blob.query.get(blob_id)
+    new_item = Item(name=name, item_type='file', path=path,
+                    parent_id=parent_id, size_bytes=blob.size_bytes,
+                    stored_size_bytes=blob.stored_size_bytes or blob.size_bytes,
+                    status='processed', sha256=blob.sha256, blob_id=blob.id,
+                    created_at=datetime.fromisoformat(created_at), expires_at=datetime.fromisoformat(expires_at))
+    db.session.add(new_item)
+    child_added(parent_id)
+    file_added(path, blob.size_bytes)
+    log = Log(action="UPLOAD_SUCCESS", details=f"Fichier '{name}' assemblé et checksum calculé.")
+    db.session.add(log)
+
+    def notify():
+        cache.invalidate_paths([path])
+        events.publish(dict(events.item_event('created', new_item), upload_uuid=upload_uuid))
+    return notify
+
+
+@retry_on_busy
+def _expire_batch(now, batch_size):
+    """
+    Supprime un lot de fichiers expirés en une transaction, rejouée si la base est occupée.
+    Retourne les lignes supprimées et les blobs libérés, dont les fichiers restent à effacer.
+    """
+    expired_ids = [row.id for row in db.session.query(Item.id)
+                   .filter(Item.item_type == 'file', Item.expires_at <= now)
+                   .order_by(Item.expires_at.asc())
+                   .limit(batch_size)]
+    if not expired_ids:
+        return [], []
+
+    # RETURNING : seules les lignes réellement supprimées par ce passage libèrent leur contenu
+    deleted_rows = db.session.execute(
+        delete(Item).where(Item.id.in_(expired_ids))
+        .returning(Item.id, Item.path, Item.blob_id, Item.parent_id, Item.size_bytes)
+        .execution_options(synchronize_session=False)
+    ).all()
+    released = release_blobs([row.blob_id for row in deleted_rows])
+    children_removed([row.parent_id for row in deleted_rows])
+    files_removed(deleted_rows)
+    db.session.commit()
+    return deleted_rows, released
+
+
+def _unlink(stored):
+    """Supprime un objet stocké ; retourne un message d'erreur plutôt que de lever une exception."""
+    try:
+        stored.delete()
+    except OSError as e:
+        return f"{stored}: {e}"
+    return None
+
+
+@celery.task(bind=True)
+def delete_expired_files(self):
+    """
+    Supprime les fichiers dont la date d'expiration est dépassée, par lots de EXPIRY_BATCH_SIZE.
+    Chaque lot est validé dans sa propre transaction ; les fichiers sont effacés du stockage ensuite,
+    en parallèle, pour ne jamais garder la base verrouillée pendant les accès disque.
+    """
+    with task_app_context() as app:
+        now = datetime.utcnow()
+        deadline = time.monotonic() + app.config['EXPIRY_TIME_BUDGET_SECONDS']
+        deleted_count = 0
+        batch_count = 0
+        errors = []
+
+        with ThreadPoolExecutor(max_workers=app.config['EXPIRY_UNLINK_WORKERS']) as executor:
+            while time.monotonic() < deadline:
+                batch_started = time.perf_counter()
+                deleted_rows, released = _expire_batch(now, app.config['EXPIRY_BATCH_SIZE'])
+                if not deleted_rows:
+                    break
+                cache.invalidate_paths([row.path for row in deleted_rows])
+                events.publish(*events.removal_events('expired', deleted_rows))
+
+                objects = [legacy_object(row.path) for row in deleted_rows if not row.blob_id]
+                objects.extend(orphan_blob_objects(released))
+                errors.extend(error for error in executor.map(_unlink, objects) if error)
+
+                deleted_count += len(deleted_rows)
+                batch_count += 1
+                EXPIRY_BATCH_SECONDS.observe(time.perf_counter() - batch_started)
+                EXPIRED_FILES.inc(len(deleted_rows))
+                if not self.request.called_directly and not self.request.is_eager:
+                    self.update_state(state='PROGRESS', meta={'deleted': deleted_count, 'batches': batch_count})
+
+        if deleted_count == 0 and not errors:
+            print("Aucun fichier expiré à supprimer.")
+            return "Aucun fichier expiré à supprimer."
 
+        if errors:
+            log_error = Log(action="DELETE_EXPIRED_ERROR",
+                            details=f"{len(errors)} erreur(s) de suppression, ex. : {errors[0]}"[:500])
+            db.session.add(log_error)
         if deleted_count > 0:
-            log_purge = Log(action="AUTO_PURGE", details=f"{deleted_count} fichier(s) expiré(s) supprimé(s).")
+            log_purge = Log(action="AUTO_PURGE",
+                            details=f"{deleted_count} fichier(s) expiré(s) supprimé(s) en {batch_count} lot(s).")
             db.session.add(log_purge)
-
         db.session.commit()
+
         return f"{deleted_count} fichier(s) expiré(s) supprimé(s)."
 
 
 @celery.task
-def cleanup_empty_directories():
-    """Vérifie la configuration et supprime les dossiers vides si nécessaire."""
-    app = create_app()
-    with app.app_context():
-        CONFIG_FILE = os.path.join(os.path.dirname(__file__), '..', 'config.json')
-        persistent_config = {}
-        if os.path.isfile(CONFIG_FILE):
-            with open(CONFIG_FILE, 'r') as f:
-                persistent_config = json.load(f)
-
-        cleanup_hours = persistent_config.get('CLEANUP_EMPTY_FOLDERS_HOURS', app.config['CLEANUP_EMPTY_FOLDERS_HOURS'])
+def cleanup_upload_sessions():
+    """
+    Supprime les sessions d'upload abandonnées (aucun morceau reçu depuis UPLOAD_SESSION_TTL_HOURS heures)
+    et leurs morceaux, en parallèle ; un seul log résume le nettoyage.
+    """
+    with task_app_context() as app:
+        stale_before = time.time() - app.config['UPLOAD_SESSION_TTL_HOURS'] * 3600
+        active, stale = scan_sessions(app.config['UPLOAD_FOLDER'], stale_before)
+        if not stale:
+            return f"Aucune session d'upload abandonnée ({active} active(s))."
+
+        removed = 0
+        reclaimed = 0
+        errors = []
+        with ThreadPoolExecutor(max_workers=app.config['EXPIRY_UNLINK_WORKERS']) as executor:
+            for temp_dir, future in [(path, executor.submit(remove_session, path)) for path in stale]:
+                try:
+                    reclaimed += future.result()
+                    removed += 1
+                except OSError as e:
+                    errors.append(f"{os.path.basename(temp_dir)}: {e}")
+        UPLOAD_SESSIONS_REMOVED.inc(removed)
+        UPLOAD_SESSION_BYTES_RECLAIMED.inc(reclaimed)
+
+        details = f"{removed} session(s) d'upload abandonnée(s) supprimée(s), {sizeof_fmt(reclaimed)} libéré(s)."
+        if errors:
+            details += f" {len(errors)} erreur(s), ex. : {errors[0]}"
+        db.session.add(Log(action="UPLOAD_SESSION_CLEANUP", details=details[:500]))
+        db.session.commit()
+        return details
+
+
+def _remove_empty_directories(upload_folder, batch_size=500):
+    """
+    Supprime les dossiers dont le compteur d'enfants est à zéro, par lots et en une requête indexée par lot.
+    Un dossier vidé par la suppression de ses sous-dossiers est traité au tour suivant.
+    """
+    deleted_paths = []
+    while True:
+        empty_ids = select(Item.id).where(Item.item_type == 'directory', Item.child_count == 0).limit(batch_size)
+        deleted_rows = db.session.execute(
+            delete(Item).where(Item.id.in_(empty_ids), Item.child_count == 0)
+            .returning(Item.id, Item.path, Item.parent_id)
+            .execution_options(synchronize_session=False)
+        ).all()
+        if not deleted_rows:
+            return deleted_paths
+
+        children_removed([row.parent_id for row in deleted_rows])
+        db.session.commit()
+        events.publish(*events.removal_events('deleted', deleted_rows))
+
+        for row in sorted(deleted_rows, key=lambda r: len(r.path), reverse=True):
+            try:
+                os.rmdir(os.path.join(upload_folder, row.path))
+            except FileNotFoundError:
+                pass
+            except OSError as e:
+                print(f"Erreur lors de la suppression de {row.path}: {e}")
+            deleted_paths.append(row.path)
+
+
+def _remove_untracked_empty_directories(upload_folder):
+    """Mode de réconciliation : parcourt le disque pour supprimer les dossiers vides absents de la base."""
+    deleted_paths = []
+    for dirpath, dirnames, filenames in os.walk(upload_folder, topdown=False):
+        if dirpath == upload_folder or os.path.basename(dirpath) == 'tmp':
+            continue
+
+        if not dirnames and not filenames:
+            try:
+                relative_path = os.path.relpath(dirpath, upload_folder).replace('\\', '/')
+                if relative_path.split('/')[0] in ('tmp', BLOB_DIRNAME):
+                    continue
+                # Les fichiers stockés par empreinte n'apparaissent pas dans le dossier physique
+                if Item.query.filter_by(path=relative_path).first():
+                    continue
+
+                os.rmdir(dirpath)
+                deleted_paths.append(relative_path)
+            except OSError as e:
+                print(f"Erreur lors de la suppression de {dirpath}: {e}")
+                continue
+    return deleted_paths
+
+
+@celery.task
+def cleanup_empty_directories(reconcile=None):
+    """
+    Vérifie la configuration et supprime les dossiers vides si nécessaire.
+    Avec `reconcile` (ou CLEANUP_RECONCILE_FILESYSTEM), les compteurs d'enfants sont recalculés
+    et le disque est aussi parcouru à la recherche de dossiers vides non référencés.
+    """
+    with task_app_context() as app:
+        cleanup_hours = get_setting('CLEANUP_EMPTY_FOLDERS_HOURS')
 
         if cleanup_hours == 0:
             return "Nettoyage des dossiers vides désactivé."
@@ -123,27 +336,18 @@ def cleanup_empty_directories():
                         return f"Nettoyage non requis. Prochain passage après {last_run + timedelta(hours=cleanup_hours)}."
 
         upload_folder = app.config['UPLOAD_FOLDER']
-        deleted_folders_paths = []
-
-        for dirpath, dirnames, filenames in os.walk(upload_folder, topdown=False):
-            if dirpath == upload_folder or os.path.basename(dirpath) == 'tmp':
-                continue
-
-            if not dirnames and not filenames:
-                try:
-                    relative_path = os.path.relpath(dirpath, upload_folder).replace('\\', '/')
-                    item_in_db = Item.query.filter_by(path=relative_path, item_type='directory').first()
+        if reconcile is None:
+            reconcile = app.config['CLEANUP_RECONCILE_FILESYSTEM']
+        if reconcile:
+            rebuild_child_counts()
+            db.session.commit()
 
-                    os.rmdir(dirpath)
-                    if item_in_db:
-                        db.session.delete(item_in_db)
-
-                    deleted_folders_paths.append(relative_path)
-                except OSError as e:
-                    print(f"Erreur lors de la suppression de {dirpath}: {e}")
-                    continue
+        deleted_folders_paths = _remove_empty_directories(upload_folder)
+        if reconcile:
+            deleted_folders_paths += _remove_untracked_empty_directories(upload_folder)
 
         if deleted_folders_paths:
+            cache.invalidate_all()
             log_cleanup = Log(action="AUTO_CLEANUP_EMPTY",
                               details=f"{len(deleted_folders_paths)} dossier(s) vide(s) supprimé(s).")
             db.session.add(log_cleanup)
@@ -155,36 +359,173 @@ def cleanup_empty_directories():
         return f"Nettoyage terminé. {len(deleted_folders_paths)} dossier(s) supprimé(s)."
 
 
+@celery.task
+def rebuild_folder_rollups():
+    """Recalcule la taille totale et le nombre de fichiers de tous les dossiers et corrige les écarts."""
+    with task_app_context():
+        started = time.perf_counter()
+        corrected = rebuild_rollups()
+        db.session.commit()
+        if corrected:
+            cache.invalidate_all()
+            log_entry = Log(action="ROLLUP_REPAIR",
+                            details=f"Totaux corrigés pour {corrected} dossier(s) "
+                                    f"en {time.perf_counter() - started:.1f} s.")
+            db.session.add(log_entry)
+            db.session.commit()
+        return f"{corrected} dossier(s) corrigé(s)."
+
+
+def _archive_logs(archive_folder, logs):
+    """Ajoute des logs aux segments d'archive compressés, un fichier par jour."""
+    os.makedirs(archive_folder, exist_ok=True)
+    by_day = {}
+    for log in logs:
+        by_day.setdefault(log.timestamp.date(), []).append(log)
+
+    for day, day_logs in by_day.items():
+        segment = os.path.join(archive_folder, f"logs-{day.isoformat()}.jsonl.gz")
+        # Chaque ajout forme un nouveau membre gzip : le fichier reste lisible d'un seul tenant
+        with gzip.open(segment, 'at', encoding='utf-8') as f:
+            for log in day_logs:
+                f.write(json.dumps({"id": log.id, "timestamp": log.timestamp.isoformat() + 'Z',
+                                    "action": log.action, "details": log.details}) + "\n")
+
+
+@celery.task
+def apply_log_retention(batch_size=5000):
+    """Archive (si activé) puis supprime par lots les logs plus anciens que LOG_RETENTION_DAYS."""
+    with task_app_context() as app:
+        retention_days = app.config['LOG_RETENTION_DAYS']
+        if retention_days <= 0:
+            return "Rétention des logs désactivée."
+
+        cutoff = datetime.utcnow() - timedelta(days=retention_days)
+        deleted_count = 0
+        while True:
+            old_logs = db.session.query(Log.id, Log.timestamp, Log.action, Log.details) \
+                .filter(Log.timestamp < cutoff) \
+                .order_by(Log.timestamp.asc(), Log.id.asc()) \
+                .limit(batch_size).all()
+            if not old_logs:
+                break
+
+            # Le segment est écrit avant la suppression : au pire un log est archivé deux fois, jamais perdu
+            if app.config['LOG_ARCHIVE_ENABLED']:
+                _archive_logs(app.config['LOG_ARCHIVE_FOLDER'], old_logs)
+            db.session.execute(delete(Log).where(Log.id.in_([log.id for log in old_logs])))
+            db.session.commit()
+            deleted_count += len(old_logs)
+
+        if deleted_count:
+            action = "archivé(s) et supprimé(s)" if app.config['LOG_ARCHIVE_ENABLED'] else "supprimé(s)"
+            log_retention = Log(action="LOG_RETENTION",
+                                details=f"{deleted_count} log(s) de plus de {retention_days} jour(s) {action}.")
+            db.session.add(log_retention)
+            db.session.commit()
+        return f"{deleted_count} log(s) traité(s)."
+
+
+@celery.task
+def scrub_files():
+    """
+    Vérifie l'intégrité des fichiers stockés en recalculant leur SHA-256, par lots de SCRUB_BATCH_SIZE
+    hachés en parallèle (SCRUB_WORKERS threads, débit total limité à SCRUB_MAX_MB_PER_SECOND).
+    Le passage reprend là où le précédent s'est arrêté (point de reprise dans scrub_state.json) ;
+    un contenu absent ou corrompu passe ses items en statut 'error'. Un seul log résume chaque passage.
+    """
+    with task_app_context() as app:
+        deadline = time.monotonic() + app.config['SCRUB_TIME_BUDGET_SECONDS']
+        workers = app.config['SCRUB_WORKERS']
+        buffer_size = app.config['SCRUB_READ_BUFFER_MB'] * 1024 * 1024
+        # Le débit maximal est réparti entre les threads de lecture
+        bytes_per_second = app.config['SCRUB_MAX_MB_PER_SECOND'] * 1024 * 1024 / workers
+
+        state = scrub.load_state(app)
+        if state is None or state['finished_at']:
+            state = scrub.new_pass(app.config['SCRUB_REVERIFY_DAYS'])
+        cutoff = datetime.fromisoformat(state['cutoff'])
+
+        finished = False
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            while time.monotonic() < deadline:
+                targets = scrub.next_batch(cutoff, app.config['SCRUB_BATCH_SIZE'])
+                if not targets:
+                    finished = True
+                    break
+                futures = {key: executor.submit(scrub.hash_stored_file, target['source'], target['codec'],
+                                                buffer_size, bytes_per_second)
+                           for key, target in targets.items()}
+                failures = state['mismatch_count'] + state['missing_count']
+                results = {}
+                for key, future in futures.items():
+                    try:
+                        results[key] = future.result()
+                    except Exception as e:
+                        # Lecture impossible (droits, erreur S3...) : compté comme absent, le passage continue
+                        app.logger.warning(f"Vérification de '{targets[key]['path']}' impossible: {e}")
+                        results[key] = (None, 0)
+                scrub.record_results(state, targets, results)
+                db.session.commit()
+                if state['mismatch_count'] + state['missing_count'] > failures:
+                    # Des fichiers sont passés en statut 'error' : leurs dossiers ne sont pas connus ici
+                    cache.invalidate_all()
+                scrub.save_state(app, state)
+
+        if finished and state['files_checked'] == 0:
+            # Rien à revérifier : le rapport du passage précédent est conservé
+            return "Aucun fichier à vérifier."
+        if finished:
+            state['finished_at'] = datetime.utcnow().isoformat()
+            scrub.save_state(app, state)
+            action = "SCRUB_ERROR" if state['mismatch_count'] or state['missing_count'] else "SCRUB_REPORT"
+            db.session.add(Log(action=action, details=scrub.report_summary(state)[:500]))
+            db.session.commit()
+            return scrub.report_summary(state)
+        return f"Vérification interrompue (durée maximale atteinte) : {state['files_checked']} contenu(s) vérifié(s)."
+
+
 @celery.task
 def process_file_checksum(item_id):
     """
-    Cette tâche n'est plus utilisée dans le flux d'upload,
-    mais peut être conservée pour des recalculs manuels futurs.
+    Recalcule le checksum d'un fichier à partir de son contenu stocké.
+    Cette tâche n'est plus utilisée dans le flux d'upload (voir scrub_files pour la vérification
+    périodique), mais peut être conservée pour des recalculs manuels.
     """
-    app = create_app()
-    with app.app_context():
+    with task_app_context() as app:
         item_record = Item.query.get(item_id)
         if not item_record or item_record.item_type != 'file':
             return
 
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], item_record.path)
-
-        try:
-            sha256_hash = hashlib.sha256()
-            with open(filepath, "rb") as f:
-                for byte_block in iter(lambda: f.read(4096), b""):
-                    sha256_hash.update(byte_block)
-
-            item_record.sha256 = sha256_hash.hexdigest()
-            item_record.status = 'processed'
-
-            log_entry = Log(action="CHECKSUM_CALCULATED", details=f"Checksum pour '{item_record.path}' recalculé.")
-            db.session.add(log_entry)
-
-        except FileNotFoundError:
-            item_record.status = 'error'
-            log_entry = Log(action="CHECKSUM_ERROR", details=f"Fichier '{item_record.path}' non trouvé.")
-            db.session.add(log_entry)
-
-        finally:
-            db.session.commit()
\ No newline at end of file
+        digest, _ = scrub.hash_stored_file(item_object(item_record), item_codec(item_record),
+                                           app.config['SCRUB_READ_BUFFER_MB'] * 1024 * 1024)
+        writes.submit('record_checksum', item_id=item_id, digest=digest, verified_at=datetime.utcnow().isoformat())
+
+
+@writes.operation('record_checksum')
+def _record_checksum(item_id, digest, verified_at):
+    """Enregistre le résultat d'un recalcul de checksum (`digest` None : contenu introuvable)."""
+    item_record = Item.query.get(item_id)
+    if item_record is None:
+        # Fichier supprimé pendant le calcul
+        return None
+    if digest is None:
+        item_record.status = 'error'
+        log_entry = Log(action="CHECKSUM_ERROR", details=f"Fichier '{item_record.path}' non trouvé.")
+    elif item_record.blob_id and digest != item_record.blob.sha256:
+        # L'empreinte d'un blob est sa clé dans le stockage : un contenu corrompu n'est jamais réindexé
+        item_record.status = 'error'
+        item_record.verified_at = datetime.fromisoformat(verified_at)
+        log_entry = Log(action="CHECKSUM_ERROR", details=f"Contenu de '{item_record.path}' corrompu.")
+    else:
+        if not item_record.blob_id:
+            item_record.sha256 = digest
+        item_record.status = 'processed'
+        item_record.verified_at = datetime.fromisoformat(verified_at)
+        log_entry = Log(action="CHECKSUM_CALCULATED", details=f"Checksum pour '{item_record.path}' recalculé.")
+    db.session.add(log_entry)
+
+    def notify():
+        cache.invalidate_folders([item_record.parent_id])
+        events.publish(events.item_event('updated', item_record))
+    return notify
@@ -0,0 +1,129 @@
+import posixpath
+from collections import Counter
+from sqlalchemy import case, func, select, update
+from sqlalchemy.orm import aliased
+from . import db
+from .models import Item
+
+
+def adjust_child_counts(deltas):
+    """
+    Applique des variations du nombre d'enfants directs des dossiers, sans commit.
+    `deltas` associe un parent_id à une variation ; la racine (None) est ignorée.
+    """
+    for parent_id, delta in deltas.items():
+        if parent_id is None or delta == 0:
+            continue
+        Item.query.filter_by(id=parent_id).update({Item.child_count: Item.child_count + delta},
+                                                  synchronize_session=False)
+
+
+def child_added(parent_id):
+    """Compte un nouvel enfant direct dans un dossier."""
+    adjust_child_counts({parent_id: 1})
+
+
+def children_removed(parent_ids):
+    """Décompte les enfants supprimés, donnés par la liste de leurs parent_id (avec répétitions)."""
+    adjust_child_counts({parent_id: -count for parent_id, count in Counter(parent_ids).items()})
+
+
+def rebuild_child_counts():
+    """Recalcule tous les compteurs d'enfants à partir de la base (réparation et migration)."""
+    child = aliased(Item)
+    count = select(func.count(child.id)).where(child.parent_id == Item.id).scalar_subquery()
+    Item.query.update({Item.child_count: count}, synchronize_session=False)
+
+
+def contribution(item):
+    """Part d'un item dans les totaux de ses dossiers parents : (octets, nombre de fichiers)."""
+    if item.item_type == 'file':
+        return item.size_bytes or 0, 1
+    return item.total_size_bytes or 0, item.file_count or 0
+
+
+def adjust_rollups(changes):
+    """
+    Applique des variations de taille totale et de nombre de fichiers aux dossiers parents, sans commit.
+    `changes` : couples (chemin d'un item, (octets, fichiers)) ; chaque variation est reportée sur tous les
+    dossiers contenant cet item, retrouvés par les préfixes de son chemin (un UPDATE par dossier concerné).
+    """
+    deltas = {}
+    for path, (size, files) in changes:
+        folder = posixpath.dirname(path)
+        while folder:
+            total_size, total_files = deltas.get(folder, (0, 0))
+            deltas[folder] = (total_size + size, total_files + files)
+            folder = posixpath.dirname(folder)
+
+    for folder, (size, files) in deltas.items():
+        if size == 0 and files == 0:
+            continue
+        Item.query.filter(Item.path == folder, Item.item_type == 'directory').update(
+            {Item.total_size_bytes: Item.total_size_bytes + size, Item.file_count: Item.file_count + files},
+            synchronize_session=False)
+
+
+def file_added(path, size_bytes):
+    """Compte un nouveau fichier dans tous les dossiers qui le contiennent."""
+    adjust_rollups([(path, (size_bytes or 0, 1))])
+
+
+def items_removed(items):
+    """Retire des totaux des dossiers parents les items supprimés (fichiers ou dossiers entiers)."""
+    changes = []
+    for item in items:
+        size, files = contribution(item)
+        changes.append((item.path, (-size, -files)))
+    adjust_rollups(changes)
+
+
+def files_removed(rows):
+    """Retire des totaux les fichiers supprimés, donnés par des lignes ayant `path` et `size_bytes`."""
+    adjust_rollups([(row.path, (-(row.size_bytes or 0), -1)) for row in rows])
+
+
+def items_moved(moves):
+    """
+    Reporte le déplacement d'items, donnés par des couples (item, ancien chemin) : leur part est retirée des
+    anciens dossiers parents et ajoutée aux nouveaux (un renommage sur place ne modifie aucun total).
+    """
+    changes = []
+    for item, old_path in moves:
+        size, files = contribution(item)
+        changes += [(old_path, (-size, -files)), (item.path, (size, files))]
+    adjust_rollups(changes)
+
+
+def rebuild_rollups(batch_size=5000):
+    """
+    Recalcule la taille totale et le nombre de fichiers de tous les dossiers (réparation et migration),
+    en un seul parcours des fichiers cumulé en mémoire, sans commit.
+    Seuls les dossiers dont les totaux étaient faux sont réécrits ; retourne leur nombre.
+    """
+    directories = db.session.query(Item.id, Item.path, Item.total_size_bytes, Item.file_count) \
+        .filter(Item.item_type == 'directory').all()
+    totals = {row.path: (0, 0) for row in directories}
+    files = db.session.query(Item.path, Item.size_bytes).filter(Item.item_type == 'file') \
+        .execution_options(yield_per=batch_size)
+    for row in files:
+        folder = posixpath.dirname(row.path)
+        while folder:
+            if folder in totals:
+                size, count = totals[folder]
+                totals[folder] = (size + (row.size_bytes or 0), count + 1)
+            folder = posixpath.dirname(folder)
+
+    corrections = [{"id": row.id, "total_size_bytes": totals[row.path][0], "file_count": totals[row.path][1]}
+                   for row in directories if (row.total_size_bytes, row.file_count) != totals[row.path]]
+    for start in range(0, len(corrections), batch_size):
+        db.session.execute(update(Item), corrections[start:start + batch_size])
+    return len(corrections)
+
+
+def usage_totals():
+    """Taille totale et nombre de fichiers de tout le stockage, lus sur les seuls éléments de la racine."""
+    size = func.sum(case((Item.item_type == 'file', Item.size_bytes), else_=Item.total_size_bytes))
+    files = func.sum(case((Item.item_type == 'file', 1), else_=Item.file_count))
+    total_size, file_count = db.session.query(size, files).filter(Item.parent_id.is_(None)).one()
+    return total_size or 0, file_count or 0
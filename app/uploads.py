@@ -0,0 +1,267 @@
+import os
+import json
+import shutil
+import hashlib
+import threading
+from datetime import datetime
+from collections import OrderedDict
+from werkzeug.utils import secure_filename
+
+# Fichier final en cours de construction, écrit morceau par morceau à sa position
+PART_FILENAME = 'data.part'
+# Métadonnées de la session d'upload (nombre de morceaux, taille totale, nom du fichier)
+SESSION_FILENAME = 'session.json'
+# Un fichier vide par morceau entièrement reçu
+RECEIVED_DIRNAME = 'received'
+# Créé une seule fois, par la requête qui complète l'ensemble des morceaux
+ASSEMBLY_LOCK_FILENAME = '.assembling'
+# Taille des blocs lus/écrits : la mémoire utilisée ne dépend plus de CHUNK_SIZE_MB
+COPY_BUFFER_SIZE = 1024 * 1024
+# Préfixe d'une session abandonnée en cours de suppression (secure_filename() ne produit jamais de nom en '.')
+TRASH_PREFIX = '.trash-'
+# Nombre maximal d'états SHA-256 conservés en mémoire par processus
+MAX_TRACKED_HASHES = 64
+
+# uuid d'upload -> (objet sha256, offset jusqu'auquel les données ont été hachées)
+_hash_states = OrderedDict()
+_hash_lock = threading.Lock()
+
+
+def session_dir(upload_folder, upload_uuid):
+    """Retourne le dossier temporaire associé à un upload."""
+    return os.path.join(upload_folder, 'tmp', secure_filename(upload_uuid))
+
+
+def part_path(temp_dir):
+    """Retourne le chemin du fichier partiel d'un upload."""
+    return os.path.join(temp_dir, PART_FILENAME)
+
+
+def open_session(temp_dir, total_chunks, total_size, filename):
+    """Crée la session d'upload si elle n'existe pas encore (plusieurs morceaux peuvent arriver en même temps)."""
+    session_file = os.path.join(temp_dir, SESSION_FILENAME)
+    if os.path.exists(session_file):
+        return
+    os.makedirs(os.path.join(temp_dir, RECEIVED_DIRNAME), exist_ok=True)
+    metadata = {
+        'total_chunks': total_chunks,
+        'total_size': total_size,
+        'filename': filename,
+        'created_at': datetime.utcnow().isoformat()
+    }
+    tmp_file = f"{session_file}.{os.getpid()}.{threading.get_ident()}"
+    with open(tmp_file, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp_file, session_file)
+
+
+def load_session(temp_dir):
+    """Retourne les métadonnées d'une session d'upload, ou None si elle n'existe pas."""
+    try:
+        with open(os.path.join(temp_dir, SESSION_FILENAME), 'r') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def mark_chunk_received(temp_dir, chunk_index):
+    """Marque un morceau comme entièrement écrit et met à jour la date de dernière activité de la session."""
+    received_dir = os.path.join(temp_dir, RECEIVED_DIRNAME)
+    os.makedirs(received_dir, exist_ok=True)
+    open(os.path.join(received_dir, str(chunk_index)), 'w').close()
+    try:
+        os.utime(os.path.join(temp_dir, SESSION_FILENAME))
+    except FileNotFoundError:
+        pass
+
+
+def last_activity(temp_dir):
+    """
+    Date (timestamp) de la dernière activité d'une session : dernier morceau reçu (date de modification
+    de session.json) ou début de l'assemblage ; à défaut, date de modification du dossier.
+    """
+    times = []
+    for name in (SESSION_FILENAME, ASSEMBLY_LOCK_FILENAME):
+        try:
+            times.append(os.stat(os.path.join(temp_dir, name)).st_mtime)
+        except FileNotFoundError:
+            pass
+    if not times:
+        times.append(os.stat(temp_dir).st_mtime)
+    return max(times)
+
+
+def disk_usage(path):
+    """Espace réellement occupé sur le disque par un dossier (fichiers préalloués compris)."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_blocks * 512
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def scan_sessions(upload_folder, stale_before):
+    """
+    Parcourt les sessions d'upload ; retourne (nombre de sessions actives, chemins des sessions abandonnées),
+    une session étant abandonnée si sa dernière activité précède le timestamp `stale_before`.
+    Les restes d'un nettoyage interrompu (dossiers TRASH_PREFIX) sont comptés parmi les abandonnées.
+    """
+    active = 0
+    stale = []
+    try:
+        entries = list(os.scandir(os.path.join(upload_folder, 'tmp')))
+    except FileNotFoundError:
+        return 0, []
+    for entry in entries:
+        if not entry.is_dir(follow_symlinks=False):
+            continue
+        try:
+            abandoned = entry.name.startswith(TRASH_PREFIX) or last_activity(entry.path) < stale_before
+        except FileNotFoundError:
+            # Session terminée (assemblée) pendant le parcours
+            continue
+        if abandoned:
+            stale.append(entry.path)
+        else:
+            active += 1
+    return active, stale
+
+
+def remove_session(temp_dir):
+    """
+    Supprime une session abandonnée ; retourne l'espace libéré en octets.
+    Le dossier est d'abord renommé : un morceau arrivant malgré tout ouvre une nouvelle session
+    au lieu d'écrire dans un dossier en cours de suppression.
+    """
+    name = os.path.basename(temp_dir)
+    if not name.startswith(TRASH_PREFIX):
+        trash_dir = os.path.join(os.path.dirname(temp_dir), f"{TRASH_PREFIX}{name}")
+        os.rename(temp_dir, trash_dir)
+        temp_dir = trash_dir
+    reclaimed = disk_usage(temp_dir)
+    shutil.rmtree(temp_dir, ignore_errors=True)
+    return reclaimed
+
+
+def received_chunks(temp_dir):
+    """Retourne l'ensemble des index de morceaux déjà reçus."""
+    try:
+        return {int(name) for name in os.listdir(os.path.join(temp_dir, RECEIVED_DIRNAME)) if name.isdigit()}
+    except FileNotFoundError:
+        return set()
+
+
+def missing_chunks(temp_dir, total_chunks):
+    """Retourne la liste triée des index de morceaux encore attendus."""
+    received = received_chunks(temp_dir)
+    return [i for i in range(total_chunks) if i not in received]
+
+
+def is_assembling(temp_dir):
+    """Indique si l'assemblage de l'upload a déjà été déclenché."""
+    return os.path.exists(os.path.join(temp_dir, ASSEMBLY_LOCK_FILENAME))
+
+
+def claim_assembly(temp_dir, total_chunks):
+    """
+    Retourne True pour une seule requête, celle qui constate que tous les morceaux sont arrivés.
+    Les morceaux pouvant arriver dans le désordre, le dernier reçu n'est pas forcément le dernier index.
+    """
+    if len(received_chunks(temp_dir)) < total_chunks:
+        return False
+    try:
+        fd = os.open(os.path.join(temp_dir, ASSEMBLY_LOCK_FILENAME), os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+    except FileExistsError:
+        return False
+    os.close(fd)
+    return True
+
+
+def release_assembly(temp_dir):
+    """Annule un claim_assembly() dont l'assemblage n'a pas pu être lancé : un nouvel envoi pourra le relancer."""
+    try:
+        os.remove(os.path.join(temp_dir, ASSEMBLY_LOCK_FILENAME))
+    except FileNotFoundError:
+        pass
+
+
+def _preallocate(fd, total_size):
+    """Réserve l'espace du fichier final pour éviter la fragmentation."""
+    if os.fstat(fd).st_size >= total_size:
+        return
+    try:
+        os.posix_fallocate(fd, 0, total_size)
+    except (AttributeError, OSError):
+        os.ftruncate(fd, total_size)
+
+
+def _claim_hasher(upload_uuid, offset):
+    """Récupère l'état SHA-256 si le morceau reçu est le suivant attendu."""
+    with _hash_lock:
+        state = _hash_states.get(upload_uuid)
+        if state and state[1] == offset:
+            del _hash_states[upload_uuid]
+            return state[0]
+    if offset == 0:
+        return hashlib.sha256()
+    return None
+
+
+def _release_hasher(upload_uuid, hasher, position):
+    """Conserve l'état SHA-256 pour le morceau suivant."""
+    with _hash_lock:
+        _hash_states[upload_uuid] = (hasher, position)
+        _hash_states.move_to_end(upload_uuid)
+        while len(_hash_states) > MAX_TRACKED_HASHES:
+            _hash_states.popitem(last=False)
+
+
+def write_chunk(temp_dir, upload_uuid, stream, offset, total_size=None):
+    """
+    Écrit un morceau directement à sa position dans le fichier partiel.
+    Le SHA-256 avance en même temps lorsque les morceaux arrivent dans l'ordre sur ce processus.
+    """
+    os.makedirs(temp_dir, exist_ok=True)
+    fd = os.open(part_path(temp_dir), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        if total_size:
+            _preallocate(fd, total_size)
+
+        hasher = _claim_hasher(upload_uuid, offset)
+        position = offset
+        for block in iter(lambda: stream.read(COPY_BUFFER_SIZE), b""):
+            view = memoryview(block)
+            while view:
+                written = os.pwrite(fd, view, position)
+                view = view[written:]
+                position += written
+            if hasher:
+                hasher.update(block)
+
+        if hasher:
+            _release_hasher(upload_uuid, hasher, position)
+    finally:
+        os.close(fd)
+
+    return position - offset
+
+
+def pop_digest(upload_uuid, total_size):
+    """Retourne le SHA-256 final s'il a pu être calculé au fil de l'eau, sinon None."""
+    with _hash_lock:
+        state = _hash_states.pop(upload_uuid, None)
+    if state is None or total_size is None or state[1] != total_size:
+        return None
+    return state[0].hexdigest()
+
+
+def hash_file(filepath):
+    """Calcule le SHA-256 d'un fichier par blocs, sans le charger en mémoire."""
+    sha256_hash = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(COPY_BUFFER_SIZE), b""):
+            sha256_hash.update(block)
+    return sha256_hash.hexdigest()
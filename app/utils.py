@@ -1,3 +1,7 @@
+import json
+import base64
+import binascii
+import redis
 from functools import wraps
 from flask import request, jsonify, current_app
 
@@ -9,6 +13,34 @@ def sizeof_fmt(num, suffix="o"):
         num /= 1024.0
     return f"{num:.1f} Y{suffix}"
 
+_redis_clients = {}
+
+
+def get_redis(url=None):
+    """Retourne un client Redis partagé par processus (le pool de connexions est réutilisé)."""
+    url = url or current_app.config['REDIS_URL']
+    client = _redis_clients.get(url)
+    if client is None:
+        client = _redis_clients[url] = redis.Redis.from_url(url, socket_connect_timeout=2, socket_timeout=5)
+    return client
+
+
+def encode_cursor(values):
+    """Encode la position d'une pagination par curseur (valeurs de tri du dernier élément renvoyé)."""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Décode un curseur produit par encode_cursor ; lève ValueError s'il est invalide."""
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (binascii.Error, UnicodeDecodeError, json.JSONDecodeError) as e:
+        raise ValueError("curseur invalide") from e
+    if not isinstance(values, list):
+        raise ValueError("curseur invalide")
+    return values
+
+
 def admin_required(f):
     """Décorateur pour sécuriser une route avec un mot de passe admin."""
     @wraps(f)
@@ -0,0 +1,80 @@
+import os
+import time
+from contextlib import contextmanager
+from celery import current_task
+from celery.signals import worker_process_init, worker_process_shutdown, task_prerun, task_postrun
+from celery.utils.log import get_task_logger
+from . import db, create_app, writes
+from .metrics import TASK_SECONDS
+
+logger = get_task_logger(__name__)
+
+# Application Flask résidente : une par processus worker, réutilisée par toutes les tâches
+_state = {'app': None, 'pid': None}
+# Mesures de la tâche en cours, par identifiant de tâche
+_timings = {}
+
+
+def get_worker_app():
+    """Retourne l'application Flask du processus courant, créée au premier appel uniquement."""
+    pid = os.getpid()
+    if _state['app'] is None or _state['pid'] != pid:
+        _state['app'] = create_app()
+        _state['pid'] = pid
+    return _state['app']
+
+
+@contextmanager
+def task_app_context():
+    """
+    Contexte d'application pour une tâche Celery, sur l'application résidente du worker.
+    Le temps de mise en place (coût fixe par tâche) est mesuré et journalisé avec la durée de la tâche.
+    """
+    started = time.perf_counter()
+    app = get_worker_app()
+    with app.app_context():
+        request = current_task.request if current_task else None
+        if request is not None and request.id in _timings:
+            _timings[request.id]['setup_ms'] = (time.perf_counter() - started) * 1000
+        yield app
+
+
+@worker_process_init.connect
+def _init_worker_process(**kwargs):
+    """
+    Après le fork d'un worker : crée son application et abandonne les connexions héritées du parent.
+    Avec la file d'écriture unique, chaque worker est prêt à l'appliquer, un seul à la fois le faisant.
+    """
+    app = get_worker_app()
+    with app.app_context():
+        db.engine.dispose(close=False)
+        if app.config['DB_WRITE_QUEUE_ENABLED']:
+            writes.ensure_writer()
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**kwargs):
+    """Ferme proprement les connexions du pool à l'arrêt du worker."""
+    app = _state['app']
+    if app is not None and _state['pid'] == os.getpid():
+        with app.app_context():
+            db.engine.dispose()
+
+
+@task_prerun.connect
+def _start_task_timer(task_id=None, **kwargs):
+    _timings[task_id] = {'started': time.perf_counter(), 'setup_ms': None}
+
+
+@task_postrun.connect
+def _log_task_duration(task_id=None, task=None, state=None, **kwargs):
+    timing = _timings.pop(task_id, None)
+    if timing is None:
+        return
+    duration_ms = (time.perf_counter() - timing['started']) * 1000
+    TASK_SECONDS.labels(task.name, state or 'UNKNOWN').observe(duration_ms / 1000)
+    if timing['setup_ms'] is None:
+        logger.info(f"Tâche {task.name} ({state}) : {duration_ms:.1f} ms")
+    else:
+        logger.info(f"Tâche {task.name} ({state}) : {duration_ms:.1f} ms, "
+                    f"dont {timing['setup_ms']:.2f} ms de mise en place")
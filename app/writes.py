@@ -0,0 +1,216 @@
+import os
+import json
+import time
+import threading
+from flask import current_app
+from redis.exceptions import LockError
+from . import db
+from .database import is_busy
+from .metrics import DB_QUEUED_WRITES
+from .utils import get_redis
+
+# File Redis des écritures différées, partagée par tous les processus (web et Celery)
+WRITE_QUEUE_KEY = 'dropzone:writes'
+# Verrou Redis désignant le seul processus qui applique la file à un instant donné
+WRITER_LOCK_KEY = 'dropzone:writes:lock'
+# Validité du verrou, prolongée à chaque lot : un processus arrêté en cours d'écriture le libère après ce délai
+WRITER_LOCK_SECONDS = 30
+
+_lock = threading.Lock()
+_wakeup = threading.Event()
+_operations = {}
+_abandon_handlers = {}
+_state = {'app': None, 'writer_pid': None}
+_stats = {'submitted': 0, 'applied': 0, 'failed': 0, 'requeued': 0, 'batches': 0, 'last_batch_ms': None}
+
+
+def init_app(app):
+    """Mémorise l'application utilisée par le thread d'écriture en arrière-plan."""
+    _state['app'] = app
+
+
+def operation(name, on_abandon=None):
+    """
+    Déclare une écriture pouvant passer par la file : la fonction décorée applique ses changements à la session
+    sans les valider et peut retourner une fonction à appeler une fois la transaction validée
+    (invalidation du cache, notifications). Ses arguments doivent être sérialisables en JSON.
+    `on_abandon`, appelée avec les mêmes arguments dans sa propre transaction si l'écriture différée échoue
+    pour une autre raison qu'une base occupée, rend ce que l'appelant avait réservé pour elle ; elle peut
+    elle aussi retourner une fonction d'après commit.
+    """
+    def register(func):
+        _operations[name] = func
+        if on_abandon is not None:
+            _abandon_handlers[name] = on_abandon
+        return func
+    return register
+
+
+def submit(name, /, **kwargs):
+    """
+    Applique une écriture déclarée par operation().
+    - DB_WRITE_QUEUE_ENABLED=false (ou Redis indisponible) : immédiatement, avec les modifications en cours
+      de l'appelant, dans une seule transaction ;
+    - sinon : les modifications en cours sont validées, puis l'écriture est ajoutée à la file Redis, appliquée par
+      un seul processus à la fois, par lots de DB_WRITE_QUEUE_BATCH_SIZE validés chacun en une transaction.
+    """
+    if current_app.config['DB_WRITE_QUEUE_ENABLED']:
+        ensure_writer()
+        db.session.commit()
+        try:
+            get_redis().rpush(WRITE_QUEUE_KEY, json.dumps({'op': name, 'args': kwargs}))
+        except Exception as e:
+            current_app.logger.warning(f"File d'écriture indisponible, écriture immédiate: {e}")
+        else:
+            with _lock:
+                _stats['submitted'] += 1
+            _wakeup.set()
+            return
+
+    after_commit = _operations[name](**kwargs)
+    db.session.commit()
+    if after_commit is not None:
+        after_commit()
+
+
+def _apply(writes):
+    """Applique des écritures dans une seule transaction ; retourne leurs fonctions d'après commit."""
+    callbacks = [_operations[write['op']](**write['args']) for write in writes]
+    db.session.commit()
+    return [callback for callback in callbacks if callback is not None]
+
+
+def _abandon(write):
+    """Annule les réservations d'une écriture abandonnée ; retourne ses fonctions d'après commit."""
+    handler = _abandon_handlers.get(write['op'])
+    if handler is None:
+        return []
+    try:
+        callback = handler(**write['args'])
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Annulation de l'écriture différée '{write['op']}' impossible: {e}")
+        return []
+    return [callback] if callback is not None else []
+
+
+def _requeue(raw_writes):
+    """Remet des écritures en tête de file, dans leur ordre d'origine."""
+    get_redis().lpush(WRITE_QUEUE_KEY, *reversed(raw_writes))
+    DB_QUEUED_WRITES.labels('requeued').inc(len(raw_writes))
+    with _lock:
+        _stats['requeued'] += len(raw_writes)
+
+
+def _apply_batch(raw_writes):
+    """
+    Applique un lot d'écritures ; retourne False si la base est occupée (le lot est alors remis en file).
+    Si une écriture échoue pour une autre raison, le lot est rejoué écriture par écriture pour ne perdre qu'elle,
+    dont les réservations sont alors rendues (voir operation()).
+    """
+    writes = [json.loads(raw) for raw in raw_writes]
+    try:
+        callbacks = _apply(writes)
+        failed = 0
+    except Exception as e:
+        db.session.rollback()
+        if is_busy(e):
+            _requeue(raw_writes)
+            return False
+        callbacks = []
+        failed = 0
+        for position, write in enumerate(writes):
+            try:
+                callbacks += _apply([write])
+            except Exception as write_error:
+                db.session.rollback()
+                if is_busy(write_error):
+                    _requeue(raw_writes[position:])
+                    return False
+                failed += 1
+                current_app.logger.error(f"Écriture différée '{write['op']}' abandonnée: {write_error}")
+                callbacks += _abandon(write)
+
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            current_app.logger.warning(f"Suite d'une écriture différée en échec: {e}")
+    applied = len(writes) - failed
+    DB_QUEUED_WRITES.labels('applied').inc(applied)
+    DB_QUEUED_WRITES.labels('failed').inc(failed)
+    with _lock:
+        _stats['applied'] += applied
+        _stats['failed'] += failed
+    return True
+
+
+def drain():
+    """
+    Applique la file si aucun autre processus ne le fait déjà ; retourne le nombre d'écritures traitées.
+    Les lots s'enchaînent tant que la file n'est pas vide ; une base occupée interrompt le passage.
+    """
+    batch_size = current_app.config['DB_WRITE_QUEUE_BATCH_SIZE']
+    redis_client = get_redis()
+    writer_lock = redis_client.lock(WRITER_LOCK_KEY, timeout=WRITER_LOCK_SECONDS)
+    if not writer_lock.acquire(blocking=False):
+        return 0
+    processed = 0
+    try:
+        while True:
+            raw_writes = redis_client.lpop(WRITE_QUEUE_KEY, batch_size) or []
+            if not raw_writes:
+                return processed
+            started = time.monotonic()
+            if not _apply_batch(raw_writes):
+                return processed
+            processed += len(raw_writes)
+            with _lock:
+                _stats['batches'] += 1
+                _stats['last_batch_ms'] = round((time.monotonic() - started) * 1000, 2)
+            writer_lock.reacquire()
+    finally:
+        try:
+            writer_lock.release()
+        except LockError:
+            # Verrou expiré pendant un lot : un autre processus a pu prendre le relais
+            pass
+
+
+def _writer_loop():
+    while True:
+        app = _state['app']
+        _wakeup.wait(app.config['DB_WRITE_QUEUE_FLUSH_SECONDS'])
+        _wakeup.clear()
+        with app.app_context():
+            try:
+                drain()
+            except Exception as e:
+                app.logger.error(f"Erreur du thread de la file d'écriture: {e}")
+
+
+def ensure_writer():
+    """Démarre le thread d'écriture une fois par processus (y compris après un fork de gunicorn)."""
+    pid = os.getpid()
+    if _state['writer_pid'] == pid:
+        return
+    with _lock:
+        if _state['writer_pid'] == pid:
+            return
+        _state['writer_pid'] = pid
+    if _state['app'] is None:
+        _state['app'] = current_app._get_current_object()
+    threading.Thread(target=_writer_loop, name='db-writer', daemon=True).start()
+
+
+def get_stats():
+    """Retourne les compteurs de la file d'écriture de ce processus et la longueur de la file partagée."""
+    with _lock:
+        stats = dict(_stats)
+    stats['enabled'] = current_app.config['DB_WRITE_QUEUE_ENABLED']
+    try:
+        stats['queued'] = get_redis().llen(WRITE_QUEUE_KEY)
+    except Exception:
+        stats['queued'] = None
+    return stats
@@ -0,0 +1,466 @@
+"""
+Banc d'essai reproductible de Dropzone : upload par morceaux, assemblage, listing, téléchargement par plages
+et purge des fichiers expirés.
+
+L'application est démarrée localement sur une base SQLite et un dossier d'upload temporaires ; Celery tourne
+soit en mode « eager » (tâches exécutées dans la requête), soit avec un worker local dans un thread
+(broker en mémoire, sans Redis). Les données synthétiques sont générées à partir d'une graine fixe.
+
+Les résultats sont écrits en JSON pour être comparés d'un commit à l'autre :
+
+    python benchmarks/bench.py --scale quick --output avant.json
+    python benchmarks/bench.py --scale quick --output apres.json --compare avant.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from io import BytesIO
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), os.pardir))
+sys.path.insert(0, ROOT)
+
+MIB = 1024 * 1024
+
+# Paramètres par échelle : 'quick' pour une vérification rapide, 'full' pour les mesures de référence
+SCALES = {
+    'quick': {
+        'upload_files': 4, 'upload_file_mb': 8,
+        'list_sizes': [10, 1000, 10000], 'list_repeats': 20,
+        'download_file_mb': 16, 'range_requests': 50, 'range_kb': 1024,
+        'expiry_files': 2000,
+    },
+    'full': {
+        'upload_files': 8, 'upload_file_mb': 64,
+        'list_sizes': [10, 10000, 100000], 'list_repeats': 50,
+        'download_file_mb': 128, 'range_requests': 200, 'range_kb': 1024,
+        'expiry_files': 20000,
+    },
+}
+
+TEXT_WORDS = [b'dropzone', b'fichier', b'dossier', b'upload', b'morceau', b'archive', b'journal', b'stockage',
+              b'2024-01-01', b'{"id": ', b'"name": ', b'</div>', b'<span>', b'\n', b'    ', b'0x1f']
+
+
+def synthetic_bytes(size, rng, kind):
+    """Contenu de test : aléatoire (incompressible) ou texte répétitif (compressible), déterministe par graine."""
+    if kind == 'random':
+        return rng.randbytes(size)
+    parts = []
+    length = 0
+    while length < size:
+        word = TEXT_WORDS[rng.randrange(len(TEXT_WORDS))]
+        parts.append(word)
+        length += len(word) + 1
+    return b' '.join(parts)[:size]
+
+
+def summarize(samples):
+    """Statistiques de latence (millisecondes) d'une série de mesures en secondes."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {'count': 0}
+    p95_index = min(len(ordered) - 1, int(round(0.95 * (len(ordered) - 1))))
+    return {
+        'count': len(ordered),
+        'mean_ms': round(statistics.fmean(ordered) * 1000, 3),
+        'p50_ms': round(statistics.median(ordered) * 1000, 3),
+        'p95_ms': round(ordered[p95_index] * 1000, 3),
+        'min_ms': round(ordered[0] * 1000, 3),
+        'max_ms': round(ordered[-1] * 1000, 3),
+    }
+
+
+def throughput(byte_count, seconds):
+    return round(byte_count / MIB / seconds, 2) if seconds > 0 else None
+
+
+def git_revision():
+    """Commit courant et présence de modifications non validées, pour situer les résultats."""
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                                check=True).stdout.strip()
+        dirty = bool(subprocess.run(['git', 'status', '--porcelain', '--untracked-files=no'], cwd=ROOT,
+                                    capture_output=True, text=True, check=True).stdout.strip())
+    except (OSError, subprocess.CalledProcessError):
+        return {'commit': None, 'dirty': None}
+    return {'commit': commit, 'dirty': dirty}
+
+
+class Bench:
+    """Application de test et utilitaires communs aux scénarios."""
+
+    def __init__(self, workdir, celery_mode, chunk_mb, compression, data_kind, seed, redis_url=None):
+        self.workdir = workdir
+        self.chunk_size = chunk_mb * MIB
+        self.data_kind = data_kind
+        self.rng = random.Random(seed)
+        self.assembly_seconds = {}
+        self._assembly_started = {}
+        self._assembled = {}
+        self._lock = threading.Lock()
+
+        # La configuration doit être surchargée avant la création de toute application (web ou worker)
+        import config
+        config.Config.UPLOAD_FOLDER = os.path.join(workdir, 'uploads')
+        config.Config.DB_FOLDER = os.path.join(workdir, 'database')
+        config.Config.LOG_ARCHIVE_FOLDER = os.path.join(workdir, 'database', 'log_archive')
+        config.Config.SQLALCHEMY_DATABASE_URI = 'sqlite:///' + os.path.join(workdir, 'database', 'app.db')
+        config.Config.STORAGE_COMPRESSION = compression
+        config.Config.EXPIRY_TIME_BUDGET_SECONDS = 3600
+        # Sans --redis-url, ni cache des listings ni événements : le listing mesure list_items et non des lectures
+        # Redis (ou des échecs de connexion), et les résultats restent comparables d'une machine à l'autre
+        config.Config.LIST_CACHE_ENABLED = redis_url is not None
+        config.Config.EVENTS_ENABLED = redis_url is not None
+        config.Config.DB_WRITE_QUEUE_ENABLED = False
+        config.Config.AUDIT_LOG_DURABILITY = 'buffered'
+        if redis_url is not None:
+            config.Config.REDIS_URL = redis_url
+        if celery_mode == 'worker':
+            config.Config.broker_url = 'memory://'
+            config.Config.result_backend = 'cache+memory://'
+
+        from celery.signals import task_prerun, task_postrun
+        from app import create_app, celery, db
+        task_prerun.connect(self._on_task_start, weak=False)
+        task_postrun.connect(self._on_task_end, weak=False)
+
+        self.celery = celery
+        self.db = db
+        self.app = create_app()
+        celery.conf.task_always_eager = celery_mode == 'eager'
+        celery.conf.task_eager_propagates = True
+        self.client = self.app.test_client()
+        self.worker = None
+        if celery_mode == 'worker':
+            from celery.contrib.testing.worker import start_worker
+            self.worker = start_worker(celery, pool='threads', concurrency=2, perform_ping_check=False,
+                                       loglevel='WARNING')
+            self.worker.__enter__()
+
+    def close(self):
+        if self.worker is not None:
+            self.worker.__exit__(None, None, None)
+        # Écrit le journal d'audit en attente avant la suppression éventuelle du dossier de travail
+        from app import audit
+        with self.app.app_context():
+            audit.flush()
+            self.db.engine.dispose()
+
+    # --- Suivi des tâches d'assemblage (signaux Celery, valables en mode eager comme avec un worker) ---
+
+    def _on_task_start(self, task=None, kwargs=None, **extra):
+        if task is not None and task.name.endswith('assemble_chunks'):
+            with self._lock:
+                self._assembly_started[kwargs['upload_uuid']] = time.perf_counter()
+
+    def _on_task_end(self, task=None, kwargs=None, **extra):
+        if task is not None and task.name.endswith('assemble_chunks'):
+            upload_uuid = kwargs['upload_uuid']
+            with self._lock:
+                self.assembly_seconds[upload_uuid] = time.perf_counter() - self._assembly_started.pop(upload_uuid)
+                self._assembled.setdefault(upload_uuid, threading.Event()).set()
+
+    def wait_assembled(self, upload_uuid, timeout=600):
+        with self._lock:
+            event = self._assembled.setdefault(upload_uuid, threading.Event())
+        if not event.wait(timeout):
+            raise RuntimeError(f"Assemblage de {upload_uuid} non terminé après {timeout} s")
+
+    # --- Opérations via l'API ---
+
+    def upload(self, data, filename, parent_id=None):
+        """Envoie un fichier par morceaux comme Dropzone ; retourne ([(durée, octets) par requête], uuid)."""
+        upload_uuid = str(uuid.uuid4())
+        total_chunks = max(1, -(-len(data) // self.chunk_size))
+        durations = []
+        for index in range(total_chunks):
+            chunk = data[index * self.chunk_size:(index + 1) * self.chunk_size]
+            form = {
+                'file': (BytesIO(chunk), filename), 'dzuuid': upload_uuid, 'dzchunkindex': index,
+                'dztotalchunkcount': total_chunks, 'dzchunkbyteoffset': index * self.chunk_size,
+                'dzchunksize': self.chunk_size, 'dztotalfilesize': len(data),
+            }
+            if parent_id is not None:
+                form['parent_id'] = parent_id
+            started = time.perf_counter()
+            response = self.client.post('/api/upload', data=form, content_type='multipart/form-data')
+            durations.append((time.perf_counter() - started, len(chunk)))
+            if response.status_code not in (200, 202):
+                raise RuntimeError(f"Upload refusé ({response.status_code}): {response.get_data(as_text=True)}")
+        return durations, upload_uuid
+
+    def create_directory(self, name, parent_id=None):
+        response = self.client.post('/api/directories', json={'name': name, 'parent_id': parent_id})
+        if response.status_code != 201:
+            raise RuntimeError(f"Création du dossier '{name}' impossible: {response.get_data(as_text=True)}")
+        return response.get_json()
+
+    def find_item(self, name, parent_id=None):
+        with self.app.app_context():
+            from app.models import Item
+            return Item.query.filter_by(name=name, parent_id=parent_id).one().to_dict()
+
+    def insert_items(self, rows):
+        """
+        Insère directement des items en base (arborescences synthétiques de grande taille), puis recalcule
+        les compteurs d'enfants et les totaux des dossiers que les routes tiendraient à jour.
+        """
+        from sqlalchemy import insert
+        from app.models import Item
+        from app.tree import rebuild_child_counts, rebuild_rollups
+        with self.app.app_context():
+            for start in range(0, len(rows), 5000):
+                self.db.session.execute(insert(Item), rows[start:start + 5000])
+            rebuild_child_counts()
+            rebuild_rollups()
+            self.db.session.commit()
+
+
+def bench_upload(bench, params):
+    """Débit des morceaux reçus (hors assemblage) et durée de l'assemblage de chaque fichier."""
+    size = params['upload_file_mb'] * MIB
+    chunks = []
+    assembly = []
+    started = time.perf_counter()
+    for index in range(params['upload_files']):
+        data = synthetic_bytes(size, bench.rng, bench.data_kind)
+        durations, upload_uuid = bench.upload(data, f"upload_{index}.bin")
+        bench.wait_assembled(upload_uuid)
+        assembly.append(bench.assembly_seconds[upload_uuid])
+        # En mode eager, la dernière requête inclut l'assemblage : elle est retirée de la mesure du débit
+        chunks.extend(durations[:-1] if bench.celery.conf.task_always_eager else durations)
+    elapsed = time.perf_counter() - started
+
+    chunk_seconds = [seconds for seconds, _ in chunks]
+    chunks_bytes = sum(size for _, size in chunks)
+    return {
+        'files': params['upload_files'],
+        'file_bytes': size,
+        'chunk_bytes': bench.chunk_size,
+        'chunk_requests': summarize(chunk_seconds),
+        'chunk_throughput_mib_s': throughput(chunks_bytes, sum(chunk_seconds)),
+        'assembly': summarize(assembly),
+        'assembly_throughput_mib_s': throughput(size * len(assembly), sum(assembly)),
+        'end_to_end_throughput_mib_s': throughput(size * params['upload_files'], elapsed),
+    }
+
+
+def bench_listing(bench, params):
+    """Latence du listing d'un dossier (première page et parcours complet) selon son nombre d'enfants."""
+    results = {}
+    now = datetime.utcnow()
+    for children in params['list_sizes']:
+        directory = bench.create_directory(f"list_{children}")
+        rows = [{'name': f"file_{i:07d}.txt", 'item_type': 'file', 'path': f"{directory['path']}/file_{i:07d}.txt",
+                 'parent_id': directory['id'], 'size_bytes': 1024, 'stored_size_bytes': 1024, 'status': 'processed',
+                 'child_count': 0, 'created_at': now, 'expires_at': now + timedelta(days=30)}
+                for i in range(children)]
+        bench.insert_items(rows)
+
+        url = f"/api/items?parent_id={directory['id']}"
+        bench.client.get(url)  # préchauffage (caches SQLite et Flask)
+        first_page = []
+        for _ in range(params['list_repeats']):
+            started = time.perf_counter()
+            response = bench.client.get(url)
+            first_page.append(time.perf_counter() - started)
+            assert response.status_code == 200
+
+        pages = []
+        listed = 0
+        cursor = None
+        walk_started = time.perf_counter()
+        while True:
+            started = time.perf_counter()
+            payload = bench.client.get(url + (f"&cursor={cursor}" if cursor else '')).get_json()
+            pages.append(time.perf_counter() - started)
+            listed += len(payload['items'])
+            cursor = payload['next_cursor']
+            if not cursor:
+                break
+        walk_seconds = time.perf_counter() - walk_started
+        assert listed == children, f"{listed} items listés sur {children}"
+
+        results[str(children)] = {
+            'first_page': summarize(first_page),
+            'all_pages': summarize(pages),
+            'walk_seconds': round(walk_seconds, 4),
+            'walk_items_per_s': round(children / walk_seconds, 1),
+        }
+    return results
+
+
+def bench_download(bench, params):
+    """Débit d'un téléchargement complet et de requêtes par plages à des positions aléatoires."""
+    size = params['download_file_mb'] * MIB
+    data = synthetic_bytes(size, bench.rng, bench.data_kind)
+    _, upload_uuid = bench.upload(data, 'download.bin')
+    bench.wait_assembled(upload_uuid)
+    item = bench.find_item('download.bin')
+    url = '/api' + item['download_url']
+    # Sans Accept-Encoding : le contenu est servi décompressé si le stockage est compressé
+    headers = {'Accept-Encoding': 'identity'}
+
+    started = time.perf_counter()
+    response = bench.client.get(url, headers=headers)
+    body = response.get_data()
+    full_seconds = time.perf_counter() - started
+    assert body == data, "Contenu téléchargé différent du contenu envoyé"
+
+    range_size = params['range_kb'] * 1024
+    ranges = []
+    for _ in range(params['range_requests']):
+        start = bench.rng.randrange(0, size - range_size)
+        request_started = time.perf_counter()
+        response = bench.client.get(url, headers=dict(headers, Range=f"bytes={start}-{start + range_size - 1}"))
+        chunk = response.get_data()
+        ranges.append(time.perf_counter() - request_started)
+        assert response.status_code == 206 and chunk == data[start:start + range_size]
+
+    return {
+        'file_bytes': size,
+        'stored_bytes': item['stored_size_bytes'],
+        'full_seconds': round(full_seconds, 4),
+        'full_throughput_mib_s': throughput(size, full_seconds),
+        'range_bytes': range_size,
+        'range_requests': summarize(ranges),
+        'range_throughput_mib_s': throughput(range_size * len(ranges), sum(ranges)),
+    }
+
+
+def bench_expiry(bench, params):
+    """Débit de la purge des fichiers expirés (suppression en base et sur le disque)."""
+    directory = bench.create_directory('expiry')
+    folder = os.path.join(bench.app.config['UPLOAD_FOLDER'], directory['path'])
+    expired_at = datetime.utcnow() - timedelta(minutes=1)
+    rows = []
+    for i in range(params['expiry_files']):
+        name = f"expired_{i:07d}.txt"
+        with open(os.path.join(folder, name), 'wb') as f:
+            f.write(b'x')
+        rows.append({'name': name, 'item_type': 'file', 'path': f"{directory['path']}/{name}",
+                     'parent_id': directory['id'], 'size_bytes': 1, 'stored_size_bytes': 1, 'status': 'processed',
+                     'child_count': 0, 'created_at': expired_at, 'expires_at': expired_at})
+    bench.insert_items(rows)
+
+    from app.tasks import delete_expired_files
+    started = time.perf_counter()
+    delete_expired_files.delay().get(timeout=3600)
+    seconds = time.perf_counter() - started
+    remaining = len(os.listdir(folder))
+    assert remaining == 0, f"{remaining} fichier(s) expiré(s) encore présents"
+    return {
+        'files': len(rows),
+        'seconds': round(seconds, 4),
+        'files_per_s': round(len(rows) / seconds, 1),
+    }
+
+
+SCENARIOS = {
+    'upload': bench_upload,
+    'listing': bench_listing,
+    'download': bench_download,
+    'expiry': bench_expiry,
+}
+
+
+def flatten(results, prefix=''):
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            yield from flatten(value, name)
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            yield name, value
+
+
+def compare(baseline, current):
+    """Affiche l'écart relatif de chaque mesure par rapport à un fichier de résultats de référence."""
+    before = dict(flatten(baseline['results']))
+    print(f"Comparaison avec {baseline['meta']['git'].get('commit') or '?'} :", file=sys.stderr)
+    for name, value in flatten(current['results']):
+        if name in before and before[name]:
+            change = (value - before[name]) / before[name] * 100
+            print(f"  {name}: {before[name]} -> {value} ({change:+.1f} %)", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', choices=sorted(SCALES), default='quick')
+    parser.add_argument('--scenario', action='append', choices=sorted(SCENARIOS),
+                        help="Scénario à exécuter (répétable) ; tous par défaut")
+    parser.add_argument('--celery', choices=['eager', 'worker'], default='eager',
+                        help="eager : tâches exécutées dans la requête ; worker : worker local dans un thread")
+    parser.add_argument('--chunk-mb', type=int, default=5, help="Taille des morceaux d'upload (Mio)")
+    parser.add_argument('--compression', choices=['', 'zstd'], default='', help="STORAGE_COMPRESSION")
+    parser.add_argument('--data', choices=['random', 'text'], default='random',
+                        help="Contenu synthétique : aléatoire (incompressible) ou texte (compressible)")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--redis-url', help="Active le cache des listings et les événements sur ce serveur Redis "
+                                            "(désactivés par défaut)")
+    parser.add_argument('--workdir', help="Dossier de travail (temporaire et supprimé à la fin par défaut)")
+    parser.add_argument('--output', help="Fichier JSON de résultats (sortie standard par défaut)")
+    parser.add_argument('--compare', help="Fichier JSON de résultats de référence à comparer")
+    args = parser.parse_args()
+
+    os.environ.setdefault('ROLE', 'web')
+    workdir = args.workdir or tempfile.mkdtemp(prefix='dropzone-bench-')
+    os.makedirs(workdir, exist_ok=True)
+    params = SCALES[args.scale]
+    scenarios = args.scenario or list(SCENARIOS)
+
+    bench = Bench(workdir, args.celery, args.chunk_mb, args.compression, args.data, args.seed, args.redis_url)
+    results = {}
+    try:
+        for name in scenarios:
+            print(f"[bench] {name}...", file=sys.stderr)
+            results[name] = SCENARIOS[name](bench, params)
+    finally:
+        bench.close()
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    report = {
+        'meta': {
+            'git': git_revision(),
+            'date': datetime.utcnow().isoformat() + 'Z',
+            'python': platform.python_version(),
+            'sqlite': sqlite3.sqlite_version,
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'scale': args.scale,
+            'params': params,
+            'celery': args.celery,
+            'chunk_mb': args.chunk_mb,
+            'compression': args.compression,
+            'data': args.data,
+            'seed': args.seed,
+            'redis': args.redis_url is not None,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(json.load(f), report)
+
+
+if __name__ == '__main__':
+    main()
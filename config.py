@@ -1,4 +1,5 @@
 import os
+import re
 from dotenv import load_dotenv
 from celery.schedules import crontab
 
@@ -11,12 +12,44 @@ class Config:
 
     UPLOAD_FOLDER = os.path.join(basedir, 'uploads')
     DB_FOLDER = os.path.join(basedir, 'database')
-    SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(DB_FOLDER, 'app.db')
+    # Base de données : SQLite (database/app.db) par défaut, ou PostgreSQL via DATABASE_URL (postgresql://...)
+    SQLALCHEMY_DATABASE_URI = re.sub(r'^postgres://', 'postgresql://',
+                                     os.environ.get('DATABASE_URL') or 'sqlite:///' + os.path.join(DB_FOLDER, 'app.db'))
     SQLALCHEMY_TRACK_MODIFICATIONS = False
+    # Pool de connexions, conservé d'une requête ou d'une tâche à l'autre ; pre_ping écarte les connexions mortes
+    SQLALCHEMY_ENGINE_OPTIONS = {
+        'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+        'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+        'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE_SECONDS', 1800)),
+        'pool_pre_ping': True,
+    }
+    # SQLite : journal WAL (les lectures ne sont jamais bloquées par une écriture), synchronisation allégée
+    # ('normal', sûre en WAL), attente d'un verrou d'écriture jusqu'à SQLITE_BUSY_TIMEOUT_MS, cache et mmap
+    # par connexion
+    SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'wal')
+    SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'normal')
+    SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', 5000))
+    SQLITE_CACHE_SIZE_MB = int(os.environ.get('SQLITE_CACHE_SIZE_MB', 64))
+    SQLITE_MMAP_SIZE_MB = int(os.environ.get('SQLITE_MMAP_SIZE_MB', 256))
+    # Vérification des clés étrangères par SQLite (toujours active sous PostgreSQL)
+    SQLITE_FOREIGN_KEYS = os.environ.get('SQLITE_FOREIGN_KEYS', 'true').lower() == 'true'
+    # Écritures encore refusées pour verrou après ce délai : nouvelles tentatives (purge, file d'écriture),
+    # après une attente de DB_BUSY_RETRY_BASE_MS doublée à chaque fois ; les requêtes HTTP reçoivent un 503
+    DB_BUSY_RETRIES = int(os.environ.get('DB_BUSY_RETRIES', 3))
+    DB_BUSY_RETRY_BASE_MS = int(os.environ.get('DB_BUSY_RETRY_BASE_MS', 100))
+    # File d'écriture unique (optionnelle) : les petites écritures des tâches (enregistrement des fichiers
+    # assemblés, checksums) passent par une file Redis appliquée par un seul processus à la fois, par lots d'au plus
+    # DB_WRITE_QUEUE_BATCH_SIZE validés en une transaction, toutes les DB_WRITE_QUEUE_FLUSH_SECONDS secondes au plus
+    DB_WRITE_QUEUE_ENABLED = os.environ.get('DB_WRITE_QUEUE_ENABLED', 'false').lower() == 'true'
+    DB_WRITE_QUEUE_BATCH_SIZE = int(os.environ.get('DB_WRITE_QUEUE_BATCH_SIZE', 200))
+    DB_WRITE_QUEUE_FLUSH_SECONDS = float(os.environ.get('DB_WRITE_QUEUE_FLUSH_SECONDS', 0.5))
+
+    # Redis : broker Celery et notifications entre processus
+    REDIS_URL = os.environ.get('REDIS_URL', 'redis://redis:6379/0')
 
     # Configuration Celery
-    broker_url = 'redis://redis:6379/0'
-    result_backend = 'redis://redis:6379/0'
+    broker_url = REDIS_URL
+    result_backend = REDIS_URL
 
     ADMIN_PASSWORD = os.environ.get('ADMIN_PASSWORD') or 'admin'
 
@@ -24,13 +57,107 @@ class Config:
     MAX_UPLOAD_MB = int(os.environ.get('MAX_UPLOAD_MB', 8192))
     MAX_CONTENT_LENGTH = MAX_UPLOAD_MB * 1024 * 1024
     CHUNK_SIZE_MB = int(os.environ.get('CHUNK_SIZE_MB', 5))
+    # 'streaming' : chaque morceau est écrit directement à sa place dans le fichier final
+    # 'chunks' : les morceaux sont stockés séparément puis recopiés à la fin (ancien comportement)
+    UPLOAD_ASSEMBLY_MODE = os.environ.get('UPLOAD_ASSEMBLY_MODE', 'streaming')
+    # Une session d'upload sans nouveau morceau depuis ce nombre d'heures est considérée abandonnée
+    # et supprimée de uploads/tmp par la tâche de nettoyage
+    UPLOAD_SESSION_TTL_HOURS = float(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+
+    # Pagination du listing des dossiers (nombre d'items par page)
+    LIST_PAGE_SIZE = int(os.environ.get('LIST_PAGE_SIZE', 200))
+    LIST_MAX_PAGE_SIZE = int(os.environ.get('LIST_MAX_PAGE_SIZE', 1000))
+    # Cache Redis des pages de listing, périmé par un numéro de version de dossier à chaque modification ;
+    # LIST_CACHE_TTL_SECONDS borne la durée de vie d'une page si une invalidation n'a pas pu atteindre Redis
+    LIST_CACHE_ENABLED = os.environ.get('LIST_CACHE_ENABLED', 'true').lower() == 'true'
+    LIST_CACHE_TTL_SECONDS = int(os.environ.get('LIST_CACHE_TTL_SECONDS', 120))
+    # Nombre de résultats par page de recherche
+    SEARCH_PAGE_SIZE = int(os.environ.get('SEARCH_PAGE_SIZE', 50))
+
+    # Stockage compressé des nouveaux contenus : '' (désactivé) ou 'zstd'. Seuls les fichiers d'au moins
+    # STORAGE_COMPRESSION_MIN_BYTES, d'un type non déjà compressé et dont un échantillon se compresse au moins
+    # jusqu'à STORAGE_COMPRESSION_MAX_RATIO de sa taille sont compressés
+    STORAGE_COMPRESSION = os.environ.get('STORAGE_COMPRESSION', '')
+    STORAGE_COMPRESSION_LEVEL = int(os.environ.get('STORAGE_COMPRESSION_LEVEL', 3))
+    STORAGE_COMPRESSION_MIN_BYTES = int(os.environ.get('STORAGE_COMPRESSION_MIN_BYTES', 64 * 1024))
+    STORAGE_COMPRESSION_MAX_RATIO = float(os.environ.get('STORAGE_COMPRESSION_MAX_RATIO', 0.9))
+
+    # Volumes de stockage des contenus, en plus du volume 'default' (UPLOAD_FOLDER/.blobs) : liste 'nom=url'
+    # séparée par des virgules, ex. 'disque2=file:///mnt/disque2,s3=s3://bucket/prefixe?endpoint=http://minio:9000'.
+    # Options : capacity_gb (capacité d'un volume S3), readonly=1 (plus aucun nouveau contenu sur ce volume).
+    # Les nouveaux contenus sont répartis selon l'espace libre et la charge, en gardant STORAGE_MIN_FREE_MB libres
+    STORAGE_VOLUMES = os.environ.get('STORAGE_VOLUMES', '')
+    STORAGE_MIN_FREE_MB = int(os.environ.get('STORAGE_MIN_FREE_MB', 1024))
+
+    # Opérations groupées (suppression, déplacement) : nombre maximal d'éléments par requête et nombre
+    # d'opérations disque menées en parallèle
+    BULK_MAX_ITEMS = int(os.environ.get('BULK_MAX_ITEMS', 5000))
+    BULK_FILESYSTEM_WORKERS = int(os.environ.get('BULK_FILESYSTEM_WORKERS', 8))
+
+    # Compression (deflate) des archives ZIP de dossiers ; désactivée, la taille exacte de l'archive est annoncée
+    ARCHIVE_ZIP_COMPRESS = os.environ.get('ARCHIVE_ZIP_COMPRESS', 'false').lower() == 'true'
+
+    # Délégation du transfert des téléchargements au proxy frontal : '' (désactivé), 'x-accel' (nginx) ou 'x-sendfile'
+    DOWNLOAD_OFFLOAD = os.environ.get('DOWNLOAD_OFFLOAD', '')
+    # Location interne nginx (directive `internal`) dont l'alias pointe sur UPLOAD_FOLDER, pour 'x-accel'
+    X_ACCEL_REDIRECT_PREFIX = os.environ.get('X_ACCEL_REDIRECT_PREFIX', '/protected-uploads')
 
     # Configuration de l'expiration en minutes
     DEFAULT_EXPIRATION_MINUTES = int(os.environ.get('DEFAULT_EXPIRATION_MINUTES', 30 * 24 * 60))
     MAX_EXPIRATION_MINUTES = int(os.environ.get('MAX_EXPIRATION_MINUTES', 365 * 24 * 60))
 
+    # Purge des fichiers expirés : taille des lots (une transaction courte par lot), durée maximale
+    # d'un passage (inférieure à l'intervalle de planification) et suppressions physiques en parallèle
+    EXPIRY_BATCH_SIZE = int(os.environ.get('EXPIRY_BATCH_SIZE', 500))
+    EXPIRY_TIME_BUDGET_SECONDS = int(os.environ.get('EXPIRY_TIME_BUDGET_SECONDS', 50))
+    EXPIRY_UNLINK_WORKERS = int(os.environ.get('EXPIRY_UNLINK_WORKERS', 8))
+
+    # Journal d'audit : 'sync' (commit immédiat), 'buffered' (file en mémoire écrite par lots)
+    # ou 'redis' (file partagée qui survit au redémarrage d'un worker)
+    AUDIT_LOG_DURABILITY = os.environ.get('AUDIT_LOG_DURABILITY', 'buffered')
+    AUDIT_LOG_FLUSH_SECONDS = float(os.environ.get('AUDIT_LOG_FLUSH_SECONDS', 2))
+    AUDIT_LOG_BATCH_SIZE = int(os.environ.get('AUDIT_LOG_BATCH_SIZE', 500))
+    AUDIT_LOG_QUEUE_SIZE = int(os.environ.get('AUDIT_LOG_QUEUE_SIZE', 10000))
+
+    # Rétention des logs : au-delà de LOG_RETENTION_DAYS jours (0 = illimitée), les logs sont supprimés par lots,
+    # après avoir été archivés dans des segments journaliers compressés si LOG_ARCHIVE_ENABLED
+    LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS', 90))
+    LOG_ARCHIVE_ENABLED = os.environ.get('LOG_ARCHIVE_ENABLED', 'true').lower() == 'true'
+    LOG_ARCHIVE_FOLDER = os.path.join(DB_FOLDER, 'log_archive')
+
+    # Vérification périodique de l'intégrité des fichiers stockés : lots de SCRUB_BATCH_SIZE fichiers hachés par
+    # SCRUB_WORKERS threads, débit de lecture total limité à SCRUB_MAX_MB_PER_SECOND Mo/s (0 = illimité),
+    # durée maximale d'un passage (reprise au suivant) ; un fichier n'est revérifié qu'après SCRUB_REVERIFY_DAYS jours
+    SCRUB_BATCH_SIZE = int(os.environ.get('SCRUB_BATCH_SIZE', 200))
+    SCRUB_WORKERS = int(os.environ.get('SCRUB_WORKERS', 4))
+    SCRUB_MAX_MB_PER_SECOND = float(os.environ.get('SCRUB_MAX_MB_PER_SECOND', 100))
+    SCRUB_READ_BUFFER_MB = int(os.environ.get('SCRUB_READ_BUFFER_MB', 8))
+    SCRUB_TIME_BUDGET_SECONDS = int(os.environ.get('SCRUB_TIME_BUDGET_SECONDS', 3 * 3600))
+    SCRUB_REVERIFY_DAYS = int(os.environ.get('SCRUB_REVERIFY_DAYS', 30))
+
+    # Endpoint /metrics (format Prometheus) ; s'il est défini, METRICS_TOKEN doit être fourni en jeton Bearer.
+    # En production multi-processus, PROMETHEUS_MULTIPROC_DIR (variable d'environnement) désigne le dossier partagé
+    METRICS_ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+    METRICS_TOKEN = os.environ.get('METRICS_TOKEN', '')
+
+    # Notifications en temps réel (Server-Sent Events, /api/events) des changements d'un dossier, relayées par
+    # Redis pub/sub : un commentaire toutes les EVENTS_HEARTBEAT_SECONDS secondes, reconnexion du navigateur
+    # après EVENTS_STREAM_MAX_SECONDS (délai EVENTS_RETRY_MS), au plus EVENTS_QUEUE_SIZE événements en attente
+    # par client avant resynchronisation. Chaque flux ouvert occupe un thread gunicorn (worker gthread)
+    EVENTS_ENABLED = os.environ.get('EVENTS_ENABLED', 'true').lower() == 'true'
+    EVENTS_HEARTBEAT_SECONDS = int(os.environ.get('EVENTS_HEARTBEAT_SECONDS', 15))
+    EVENTS_STREAM_MAX_SECONDS = int(os.environ.get('EVENTS_STREAM_MAX_SECONDS', 300))
+    EVENTS_RETRY_MS = int(os.environ.get('EVENTS_RETRY_MS', 3000))
+    EVENTS_QUEUE_SIZE = int(os.environ.get('EVENTS_QUEUE_SIZE', 256))
+
+    # Intervalle (secondes) de vérification de la date de modification de config.json ; les changements
+    # faits depuis le panneau d'administration sont en plus propagés immédiatement via Redis
+    RUNTIME_CONFIG_CHECK_SECONDS = int(os.environ.get('RUNTIME_CONFIG_CHECK_SECONDS', 30))
+
     # Configuration du nettoyage des dossiers vides
     CLEANUP_EMPTY_FOLDERS_HOURS = int(os.environ.get('CLEANUP_EMPTY_FOLDERS_HOURS', 24))
+    # Recalcule les compteurs d'enfants et parcourt aussi le disque (os.walk) lors du nettoyage
+    CLEANUP_RECONCILE_FILESYSTEM = os.environ.get('CLEANUP_RECONCILE_FILESYSTEM', 'false').lower() == 'true'
 
     # Planification des tâches Celery
     beat_schedule = {
@@ -38,8 +165,24 @@ class Config:
             'task': 'app.tasks.delete_expired_files',
             'schedule': crontab(),  # S'exécute chaque minute
         },
+        'cleanup-upload-sessions-hourly': {
+            'task': 'app.tasks.cleanup_upload_sessions',
+            'schedule': crontab(minute=15),  # S'exécute chaque heure
+        },
         'cleanup-empty-folders-scheduler': {
             'task': 'app.tasks.cleanup_empty_directories',
             'schedule': crontab(minute=0),  # S'exécute au début de chaque heure
         },
+        'apply-log-retention-daily': {
+            'task': 'app.tasks.apply_log_retention',
+            'schedule': crontab(hour=3, minute=30),  # S'exécute chaque nuit
+        },
+        'scrub-files-nightly': {
+            'task': 'app.tasks.scrub_files',
+            'schedule': crontab(hour=4, minute=0),  # S'exécute chaque nuit, après la rétention des logs
+        },
+        'rebuild-folder-rollups-weekly': {
+            'task': 'app.tasks.rebuild_folder_rollups',
+            'schedule': crontab(hour=5, minute=0, day_of_week=0),  # S'exécute chaque dimanche
+        },
     }
\ No newline at end of file